@@ -0,0 +1,107 @@
+
+import threading,unittest
+from concurrent.futures import ThreadPoolExecutor
+
+from v6jail.ddns import DDNSConfig
+from v6jail.dnsupdate import DNSUpdateError
+from v6jail.fake import FakeDNSServer
+
+class UpdateQueueTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = FakeDNSServer("example.com")
+        self.server.start()
+        self.ddns = DDNSConfig(server=f"::1 {self.server.port}",zone="example.com",
+                               backend="native",batch_interval=0.05,timeout=2.0)
+
+    def tearDown(self):
+        self.server.close()
+
+    def test_sequential(self):
+        # Each update must complete (worker woken for every new batch)
+        for i in range(3):
+            self.ddns.update(f"add h{i} AAAA 2001:db8::{i+1}")
+        self.assertEqual(self.server.messages,3)
+        self.assertEqual({ n for n in self.server.records if n.startswith("h") },
+                         { f"h{i}.example.com." for i in range(3) })
+
+    def test_concurrent(self):
+        # Concurrent submissions are coalesced into a single message
+        barrier = threading.Barrier(8)
+        def _update(i):
+            barrier.wait()
+            return self.ddns.update(f"add c{i} AAAA 2001:db8::{i+1}")
+        with ThreadPoolExecutor(8) as pool:
+            [*pool.map(_update,range(8))]
+        self.assertLess(self.server.messages,8)
+        self.assertEqual(len([ n for n in self.server.records if n.startswith("c") ]),8)
+        # Queue still usable after batch
+        self.ddns.update("del c0")
+        self.assertNotIn("c0.example.com.",self.server.records)
+
+class TsigTest(unittest.TestCase):
+
+    KEY = "hmac-sha256:ddns-key c2VjcmV0LWtleS1mb3ItdGVzdGluZy0xMjM0NTY3OA=="
+    BADSIG = "hmac-sha256:ddns-key b3RoZXIta2V5LWZvci10ZXN0aW5nLTEyMzQ1Njc4OQ=="
+    BADKEY = "hmac-sha256:other-key c2VjcmV0LWtleS1mb3ItdGVzdGluZy0xMjM0NTY3OA=="
+
+    def setUp(self):
+        self.server = FakeDNSServer("example.com",tsig=self.KEY)
+        self.server.start()
+
+    def tearDown(self):
+        self.server.close()
+
+    def _ddns(self,tsig):
+        return DDNSConfig(server=f"::1 {self.server.port}",zone="example.com",
+                          backend="native",tsig=tsig,batch_interval=0.05,timeout=2.0)
+
+    def test_signed_update(self):
+        self._ddns(self.KEY).update("add s1 AAAA 2001:db8::1")
+        self.assertEqual(self.server.messages,1)
+        self.assertIn("s1.example.com.",self.server.records)
+
+    def test_wrong_key(self):
+        for (tsig,rcode) in ((self.BADSIG,16),(self.BADKEY,17)):
+            with self.subTest(rcode=rcode):
+                with self.assertRaises(DNSUpdateError) as cm:
+                    self._ddns(tsig).update("add w1 AAAA 2001:db8::1")
+                self.assertEqual(cm.exception.rcode,rcode)
+        self.assertEqual(self.server.messages,0)
+        self.assertNotIn("w1.example.com.",self.server.records)
+
+    def test_no_retry_on_tsig_error(self):
+        # Batch rejected with BADSIG is not resent one item at a time
+        ddns = self._ddns(self.BADSIG)
+        client = ddns.client()
+        sent = []
+        send = client.send
+        client.send = lambda rrs: (sent.append(rrs),send(rrs))[1]
+        barrier = threading.Barrier(4)
+        def _update(i):
+            barrier.wait()
+            try:
+                ddns.update(f"add b{i} AAAA 2001:db8::{i+1}")
+            except DNSUpdateError as e:
+                return e.rcode
+        with ThreadPoolExecutor(4) as pool:
+            rcodes = [*pool.map(_update,range(4))]
+        self.assertEqual(rcodes,[16] * 4)
+        self.assertLess(len(sent),4)
+        self.assertEqual(self.server.records,{})
+
+class BackendTest(unittest.TestCase):
+
+    def test_default_nsupdate(self):
+        self.assertEqual(DDNSConfig(zone="example.com").backend,"nsupdate")
+
+    def test_unsupported_type_fallback(self):
+        # Record types the native client can't encode are sent with nsupdate
+        ddns = DDNSConfig(zone="example.com",backend="native")
+        sent = []
+        ddns.nsupdate_update = lambda *cmds: sent.append(cmds)
+        ddns.update("add _sip._tcp SRV 0 5 5060 sip")
+        self.assertEqual(sent,[("add _sip._tcp SRV 0 5 5060 sip",)])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+
+"""
+    Measure decode throughput of stored jail configs (jail:config property)
+    for Host.load_jails (single zfs get, cached codecs) against decoding
+    each config with ConfigParser (Jail.from_config).
+
+    Configs are generated with the fake FreeBSD backend (no datasets are
+    created) so this can run on any host.
+"""
+
+import argparse,io,os,sys,tempfile,time
+
+def best(f,runs):
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        f()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+def main():
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    sys.path.insert(0,root)
+    parser = argparse.ArgumentParser(description='v6 config decode benchmark')
+    parser.add_argument('--count',type=int,default=5000,help='Number of configs')
+    parser.add_argument('--runs',type=int,default=5,help='Runs (best reported)')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ['V6JAIL_EXECUTOR'] = f"fake:{tmp}/state.json"
+        from v6jail.config import HostConfig
+        from v6jail.host import Host
+        from v6jail.jail import Jail
+        from v6jail.jailparam import JailParam
+        from v6jail.config import JailConfig
+        from v6jail.ini_encoder import parse_sections
+
+        host = Host(HostConfig(facts_cache=''))
+        configs = [ host.jail(f"bench-{i}").get_config() for i in range(args.count) ]
+        # Output as returned by Host.load_args() zfs get
+        out = "\n".join(f"{host.config.zvol}/{i:013d}\t{c.rstrip()}" for (i,c) in enumerate(configs))
+
+        def configparser_decode():
+            for c in configs:
+                Jail.from_config(io.StringIO(c))
+
+        def codec_decode():
+            for c in configs:
+                s = parse_sections(c)
+                JailConfig.from_section(s["jail"])
+                JailParam.from_section(s["jail_params"])
+
+        def load_jails():
+            host.decode_jails(out)
+
+        print(f"{'method':24}{'configs':>10}{'time':>10}{'configs/s':>12}")
+        for (name,f) in (("configparser (jails)",configparser_decode),
+                         ("codecs (configs only)",codec_decode),
+                         ("load_jails (jails)",load_jails)):
+            t = best(f,args.runs)
+            print(f"{name:24}{args.count:>10}{t*1000:>8.1f}ms{args.count/t:>12.0f}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+
+"""
+    Measure v6 CLI cold-start time (new process per run) for a set of
+    commands from the source tree and (if built) the shiv zipapp.
+
+    Exits non-zero if the median time for any command exceeds the budget.
+
+    Commands are run against the fake FreeBSD backend by default (--real
+    to run against the host) and never forwarded to v6jaild.
+"""
+
+import argparse,os,statistics,subprocess,sys,tempfile,time
+
+COMMANDS = [ ["--help"], ["list"], ["genconfig","bench"] ]
+
+def run_times(argv,runs,env):
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        proc = subprocess.run(argv,env=env,capture_output=True)
+        times.append(time.perf_counter() - start)
+        if proc.returncode != 0:
+            raise RuntimeError(f"{' '.join(argv)}: {proc.stderr.decode().strip()}")
+    return times
+
+def main():
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    parser = argparse.ArgumentParser(description='v6 startup benchmark')
+    parser.add_argument('--runs',type=int,default=10,help='Runs per command')
+    parser.add_argument('--budget',type=float,
+                        default=float(os.environ.get('V6JAIL_STARTUP_BUDGET',250)),
+                        help='Budget per command (median ms)')
+    parser.add_argument('--shiv',default=os.path.join(root,'bin','v6'),help='Shiv zipapp')
+    parser.add_argument('--python',default=sys.executable,help='Python interpreter')
+    parser.add_argument('--real',action='store_true',help='Run against host (not fake)')
+    args = parser.parse_args()
+
+    env = dict(os.environ,V6JAIL_SOCKET='',PYTHONPATH=root)
+    with tempfile.TemporaryDirectory() as tmp:
+        if not args.real:
+            env['V6JAIL_EXECUTOR'] = f"fake:{tmp}/state.json"
+        targets = [('source',[args.python,'-m','v6jail.cli'])]
+        if os.path.exists(args.shiv):
+            targets.append(('shiv',[args.shiv]))
+        else:
+            print(f"Shiv not found: {args.shiv} (skipping)",file=sys.stderr)
+
+        failed = []
+        print(f"{'target':8}{'command':20}{'min':>10}{'median':>10}{'max':>10}")
+        for (target,prefix) in targets:
+            for c in COMMANDS:
+                times = [ t * 1000 for t in run_times([*prefix,*c],args.runs,env) ]
+                median = statistics.median(times)
+                flag = '' if median <= args.budget else '  OVER BUDGET'
+                print(f"{target:8}{' '.join(c):20}{min(times):>8.1f}ms"
+                      f"{median:>8.1f}ms{max(times):>8.1f}ms{flag}")
+                if flag:
+                    failed.append(f"{target} {' '.join(c)}")
+
+    if failed:
+        print(f"Budget ({args.budget:.0f}ms) exceeded: {', '.join(failed)}",file=sys.stderr)
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
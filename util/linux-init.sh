@@ -11,12 +11,10 @@ set -o pipefail
 set -o errexit
 set -o nounset
 
-ZPATH=${ZPATH-zroot/jail}
 TARGET=${1?Usage: $0 <base>}
-LATEST_BASE=$(zfs list -t snap -Hr -s creation -o name zroot/jail/base | tail -1)
 
-# Create volume
-zfs send -c $LATEST_BASE | zfs recv -v ${ZPATH}/${TARGET}
+# Create volume (or refresh incrementally from latest base snapshot)
+python3 -mv6jail.cli clone-base --progress ${TARGET}
 
 python3 -mv6jail.cli --base ${TARGET} chroot-base --snapshot <<EOM
 
@@ -1,3 +1,10 @@
 
-from .host import Host
-from .jail import Jail
+# Host/Jail are imported on first access (keeps CLI startup cheap)
+def __getattr__(name):
+    if name == "Host":
+        from .host import Host
+        return Host
+    elif name == "Jail":
+        from .jail import Jail
+        return Jail
+    raise AttributeError(f"module 'v6jail' has no attribute '{name}'")
@@ -0,0 +1,218 @@
+
+import asyncio,os,signal,subprocess,time,weakref
+from dataclasses import dataclass
+
+from .util import Command,SubprocessExecutor,get_executor
+from .bulk import BulkResult,_error
+from .host import BaseHost
+from .jail import BaseJail
+
+@dataclass
+class AsyncCommand(Command):
+
+    """
+        asyncio version of Command - cmd/check/nocheck/pipe/stream have
+        the same semantics but are coroutines. Commands are run using
+        asyncio.create_subprocess_exec (non-subprocess executors such as
+        FakeFreeBSD are called directly). Ops are driven as coroutines
+    """
+
+    async def run(self,*args,input=None,capture=True,check=True):
+        executor = self.executor or get_executor()
+        self.count += 1
+        if isinstance(executor,SubprocessExecutor):
+            pipe = asyncio.subprocess.PIPE if capture else None
+            proc = await asyncio.create_subprocess_exec(*args,
+                            stdin=asyncio.subprocess.PIPE if input is not None else None,
+                            stdout=pipe,stderr=pipe)
+            (stdout,stderr) = await proc.communicate(input)
+            result = subprocess.CompletedProcess(args,proc.returncode,stdout,stderr)
+        else:
+            result = executor.run(args,input=input,capture=capture)
+        if check and result.returncode != 0:
+            raise subprocess.CalledProcessError(result.returncode,args,
+                                                result.stdout,result.stderr)
+        return result
+
+    async def cmd(self,*args,input=None):
+        try:
+            result = await self.run(*args,input=input)
+            out = result.stdout.strip().decode()
+            self._print_out(args,out)
+            return out
+        except (PermissionError,FileNotFoundError) as e:
+            self._print_err(args,e.strerror)
+            raise
+        except subprocess.CalledProcessError as e:
+            self._print_err(args,e.stderr.strip().decode("utf8","ignore") if e.stderr else '')
+            raise
+
+    __call__ = cmd
+
+    async def check(self,*args):
+        try:
+            await self.cmd(*args)
+            return True
+        except subprocess.CalledProcessError:
+            return False
+
+    async def nocheck(self,*args):
+        try:
+            await self.cmd(*args)
+        except subprocess.CalledProcessError:
+            pass
+
+    async def pipe(self,src,dst,progress=None):
+        executor = self.executor or get_executor()
+        self.count += 1
+        if self.debug:
+            print("CMD:",(*src,'|',*dst))
+        if not isinstance(executor,SubprocessExecutor):
+            return executor.pipe(src,dst,progress)
+        if progress is None:
+            # Connect processes directly
+            (r,w) = os.pipe()
+            try:
+                send = await asyncio.create_subprocess_exec(*src,stdout=w)
+                recv = await asyncio.create_subprocess_exec(*dst,stdin=r)
+            finally:
+                os.close(r)
+                os.close(w)
+        else:
+            # Copy stream to count bytes - progress(nbytes) called for each chunk
+            send = await asyncio.create_subprocess_exec(*src,stdout=asyncio.subprocess.PIPE)
+            recv = await asyncio.create_subprocess_exec(*dst,stdin=asyncio.subprocess.PIPE)
+            total = 0
+            try:
+                while chunk := await send.stdout.read(1<<20):
+                    recv.stdin.write(chunk)
+                    await recv.stdin.drain()
+                    total += len(chunk)
+                    progress(total)
+                recv.stdin.close()
+            except (BrokenPipeError,ConnectionResetError):
+                pass
+        recv_rc = await recv.wait()
+        if recv_rc != 0 and send.returncode is None:
+            send.kill()
+        send_rc = await send.wait()
+        return (send_rc,recv_rc)
+
+    async def stream(self,*args,output,timeout=None):
+        executor = self.executor or get_executor()
+        self.count += 1
+        if self.debug:
+            print("CMD:",args)
+        if not isinstance(executor,SubprocessExecutor):
+            return executor.stream(args,output,timeout)
+        proc = await asyncio.create_subprocess_exec(*args,stdin=asyncio.subprocess.DEVNULL,
+                        stdout=asyncio.subprocess.PIPE,stderr=asyncio.subprocess.STDOUT,
+                        start_new_session=True,limit=1<<20)
+        async def _read():
+            while line := await proc.stdout.readline():
+                output(line)
+            return await proc.wait()
+        try:
+            return await asyncio.wait_for(_read(),timeout)
+        except asyncio.TimeoutError:
+            # Kill process group
+            try:
+                os.killpg(proc.pid,signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+            await proc.wait()
+            raise subprocess.TimeoutExpired(args,timeout)
+
+    def drive(self,gen):
+        return run_async(gen)
+
+    def sync(self):
+        return Command(self.debug,self.executor)
+
+    async def blocking(self,f,*args):
+        return await asyncio.get_running_loop().run_in_executor(None,f,*args)
+
+    async def locked(self,lock,f):
+        async with _async_lock(lock):
+            return await _result(f())
+
+    async def gather(self,*results):
+        return await asyncio.gather(*results)
+
+    async def bulk(self,f,names,workers=8):
+        # Multiplexed on event loop with at most `workers` in flight
+        sem = asyncio.Semaphore(max(1,workers))
+        async def _run(name):
+            async with sem:
+                start = time.perf_counter()
+                try:
+                    await _result(f(name))
+                    return BulkResult(name,True,elapsed=time.perf_counter()-start)
+                except Exception as e:
+                    return BulkResult(name,False,_error(e),time.perf_counter()-start,
+                                      getattr(e,"returncode",None))
+        start = time.perf_counter()
+        results = await asyncio.gather(*[ _run(name) for name in names ])
+        return (results,time.perf_counter()-start)
+
+async def _result(value):
+    # Await op/command result (plain values are returned as is)
+    return await value if hasattr(value,"__await__") else value
+
+async def run_async(gen):
+    # Run op generator as coroutine - each yielded awaitable is awaited and
+    # the result (or exception) sent back into the generator
+    (value,error) = (None,None)
+    while True:
+        try:
+            step = gen.throw(error) if error is not None else gen.send(value)
+        except StopIteration as e:
+            return e.value
+        try:
+            (value,error) = (await _result(step),None)
+        except BaseException as e:
+            (value,error) = (None,e)
+
+# asyncio.Lock standing in for a threading lock (eg. epair.bridge_lock) on
+# each event loop
+_async_locks = weakref.WeakKeyDictionary()
+
+def _async_lock(lock):
+    locks = _async_locks.setdefault(asyncio.get_running_loop(),{})
+    return locks.setdefault(id(lock),asyncio.Lock())
+
+class AsyncJail(BaseJail):
+
+    """
+        asyncio version of Jail - methods which run commands return
+        awaitables (same logic as Jail, see jail.BaseJail)
+    """
+
+    command = AsyncCommand
+
+class AsyncHost(BaseHost):
+
+    """
+        asyncio version of Host - use `await AsyncHost.create(config)` to
+        validate the base dataset. Methods which run commands return
+        awaitables (same logic as Host, see host.BaseHost) and bulk
+        operations are multiplexed on the event loop with a concurrency
+        limit (workers). Blocking calls (placement table, ddns) are run in
+        an executor
+    """
+
+    command = AsyncCommand
+    jail_class = AsyncJail
+
+    @classmethod
+    async def create(cls,config,debug=False,rctl_profiles=None):
+        host = cls(config,debug,rctl_profiles)
+        await host.check_base()
+        return host
+
+    async def iter_jails(self,status=False,running=None,base=None,name_glob=None):
+        """
+            Async generator of jail rows (see select_jails)
+        """
+        for row in await self.select_jails(status,running,base,name_glob):
+            yield row
@@ -0,0 +1,44 @@
+
+import subprocess,time
+from dataclasses import dataclass
+
+@dataclass
+class BulkResult:
+
+    name:           str
+    ok:             bool
+    error:          str = ''
+    elapsed:        float = 0.0
+    returncode:     int = None
+
+def _error(e):
+    if isinstance(e,subprocess.CalledProcessError) and e.stderr:
+        return f"{e} :: {e.stderr.strip().decode('utf8','ignore')}"
+    return str(e)
+
+def run_bulk(f,names,workers=8):
+    """
+        Run f(name) for each name on a bounded worker pool - any exception
+        is recorded as that name's failure (so callers can merge results
+        and roll back)
+
+        Returns ([BulkResult,...],wall_time) with results in input order
+    """
+    def _run(name):
+        start = time.perf_counter()
+        try:
+            f(name)
+            return BulkResult(name,True,elapsed=time.perf_counter()-start)
+        except Exception as e:
+            return BulkResult(name,False,_error(e),time.perf_counter()-start,
+                              getattr(e,"returncode",None))
+    from concurrent.futures import ThreadPoolExecutor
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max(1,workers)) as pool:
+        results = list(pool.map(_run,names))
+    return (results,time.perf_counter()-start)
+
+def merge_results(results,later):
+    # Replace results with those from a later phase (matched by name)
+    later = { r.name:r for r in later }
+    return [ later.get(r.name,r) for r in results ]
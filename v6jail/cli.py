@@ -1,18 +1,98 @@
 #!/usr/bin/env python3
 
-import binascii,code,shlex,signal,subprocess,sys,uuid
-import click,tabulate
+import importlib,os,shlex,signal,subprocess,sys
+import click
 
-from .host import Host
-from .jail import Jail
-from .config import HostConfig,JailConfig
-from .ddns import DDNSConfig
+# Heavy modules (host/jail/tabulate etc) are imported when used so that
+# trivial invocations (--help, daemon forwarding) stay cheap
 
 proc_err = lambda e: e.stderr.strip().decode() if e.stderr else ''
 
 DEFAULT_CONFIG = "/usr/local/etc/v6jail.ini"
 
-@click.group()
+DEFAULT_SOCKET = "/var/run/v6jaild.sock"
+
+# Verbs which need a tty, block or stream output/progress (always run
+# locally - v6jaild only returns output once the verb has completed)
+LOCAL_VERBS = {"repl","jexec","exec-all","run","chroot-base","fromconfig","apply",
+               "update-base","clone-base","gc-base"}
+
+# Local verbs which change state cached by v6jaild (snapshot/jail index
+# refreshed after)
+BASE_VERBS = {"chroot-base","apply","update-base","clone-base","gc-base"}
+
+# CPU placement policies (see cpuset.Placement)
+CPU_POLICIES = ["spread","pack","dedicated"]
+
+# Machine-readable output formats (see emit_rows)
+ROW_FORMATS = ["json","ndjson","tsv"]
+
+# Rarely used subcommands (loaded on demand by LazyGroup)
+LAZY_COMMANDS = {
+    "repl":         "v6jail.cli_admin:repl",
+    "fromconfig":   "v6jail.cli_admin:fromconfig",
+    "chroot-base":  "v6jail.cli_admin:chroot_base",
+    "update-base":  "v6jail.cli_admin:update_base",
+    "clone-base":   "v6jail.cli_admin:clone_base",
+    "gc-base":      "v6jail.cli_admin:gc_base",
+    "clone-pool":   "v6jail.cli_admin:clone_pool",
+    "epair-pool":   "v6jail.cli_admin:epair_pool",
+    "metrics":      "v6jail.cli_admin:metrics",
+    "jail-conf":    "v6jail.cli_admin:jail_conf",
+    "apply":        "v6jail.cli_admin:apply",
+    "cpuset":       "v6jail.cli_admin:cpuset",
+    "rctl":         "v6jail.cli_admin:rctl",
+}
+
+class LazyGroup(click.Group):
+
+    """
+        click.Group which imports subcommands listed in LAZY_COMMANDS
+        the first time they are looked up
+    """
+
+    def list_commands(self,ctx):
+        return sorted([*super().list_commands(ctx),*LAZY_COMMANDS])
+
+    def get_command(self,ctx,name):
+        if name in LAZY_COMMANDS and name not in self.commands:
+            (module,attr) = LAZY_COMMANDS[name].split(":")
+            self.add_command(getattr(importlib.import_module(module),attr),name)
+        return super().get_command(ctx,name)
+
+def load_host(debug=False,base=None,config=None,ddns=None):
+    from .host import Host
+    from .config import HostConfig
+    from .ddns import DDNSConfig
+    from .rctl import read_profiles
+    if config:
+        host_config = HostConfig.read_config("host",f=config)
+        config.seek(0)
+        rctl_profiles = read_profiles(config)
+    else:
+        try:
+            with open(DEFAULT_CONFIG) as config:
+                host_config = HostConfig.read_config("host",f=config)
+                config.seek(0)
+                rctl_profiles = read_profiles(config)
+        except (FileNotFoundError,KeyError):
+            # Try to guess config
+            host_config = HostConfig()
+            rctl_profiles = {}
+    if base:
+        host_config.base = base
+    if ddns:
+        ddns_config = DDNSConfig.read_config("ddns",f=ddns)
+    else:
+        try:
+            with open(DEFAULT_CONFIG) as ddns:
+                ddns_config = DDNSConfig.read_config("ddns",f=ddns)
+        except (FileNotFoundError,KeyError):
+            # Try to guess config
+            ddns_config = DDNSConfig()
+    return (Host(host_config,debug,rctl_profiles),ddns_config)
+
+@click.group(cls=LazyGroup)
 @click.option("--debug",is_flag=True)
 @click.option("--config",type=click.File("r"))
 @click.option("--ddns",type=click.File("r"))
@@ -21,28 +101,14 @@ DEFAULT_CONFIG = "/usr/local/etc/v6jail.ini"
 def cli(ctx,debug,base,config,ddns):
     try:
         ctx.ensure_object(dict)
-        if config:
-            host_config = HostConfig.read_config("host",f=config)
-        else:
-            try:
-                with open(DEFAULT_CONFIG) as config:
-                    host_config = HostConfig.read_config("host",f=config)
-            except (FileNotFoundError,KeyError):
-                # Try to guess config
-                host_config = HostConfig()
-        if base:
-            host_config.base = base
-        if ddns:
-            ddns_config = DDNSConfig.read_config("ddns",f=ddns)
-        else:
-            try:
-                with open(DEFAULT_CONFIG) as ddns:
-                    ddns_config = DDNSConfig.read_config("ddns",f=ddns)
-            except (FileNotFoundError,KeyError):
-                # Try to guess config
-                ddns_config = DDNSConfig()
-        ctx.obj["host"] = Host(host_config,debug)
-        ctx.obj["ddns"] = ddns_config
+        if "host" not in ctx.obj:
+            # (Host provided by v6jaild)
+            (ctx.obj["host"],ctx.obj["ddns"]) = load_host(debug,base,config,ddns)
+            # Don't wait for clone pool refill on exit
+            ctx.obj["host"].clone_pool().detach = True
+        if ctx.obj["host"].metrics:
+            # Merge metrics recorded by this command into state/textfile
+            ctx.call_on_close(ctx.obj["host"].metrics.flush)
     except subprocess.CalledProcessError as e:
         raise click.ClickException(f"{e} :: {proc_err(e)}")
     except ValueError as e:
@@ -57,9 +123,22 @@ def cli(ctx,debug,base,config,ddns):
 @click.option("--base")
 @click.option("--mountpoint")
 @click.option("--salt")
+@click.option("--refresh",is_flag=True)
 @click.pass_context
-def config(ctx,zvol,bridge,gateway,network,proxy,base,mountpoint,salt):
+def config(ctx,zvol,bridge,gateway,network,proxy,base,mountpoint,salt,refresh):
     config = ctx.obj["host"].config
+    if refresh:
+        try:
+            config.refresh()
+            ctx.obj["host"].snapshots.invalidate()
+            ctx.obj["host"].jail_index.invalidate()
+        except subprocess.CalledProcessError as e:
+            raise click.ClickException(f"{e} :: {proc_err(e)}")
+        except ValueError as e:
+            raise click.ClickException(f"{e}")
+    # Overrides only apply to output (don't change resident v6jaild config)
+    import copy
+    config = copy.copy(config)
     if zvol:
         config.zvol = zvol
     if bridge:
@@ -75,6 +154,7 @@ def config(ctx,zvol,bridge,gateway,network,proxy,base,mountpoint,salt):
     if mountpoint:
         config.mountpoint = mountpoint
     if salt:
+        import binascii
         config.salt = binascii.unhexlify(salt)
     config.write_config("host").write(sys.stdout)
 
@@ -109,8 +189,9 @@ def _cli_config(jail,jail_params,linux,fastboot,fastboot_service,fastboot_cmd,wr
 @click.option("--fastboot",is_flag=True)
 @click.option("--fastboot-service",multiple=True,default=["syslogd","cron","sshd"])
 @click.option("--fastboot-cmd",multiple=True)
+@click.option("--format","fmt",type=click.Choice(["text",*ROW_FORMATS]),default="text")
 @click.pass_context
-def genconfig(ctx,name,jail_params,linux,persist,fastboot,fastboot_service,fastboot_cmd):
+def genconfig(ctx,name,jail_params,linux,persist,fastboot,fastboot_service,fastboot_cmd,fmt):
     try:
         jail = ctx.obj["host"].jail(name)
         if not persist:
@@ -118,19 +199,12 @@ def genconfig(ctx,name,jail_params,linux,persist,fastboot,fastboot_service,fastb
             fastboot_service = []
         # XXX Do something with fastboot
         _cli_config(jail,jail_params,linux,fastboot,fastboot_service,fastboot_cmd,write_fastboot=False)
-        click.echo(jail.get_config())
-    except subprocess.CalledProcessError as e:
-        raise click.ClickException(f"{e} :: {proc_err(e)}")
-    except ValueError as e:
-        raise click.ClickException(f"{e}")
-
-@cli.command()
-@click.option("--jail-config",type=click.File("r"))
-@click.pass_context
-def fromconfig(ctx,jail_config):
-    try:
-        jail = Jail.from_config(jail_config)
-        click.echo(jail.get_config())
+        if fmt == "text":
+            click.echo(jail.get_config())
+        else:
+            c = jail.config_parser()
+            emit_rows((dict(section=section,key=k,value=v)
+                            for section in c.sections() for (k,v) in c[section].items()),fmt)
     except subprocess.CalledProcessError as e:
         raise click.ClickException(f"{e} :: {proc_err(e)}")
     except ValueError as e:
@@ -156,6 +230,7 @@ def run(ctx,name,jail_params,linux,fastboot,force_ndp,ddns,persist,
             fastboot_service,fastboot_cmd,adduser,wheel,shell,jexec,destroy):
     try:
         if name == '__uuid__':
+            import uuid
             name = str(uuid.uuid4())
         jail = ctx.obj["host"].jail(name)
         if not jail.check_fs():
@@ -214,19 +289,31 @@ def run(ctx,name,jail_params,linux,fastboot,force_ndp,ddns,persist,
 @click.option("--fastboot",is_flag=True)
 @click.option("--fastboot-service",multiple=True,default=["syslogd","cron","sshd"])
 @click.option("--fastboot-cmd",multiple=True)
+@click.option("--timings",is_flag=True)
+@click.option("--cpus",type=int,help="CPUs allocated if placement enabled")
+@click.option("--cpu-policy",type=click.Choice(CPU_POLICIES))
+@click.option("--rctl",help="rctl profile (default from host config)")
 @click.pass_context
-def start(ctx,name,jail_params,linux,persist,fastboot,fastboot_service,fastboot_cmd):
+def start(ctx,name,jail_params,linux,persist,fastboot,fastboot_service,fastboot_cmd,timings,
+          cpus,cpu_policy,rctl):
     try:
         jail = ctx.obj["host"].jail(name)
         if not persist:
             jail_params = [*jail_params,"persist=false"]
             fastboot_service = []
         _cli_config(jail,jail_params,linux,fastboot,fastboot_service,fastboot_cmd)
+        (jail.cpus,jail.cpu_policy) = (cpus,cpu_policy)
+        if rctl is not None:
+            jail.config.rctl = rctl
         jail.start()
         click.secho(f"Started jail: {jail.config.name} " \
                     f"(id={jail.config.jname} " \
                     f"ipv6={jail.config.address})",
                     fg="green")
+        if timings:
+            import tabulate
+            click.echo(tabulate.tabulate(jail.steps.report(),headers="keys"))
+            click.echo(f"Total commands: {jail.cmd.count}")
     except subprocess.CalledProcessError as e:
         raise click.ClickException(f"{e} :: {proc_err(e)}")
     except ValueError as e:
@@ -262,121 +349,239 @@ def destroy(ctx,name,force,ddns):
     except ValueError as e:
         raise click.ClickException(f"{e}")
 
+def _sysrc_rows(out):
+    # sysrc -v lines are "[<file>: ]<name>: <value>"
+    for l in out.split("\n"):
+        if ": " in l:
+            f = l.split(": ",2) if l.startswith("/") else ["",*l.split(": ",1)]
+            if len(f) == 3:
+                yield dict(file=f[0],name=f[1],value=f[2])
+
+def emit_rows(rows,fmt="table"):
+    """
+        Write rows (iterable of dicts with the same keys) - json/ndjson/tsv
+        are streamed as rows are generated, table needs all rows
+    """
+    if fmt == "table":
+        import tabulate
+        click.echo(tabulate.tabulate([*rows],headers="keys"))
+    elif fmt == "json":
+        import json
+        sep = "[\n"
+        for r in rows:
+            click.echo(sep + json.dumps(r),nl=False)
+            sep = ",\n"
+        click.echo("[]" if sep == "[\n" else "\n]")
+    elif fmt == "ndjson":
+        import json
+        for r in rows:
+            click.echo(json.dumps(r))
+    elif fmt == "tsv":
+        header = None
+        for r in rows:
+            if header is None:
+                header = [*r]
+                click.echo("\t".join(header))
+            click.echo("\t".join("" if r[k] is None else str(r[k]) for k in header))
+    else:
+        raise ValueError(f"Invalid format: {fmt}")
+
+def _depend(depend):
+    # NAME:DEP[,DEP...] options as {name:[deps]}
+    deps = {}
+    for d in depend:
+        (name,sep,names) = d.partition(":")
+        if not sep:
+            raise click.BadParameter(f"Expecting NAME:DEP[,DEP...] ({d})",param_hint="--depend")
+        deps.setdefault(name,[]).extend(n for n in names.split(",") if n)
+    return deps
+
+def _bulk_report(results,elapsed,verb):
+    import tabulate
+    click.echo(tabulate.tabulate([dict(name=r.name,
+                                       result=verb if r.ok else "failed",
+                                       elapsed=f"{r.elapsed:.3f}s",
+                                       error=r.error) for r in results],headers="keys"))
+    failed = len([r for r in results if not r.ok])
+    click.secho(f"{verb}: {len(results)-failed}/{len(results)} jails in {elapsed:.3f}s",
+                fg="red" if failed else "green")
+    if failed:
+        raise click.ClickException(f"{failed} jail(s) failed")
+
 @cli.command()
-@click.option("--status",is_flag=True)
+@click.argument("names",nargs=-1,required=True)
+@click.option("--workers",type=int,default=8)
+@click.option("--atomic/--no-atomic",default=True)
 @click.pass_context
-def list(ctx,status):
+def new_many(ctx,names,workers,atomic):
     try:
-        jails = ctx.obj["host"].list_jails(status=status)
-        click.echo(tabulate.tabulate(jails,headers="keys"))
+        _bulk_report(*ctx.obj["host"].create_many(names,workers,atomic),"created")
     except subprocess.CalledProcessError as e:
         raise click.ClickException(f"{e} :: {proc_err(e)}")
     except ValueError as e:
         raise click.ClickException(f"{e}")
 
 @cli.command()
-@click.argument("name",nargs=1)
-@click.option("--user",required=True)
-@click.option("--pk",required=True)
-@click.option("--wheel",is_flag=True)
+@click.argument("names",nargs=-1,required=True)
+@click.option("--workers",type=int,default=8)
+@click.option("--jail-params",multiple=True)
+@click.option("--linux",is_flag=True)
+@click.option("--persist",type=bool,default=True)
+@click.option("--fastboot",is_flag=True)
+@click.option("--fastboot-service",multiple=True,default=["syslogd","cron","sshd"])
+@click.option("--fastboot-cmd",multiple=True)
+@click.option("--single",is_flag=True,help="Create jails with single jail(8) invocation")
+@click.option("--depend",multiple=True,help="NAME:DEP[,DEP...] (with --single)")
+@click.option("--cpus",type=int,help="CPUs allocated per jail if placement enabled")
+@click.option("--cpu-policy",type=click.Choice(CPU_POLICIES))
+@click.option("--rctl",help="rctl profile (default from host config)")
 @click.pass_context
-def adduser(ctx,name,user,pk,wheel):
+def start_many(ctx,names,workers,jail_params,linux,persist,fastboot,fastboot_service,fastboot_cmd,
+               single,depend,cpus,cpu_policy,rctl):
     try:
-        jail = ctx.obj["host"].jail(name)
-        jail.adduser(user=user,pk=pk)
-        if wheel:
-            jail.usermod(user,"-G","wheel")
+        if not persist:
+            jail_params = [*jail_params,"persist=false"]
+            fastboot_service = []
+        def setup(jail):
+            _cli_config(jail,jail_params,linux,fastboot,fastboot_service,fastboot_cmd)
+            (jail.cpus,jail.cpu_policy) = (cpus,cpu_policy)
+            if rctl is not None:
+                jail.config.rctl = rctl
+        if single:
+            _bulk_report(*ctx.obj["host"].boot_many(names,workers,setup,_depend(depend)),"started")
+        else:
+            _bulk_report(*ctx.obj["host"].start_many(names,workers,setup),"started")
     except subprocess.CalledProcessError as e:
         raise click.ClickException(f"{e} :: {proc_err(e)}")
     except ValueError as e:
         raise click.ClickException(f"{e}")
 
 @cli.command()
-@click.argument("name",nargs=1)
-@click.argument("args", nargs=-1)
+@click.argument("names",nargs=-1,required=True)
+@click.option("--workers",type=int,default=8)
 @click.pass_context
-def sysrc(ctx,name,args):
+def stop_many(ctx,names,workers):
     try:
-        jail = ctx.obj["host"].jail(name)
-        click.secho(f"sysrc: {jail.config.name} ({jail.config.jname})",fg="yellow")
-        if args:
-            click.secho(jail.sysrc("-v",*args),fg="green")
-        else:
-            click.secho(jail.sysrc("-a","-v"),fg="green")
+        _bulk_report(*ctx.obj["host"].stop_many(names,workers),"stopped")
     except subprocess.CalledProcessError as e:
         raise click.ClickException(f"{e} :: {proc_err(e)}")
     except ValueError as e:
         raise click.ClickException(f"{e}")
 
 @cli.command()
-@click.argument("name",nargs=1)
-@click.argument("args", nargs=-1)
+@click.argument("names",nargs=-1,required=True)
+@click.option("--workers",type=int,default=8)
+@click.option("--force",is_flag=True)
+@click.option("--ddns",is_flag=True)
 @click.pass_context
-def jexec(ctx,name,args):
+def destroy_many(ctx,names,workers,force,ddns):
     try:
-        jail = ctx.obj["host"].jail(name)
-        jail.jexec(*args)
+        results,elapsed = ctx.obj["host"].remove_many(names,workers,force)
+        removed = [ f"del {r.name}" for r in results if r.ok ]
+        if ddns and removed:
+            # Single update for all removed jails
+            ctx.obj["ddns"].update(*removed)
+        _bulk_report(results,elapsed,"removed")
+    except subprocess.CalledProcessError as e:
+        raise click.ClickException(f"{e} :: {proc_err(e)}")
+    except ValueError as e:
+        raise click.ClickException(f"{e}")
+
+@cli.command()
+@click.option("--status",is_flag=True)
+@click.option("--running/--stopped",default=None)
+@click.option("--base")
+@click.option("--name-glob")
+@click.option("--format","fmt",type=click.Choice(["table",*ROW_FORMATS]),default="table")
+@click.pass_context
+def list(ctx,status,running,base,name_glob,fmt):
+    try:
+        emit_rows(ctx.obj["host"].iter_jails(status=status,running=running,
+                                             base=base,name_glob=name_glob),fmt)
     except subprocess.CalledProcessError as e:
         raise click.ClickException(f"{e} :: {proc_err(e)}")
     except ValueError as e:
         raise click.ClickException(f"{e}")
 
 @cli.command()
-@click.argument("name",nargs=-1)
+@click.argument("name",nargs=1)
+@click.option("--user",required=True)
+@click.option("--pk",required=True)
+@click.option("--wheel",is_flag=True)
 @click.pass_context
-def repl(ctx,name):
+def adduser(ctx,name,user,pk,wheel):
     try:
-        if name:
-            jail = ctx.obj["host"].jail(name[0])
-        host = ctx.obj["host"]
-        ddns = ctx.obj["ddns"]
-        code.interact(local=locals())
+        jail = ctx.obj["host"].jail(name)
+        jail.adduser(user=user,pk=pk)
+        if wheel:
+            jail.usermod(user,"-G","wheel")
     except subprocess.CalledProcessError as e:
         raise click.ClickException(f"{e} :: {proc_err(e)}")
     except ValueError as e:
         raise click.ClickException(f"{e}")
 
 @cli.command()
-@click.argument("cmds",nargs=-1)
-@click.option("--snapshot",is_flag=True)
+@click.argument("name",nargs=1)
+@click.argument("args", nargs=-1)
+@click.option("--format","fmt",type=click.Choice(["text",*ROW_FORMATS]),default="text")
 @click.pass_context
-def chroot_base(ctx,snapshot,cmds):
+def sysrc(ctx,name,args,fmt):
     try:
-        host  = ctx.obj["host"]
-        host.chroot_base(cmds=cmds,snapshot=snapshot)
-        if snapshot:
-            click.secho(host.get_latest_snapshot(),fg="green")
+        jail = ctx.obj["host"].jail(name)
+        out = jail.sysrc("-v",*args) if args else jail.sysrc("-a","-v")
+        if fmt == "text":
+            click.secho(f"sysrc: {jail.config.name} ({jail.config.jname})",fg="yellow")
+            click.secho(out,fg="green")
+        else:
+            emit_rows(_sysrc_rows(out),fmt)
     except subprocess.CalledProcessError as e:
         raise click.ClickException(f"{e} :: {proc_err(e)}")
     except ValueError as e:
         raise click.ClickException(f"{e}")
 
 @cli.command()
+@click.argument("name",nargs=1)
+@click.argument("args", nargs=-1)
 @click.pass_context
-def update_base(ctx):
+def jexec(ctx,name,args):
     try:
-        host  = ctx.obj["host"]
-        cmds = [ "/usr/sbin/freebsd-update --not-running-from-cron fetch | head",
-                 "/usr/sbin/freebsd-update --not-running-from-cron install || echo No updates available",
-                 "/usr/bin/env ASSUME_ALWAYS_YES=true /usr/sbin/pkg bootstrap",
-                 "/usr/bin/env ASSUME_ALWAYS_YES=true /usr/sbin/pkg update",
-                 "/usr/bin/env ASSUME_ALWAYS_YES=true /usr/sbin/pkg upgrade",
-        ]
-        host.chroot_base(cmds=cmds,snapshot=True)
-        click.secho(host.get_latest_snapshot(),fg="green")
+        jail = ctx.obj["host"].jail(name)
+        jail.jexec(*args)
     except subprocess.CalledProcessError as e:
         raise click.ClickException(f"{e} :: {proc_err(e)}")
     except ValueError as e:
         raise click.ClickException(f"{e}")
 
 @cli.command()
-@click.argument("name",required=True)
+@click.option("--filter","patterns",multiple=True,help="Jail name glob")
+@click.option("--base")
+@click.option("--workers",type=int,default=8)
+@click.option("--timeout",type=float,help="Per-jail timeout (seconds)")
+@click.option("--quiet",is_flag=True,help="Only print summary")
+@click.argument("args",nargs=-1,required=True,type=click.UNPROCESSED)
 @click.pass_context
-def clone_base(ctx,name):
+def exec_all(ctx,patterns,base,workers,timeout,quiet,args):
     try:
-        host  = ctx.obj["host"]
-        host.clone_base(name)
-        click.secho(f"Cloned base -> {host.config.zvol}/{name}")
+        import threading
+        lock = threading.Lock()
+        def _output(name,line):
+            line = line.decode("utf8","replace").rstrip("\n")
+            with lock:
+                click.echo(f"{click.style(name,fg='cyan')}: {line}")
+        (results,elapsed) = ctx.obj["host"].exec_all(args,patterns,base,workers,timeout,
+                                                     None if quiet else _output)
+        import tabulate
+        click.echo(tabulate.tabulate([dict(name=r.name,
+                                           rc=0 if r.ok else r.returncode,
+                                           result="ok" if r.ok else \
+                                                  "timeout" if r.returncode is None else "failed",
+                                           elapsed=f"{r.elapsed:.3f}s") for r in results],
+                                     headers="keys"))
+        failed = len([r for r in results if not r.ok])
+        click.secho(f"exec: {len(results)-failed}/{len(results)} jails in {elapsed:.3f}s",
+                    fg="red" if failed else "green")
+        if failed:
+            raise click.ClickException(f"{failed} jail(s) failed")
     except subprocess.CalledProcessError as e:
         raise click.ClickException(f"{e} :: {proc_err(e)}")
     except ValueError as e:
@@ -398,6 +603,30 @@ def ddns(ctx,name,operation,record):
             record = ""
     ctx.obj["ddns"].update(f"{operation} {name} {record}")
 
+def main():
+    """
+        Entry point - if v6jaild is listening on V6JAIL_SOCKET (default
+        /var/run/v6jaild.sock) forward command, otherwise run locally.
+        Global options or interactive verbs always run locally
+    """
+    argv = sys.argv[1:]
+    path = os.environ.get("V6JAIL_SOCKET",DEFAULT_SOCKET)
+    if path and argv and not argv[0].startswith("-") and argv[0] not in LOCAL_VERBS:
+        from .daemon import client
+        try:
+            sys.exit(client(path,argv))
+        except (FileNotFoundError,ConnectionRefusedError):
+            pass
+    try:
+        cli()
+    finally:
+        if path and argv and argv[0] in BASE_VERBS and os.path.exists(path):
+            from .daemon import client
+            try:
+                client(path,["config","--refresh"],quiet=True)
+            except (FileNotFoundError,ConnectionRefusedError):
+                pass
+
 if __name__ == "__main__":
-    cli()
+    main()
 
@@ -0,0 +1,284 @@
+
+import subprocess
+import click
+
+from .cli import ROW_FORMATS,proc_err,_bulk_report,_cli_config,_depend,emit_rows
+
+# Rarely used subcommands - imported on demand by cli.LazyGroup
+
+@click.command()
+@click.option("--jail-config",type=click.File("r"))
+@click.pass_context
+def fromconfig(ctx,jail_config):
+    try:
+        from .jail import Jail
+        jail = Jail.from_config(jail_config)
+        click.echo(jail.get_config())
+    except subprocess.CalledProcessError as e:
+        raise click.ClickException(f"{e} :: {proc_err(e)}")
+    except ValueError as e:
+        raise click.ClickException(f"{e}")
+
+@click.command()
+@click.argument("name",nargs=-1)
+@click.pass_context
+def repl(ctx,name):
+    try:
+        if name:
+            jail = ctx.obj["host"].jail(name[0])
+        host = ctx.obj["host"]
+        ddns = ctx.obj["ddns"]
+        import code
+        code.interact(local=locals())
+    except subprocess.CalledProcessError as e:
+        raise click.ClickException(f"{e} :: {proc_err(e)}")
+    except ValueError as e:
+        raise click.ClickException(f"{e}")
+
+@click.command()
+@click.argument("cmds",nargs=-1)
+@click.option("--snapshot",is_flag=True)
+@click.pass_context
+def chroot_base(ctx,snapshot,cmds):
+    try:
+        host  = ctx.obj["host"]
+        host.chroot_base(cmds=cmds,snapshot=snapshot)
+        if snapshot:
+            click.secho(host.get_latest_snapshot(),fg="green")
+    except subprocess.CalledProcessError as e:
+        raise click.ClickException(f"{e} :: {proc_err(e)}")
+    except ValueError as e:
+        raise click.ClickException(f"{e}")
+
+@click.command()
+@click.pass_context
+def update_base(ctx):
+    try:
+        host  = ctx.obj["host"]
+        cmds = [ "/usr/sbin/freebsd-update --not-running-from-cron fetch | head",
+                 "/usr/sbin/freebsd-update --not-running-from-cron install || echo No updates available",
+                 "/usr/bin/env ASSUME_ALWAYS_YES=true /usr/sbin/pkg bootstrap",
+                 "/usr/bin/env ASSUME_ALWAYS_YES=true /usr/sbin/pkg update",
+                 "/usr/bin/env ASSUME_ALWAYS_YES=true /usr/sbin/pkg upgrade",
+        ]
+        host.chroot_base(cmds=cmds,snapshot=True)
+        click.secho(host.get_latest_snapshot(),fg="green")
+    except subprocess.CalledProcessError as e:
+        raise click.ClickException(f"{e} :: {proc_err(e)}")
+    except ValueError as e:
+        raise click.ClickException(f"{e}")
+
+def _progress():
+    # Single line progress report on stderr
+    import time
+    start = time.perf_counter()
+    def _report(nbytes,total):
+        elapsed = max(time.perf_counter() - start,1e-6)
+        pct = f" ({100*nbytes/total:.0f}%)" if total else ""
+        click.echo(f"\r{nbytes/2**20:.1f} MB{pct} {nbytes/2**20/elapsed:.1f} MB/s ",nl=False,err=True)
+    return _report
+
+@click.command()
+@click.argument("name",required=True)
+@click.option("--incremental/--full",default=True)
+@click.option("--compressed/--uncompressed",default=True)
+@click.option("--raw",is_flag=True)
+@click.option("--resume/--no-resume",default=True)
+@click.option("--progress",is_flag=True)
+@click.pass_context
+def clone_base(ctx,name,incremental,compressed,raw,resume,progress):
+    try:
+        host  = ctx.obj["host"]
+        stats = host.clone_base(name,incremental=incremental,compressed=compressed,raw=raw,
+                                resume=resume,progress=_progress() if progress else None)
+        if progress:
+            click.echo(err=True)
+        if stats["mode"] == "current":
+            click.secho(f"Base up to date: {stats['dest']} ({stats['source']})")
+        else:
+            rate = stats["bytes"] / 2**20 / stats["elapsed"] if stats["elapsed"] else 0
+            click.secho(f"Cloned base -> {stats['dest']} ({stats['mode']}" +
+                        (f" from {stats['base']}" if stats["base"] else "") +
+                        f": {stats['bytes']/2**20:.1f} MB in {stats['elapsed']:.1f}s {rate:.1f} MB/s)")
+    except subprocess.CalledProcessError as e:
+        raise click.ClickException(f"{e} :: {proc_err(e)}")
+    except ValueError as e:
+        raise click.ClickException(f"{e}")
+
+@click.command()
+@click.option("--keep",type=int,default=3)
+@click.option("--dry-run",is_flag=True)
+@click.pass_context
+def gc_base(ctx,keep,dry_run):
+    try:
+        import tabulate
+        (snapshots,reclaim) = ctx.obj["host"].gc_base(keep=keep,dry_run=dry_run)
+        click.echo(tabulate.tabulate([ dict(snapshot=s["snapshot"],clones=s["clones"],used=s["used"],
+                                            action=s["action"],reason=s["reason"])
+                                       for s in snapshots ],headers="keys"))
+        n = len([ s for s in snapshots if s["action"] == "destroy" ])
+        if dry_run:
+            click.secho(f"Would destroy {n} snapshot(s) (reclaim {reclaim/2**20:.1f} MB)",fg="yellow")
+        else:
+            click.secho(f"Destroyed {n} snapshot(s) (reclaimed {reclaim/2**20:.1f} MB)",fg="green")
+    except subprocess.CalledProcessError as e:
+        raise click.ClickException(f"{e} :: {proc_err(e)}")
+    except ValueError as e:
+        raise click.ClickException(f"{e}")
+
+@click.command()
+@click.option("--fill",is_flag=True)
+@click.option("--drain",is_flag=True)
+@click.option("--size",type=int)
+@click.pass_context
+def clone_pool(ctx,fill,drain,size):
+    try:
+        host = ctx.obj["host"]
+        pool = host.clone_pool()
+        snapshot = host.get_latest_snapshot()
+        if size is None:
+            size = pool.size
+        if drain:
+            click.secho(f"Destroyed {pool.invalidate()} clone(s)",fg="green")
+        else:
+            pool.invalidate(snapshot)
+        if fill:
+            click.secho(f"Created {pool.fill(snapshot,size)} clone(s)",fg="green")
+        click.echo(f"Available: {len(pool.available(snapshot))} (size: {size} snapshot: {snapshot})")
+    except subprocess.CalledProcessError as e:
+        raise click.ClickException(f"{e} :: {proc_err(e)}")
+    except ValueError as e:
+        raise click.ClickException(f"{e}")
+
+@click.command()
+@click.option("--fill",is_flag=True)
+@click.option("--drain",is_flag=True)
+@click.option("--low-water",type=int)
+@click.pass_context
+def epair_pool(ctx,fill,drain,low_water):
+    try:
+        pool = ctx.obj["host"].epair_pool()
+        if low_water is not None:
+            pool.low_water = low_water
+        if drain:
+            click.secho(f"Destroyed {pool.drain()} epair(s)",fg="green")
+        if fill:
+            click.secho(f"Created {pool.fill()} epair(s)",fg="green")
+        click.echo(f"Available: {len(pool.available())} (low-water: {pool.low_water})")
+    except subprocess.CalledProcessError as e:
+        raise click.ClickException(f"{e} :: {proc_err(e)}")
+    except ValueError as e:
+        raise click.ClickException(f"{e}")
+
+@click.command()
+@click.option("--format","fmt",type=click.Choice(["json","prom"]),default="json")
+@click.pass_context
+def metrics(ctx,fmt):
+    host = ctx.obj["host"]
+    if not host.metrics:
+        raise click.ClickException("Metrics disabled (set metrics in [host] config)")
+    from . import metrics
+    try:
+        state = host.metrics.flush()
+    except (OSError,ValueError) as e:
+        raise click.ClickException(f"{e}")
+    if fmt == "prom":
+        click.echo(metrics.prometheus(state),nl=False)
+    else:
+        import json
+        click.echo(json.dumps(metrics.summary(state),indent=2))
+
+@click.command()
+@click.argument("names",nargs=-1,required=True)
+@click.option("--hooks/--no-hooks",default=True,help="Create/destroy epair in exec.prestart/poststop")
+@click.option("--depend",multiple=True,help="NAME:DEP[,DEP...]")
+@click.option("--jail-params",multiple=True)
+@click.option("--linux",is_flag=True)
+@click.pass_context
+def jail_conf(ctx,names,hooks,depend,jail_params,linux):
+    try:
+        setup = lambda jail: _cli_config(jail,jail_params,linux,False,[],[])
+        click.echo(ctx.obj["host"].jail_conf(names,hooks,_depend(depend),setup),nl=False)
+    except subprocess.CalledProcessError as e:
+        raise click.ClickException(f"{e} :: {proc_err(e)}")
+    except ValueError as e:
+        raise click.ClickException(f"{e}")
+
+@click.command()
+@click.argument("manifest",type=click.File("r"))
+@click.option("--workers",type=int,default=8)
+@click.option("--prune",is_flag=True,help="Destroy jails not in manifest")
+@click.option("--dry-run",is_flag=True,help="Show plan only")
+@click.pass_context
+def apply(ctx,manifest,workers,prune,dry_run):
+    try:
+        import tabulate
+        from .manifest import read_manifest
+        specs = read_manifest(manifest)
+        (actions,results,elapsed,error) = ctx.obj["host"].apply(specs,workers,prune,dry_run,
+                                                                ctx.obj["ddns"].update)
+        if not actions:
+            click.secho(f"No changes ({len(specs)} jails)",fg="green")
+            return
+        click.echo(tabulate.tabulate([dict(name=name,actions=" ".join(a))
+                                        for (name,a) in actions.items()],headers="keys"))
+        if dry_run:
+            return
+        if error:
+            click.secho(error,fg="red",err=True)
+        _bulk_report(results,elapsed,"applied")
+    except subprocess.CalledProcessError as e:
+        raise click.ClickException(f"{e} :: {proc_err(e)}")
+    except ValueError as e:
+        raise click.ClickException(f"{e}")
+
+@click.command()
+@click.option("--rebalance",is_flag=True,help="Reallocate CPUs for running jails")
+@click.option("--dry-run",is_flag=True)
+@click.option("--format","fmt",type=click.Choice(["table",*ROW_FORMATS]),default="table")
+@click.pass_context
+def cpuset(ctx,rebalance,dry_run,fmt):
+    try:
+        host = ctx.obj["host"]
+        if not host.placement:
+            raise click.ClickException("CPU placement not enabled (cpuset not set in config)")
+        if rebalance:
+            from .cpuset import cpulist
+            changed = host.rebalance_cpus(dry_run)
+            emit_rows([ dict(name=name,old=cpulist(old),new=cpulist(new),error=error or "")
+                            for (name,old,new,error) in changed ],fmt)
+            if fmt == "table":
+                failed = sum(1 for c in changed if c[3])
+                click.secho(f"{'Would move' if dry_run else 'Moved'}: {len(changed)-failed} jails",fg="green")
+                if failed:
+                    click.secho(f"Failed: {failed} jails",fg="red")
+        else:
+            emit_rows(host.placement.rows(),fmt)
+    except subprocess.CalledProcessError as e:
+        raise click.ClickException(f"{e} :: {proc_err(e)}")
+    except ValueError as e:
+        raise click.ClickException(f"{e}")
+
+@click.command()
+@click.argument("name",required=False)
+@click.option("--format","fmt",type=click.Choice(["table",*ROW_FORMATS]),default="table")
+@click.pass_context
+def rctl(ctx,name,fmt):
+    # List profiles or rules/usage for running jail
+    try:
+        host = ctx.obj["host"]
+        if name:
+            jname = host.jail(name).config.jname
+            rules = host.cmd("/usr/bin/rctl",f"jail:{jname}")
+            usage = dict(l.split("=",1) for l in
+                            host.cmd("/usr/bin/rctl","-u",f"jail:{jname}").split("\n") if "=" in l)
+            emit_rows(({ "rule":r,"usage":usage.get(r.split(":")[2],"") }
+                            for r in rules.split("\n") if r),fmt)
+        else:
+            emit_rows(({ "profile":p.name,"resource":r,"action":a,"amount":v }
+                            for p in host.rctl_profiles.values()
+                            for (r,(a,v)) in p.limits.items()),fmt)
+    except subprocess.CalledProcessError as e:
+        raise click.ClickException(f"{e} :: {proc_err(e)}")
+    except ValueError as e:
+        raise click.ClickException(f"{e}")
@@ -0,0 +1,131 @@
+
+import os,subprocess,sys,threading,uuid
+
+from .counter import try_locked
+from .util import Command,op
+
+# Directory for pool fill lock files
+LOCK_DIR = "/var/run"
+
+class ClonePool:
+
+    """
+        Pool of warm spare ZFS clones of the latest base snapshot held under
+        <zvol>/_pool (mountpoint=none). A clone is claimed by renaming it
+        to the jail dataset (which mounts it at the jail path). Clones of
+        older snapshots are destroyed by invalidate() when a new base
+        snapshot is created
+
+        Fills are serialised across processes by a lock file named after
+        the pool dataset (see fill) - Host shares a single pool with its
+        jails. If detach is set refill() runs in a detached process so that
+        short-lived (CLI) processes exit without waiting for it
+
+        Methods other than refill are ops (see util.op) - coroutines if cmd
+        is an AsyncCommand
+    """
+
+    def __init__(self,base_zvol,size=0,cmd=None,snapshots=None,detach=False):
+        self.base_zvol = base_zvol
+        (self.zvol,_,self.base) = base_zvol.rpartition("/")
+        self.parent = f"{self.zvol}/_pool"
+        self.size = size
+        self.cmd = cmd or Command()
+        self.snapshots = snapshots
+        self.detach = detach
+        self.lockfile = os.path.join(LOCK_DIR,f"v6jail.{self.parent.replace('/','.')}.lock")
+
+    @op
+    def members(self):
+        try:
+            return self.decode_members((yield self.cmd(*self.members_args())))
+        except subprocess.CalledProcessError:
+            return []
+
+    def members_args(self):
+        return ("/sbin/zfs","list","-H","-r","-d","1","-t","filesystem",
+                "-o","name,origin","-s","creation",self.parent)
+
+    def decode_members(self,out):
+        return [ l.split("\t") for l in out.split("\n") if l and not l.startswith(f"{self.parent}\t") ]
+
+    @op
+    def available(self,snapshot):
+        return [ name for (name,origin) in (yield self.members()) if origin == snapshot ]
+
+    @op
+    def create(self,snapshot):
+        if not (yield self.cmd.check("/sbin/zfs","list","-H","-o","name",self.parent)):
+            yield self.cmd.nocheck("/sbin/zfs","create","-o","mountpoint=none",self.parent)
+        name = f"{self.parent}/{self.base}_{uuid.uuid4().hex[:12]}"
+        yield self.cmd("/sbin/zfs","clone",snapshot,name)
+        if self.snapshots:
+            self.snapshots.add_clone(snapshot)
+        return name
+
+    @op
+    def claim(self,snapshot,zpath):
+        """
+            Rename spare clone of snapshot to zpath - returns False if
+            none available
+        """
+        for name in (yield self.available(snapshot))[:3]:
+            try:
+                yield self.cmd("/sbin/zfs","rename",name,zpath)
+                return True
+            except subprocess.CalledProcessError:
+                # Claimed by another process
+                continue
+        return False
+
+    @op
+    def fill(self,snapshot,size=None):
+        """
+            Create spare clones of snapshot up to size (default pool size) -
+            returns number created (0 without waiting if another fill holds
+            the pool lock)
+        """
+        with try_locked(self.lockfile) as locked:
+            if not locked:
+                return 0
+            n = max(0,(self.size if size is None else size) - len((yield self.available(snapshot))))
+            for _ in range(n):
+                yield self.create(snapshot)
+            return n
+
+    def refill(self,snapshot):
+        """
+            Fill pool in background - detached process if detach is set,
+            otherwise daemon thread (blocking commands so that it can be
+            used from async callers)
+        """
+        if self.detach:
+            return subprocess.Popen([sys.executable,"-m","v6jail.clonepool",
+                                     self.base_zvol,str(self.size),snapshot],
+                                    stdin=subprocess.DEVNULL,stdout=subprocess.DEVNULL,
+                                    stderr=subprocess.DEVNULL,start_new_session=True)
+        pool = ClonePool(self.base_zvol,self.size,self.cmd.sync(),self.snapshots)
+        t = threading.Thread(target=pool.fill,args=(snapshot,),daemon=True)
+        t.start()
+        return t
+
+    @op
+    def invalidate(self,snapshot=None):
+        """
+            Destroy spare clones of this base which are not cloned from
+            snapshot (all spare clones if snapshot is None)
+        """
+        stale = [ name for (name,origin) in (yield self.members())
+                        if origin.startswith(f"{self.base_zvol}@") and origin != snapshot ]
+        for name in stale:
+            yield self.cmd.nocheck("/sbin/zfs","destroy",name)
+        return len(stale)
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Fill clone pool (see ClonePool.refill)')
+    parser.add_argument('base_zvol',help='Base dataset')
+    parser.add_argument('size',type=int,help='Pool size')
+    parser.add_argument('snapshot',help='Base snapshot')
+    args = parser.parse_args()
+    print(ClonePool(args.base_zvol,args.size).fill(args.snapshot))
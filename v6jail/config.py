@@ -1,5 +1,5 @@
 
-import ipaddress,re,subprocess,sys
+import ipaddress,json,os,re,socket,subprocess,sys
 from dataclasses import dataclass,field
 from enum import Enum
 from ipaddress import IPv6Network,IPv6Address
@@ -24,6 +24,29 @@ def bridge_mtu(bridge_if):
                         cmd('/sbin/ifconfig',bridge_if,'inet6')).groups()
     return int(mtu)
 
+def bridge_facts(bridge_if,network=True):
+    # Get (mtu,network) from single ifconfig call
+    out = cmd('/sbin/ifconfig',bridge_if,'inet6')
+    (mtu,) = re.search('mtu (\d+)',out).groups()
+    m = network and re.search('inet6 (?!fe80::)(\S*) prefixlen (\d+)',out)
+    if m:
+        (ipv6,prefixlen) = m.groups()
+        return (int(mtu),IPv6Network(f'{ipv6}/{prefixlen}',strict=False))
+    # (No global address on bridge)
+    return (int(mtu),None)
+
+def interface_index(interface):
+    # No subprocess needed - None if interface not visible to this host
+    try:
+        return socket.if_nametoindex(interface)
+    except OSError:
+        return None
+
+def gateway_index(gateway):
+    # Index of link-local gateway interface (scope) - None if global
+    (_,scope,interface) = gateway.partition("%")
+    return interface_index(interface) if scope else None
+
 def host_gateway():
     (gateway,) = re.search('gateway: (.*)',
                            cmd('/sbin/route','-6','get','default')).groups()
@@ -35,25 +58,138 @@ class HostConfig(IniEncoderMixin):
     zvol:           str = 'zroot/jail'
     bridge:         str = 'bridge0'
     mtu:            int = 1500
-    gateway:        str = field(default_factory=host_gateway)
+    gateway:        str = ''
     network:        IPv6Network = None
     proxy:          bool = False
 
     base:           str = 'base'
     mountpoint:     str = ''
 
+    epair_pool:     int = 0
+    clone_pool:     int = 0
+
+    facts_cache:    str = '/var/db/v6jail/hostfacts.json'
+
+    # Lifecycle metrics state/JSON summary and Prometheus textfile (node_exporter
+    # textfile collector) - metrics are disabled if not set
+    metrics:        str = ''
+    metrics_textfile: str = ''
+
+    # CPU placement allocation table - jails are not pinned if not set
+    # (see cpuset.Placement for policies)
+    cpuset:         str = ''
+    cpuset_policy:  str = 'spread'
+    cpuset_cpus:    int = 1
+    cpuset_numa:    bool = False
+    cpuset_reserve: str = ''
+
+    # Default rctl profile for jails (profiles are [rctl <name>] sections
+    # of the config file - see rctl.RctlProfile)
+    rctl:           str = ''
+
     salt:           bytes = b''
 
     def __post_init__(self):
-        if not cmd.check("/sbin/zfs","list",f"{self.zvol}/{self.base}"):
+        # Discovered host facts (bridge mtu/network, gateway, mountpoint) are
+        # cached and only re-probed if the fingerprint (zvol guid, bridge
+        # ifindex, gateway interface) changes or the cache lacks a value this
+        # config needs. Only probed values are cached (the cache is shared
+        # by configs for the same zvol/bridge)
+        self._configured = dict(gateway=self.gateway,
+                                network=self.network,
+                                mountpoint=self.mountpoint)
+        (fingerprint,mountpoint) = self.fingerprint()
+        facts = self.cached_facts(fingerprint)
+        if facts is None:
+            facts = self.probe_facts(fingerprint,mountpoint)
+        self.apply_facts(facts)
+
+    def fingerprint(self):
+        # Single zfs call checks base and gets zvol guid/mountpoint
+        try:
+            out = cmd("/sbin/zfs","get","-Hp","-o","name,property,value","guid,mountpoint",
+                      self.zvol,f"{self.zvol}/{self.base}")
+        except subprocess.CalledProcessError:
             raise ValueError(f"base not found: {self.zvol}/{self.base}")
-
-        if not cmd.check("/sbin/ifconfig",self.bridge):
+        props = { (n,p):v for (n,p,v) in [ l.split("\t") for l in out.split("\n") ] }
+        return (dict(zvol=self.zvol,
+                     zvol_guid=props[(self.zvol,"guid")],
+                     bridge=self.bridge,
+                     bridge_index=interface_index(self.bridge)),
+                props[(self.zvol,"mountpoint")])
+
+    def _facts_key(self):
+        return f"{self.zvol}:{self.bridge}"
+
+    def cached_facts(self,fingerprint):
+        if not self.facts_cache or fingerprint["bridge_index"] is None:
+            return None
+        try:
+            with open(self.facts_cache) as f:
+                facts = json.load(f).get(self._facts_key())
+        except (OSError,ValueError):
+            return None
+        if not facts or facts.get("fingerprint") != fingerprint:
+            return None
+        if (facts.get("network") is None and self._configured["network"] is None) or \
+           (facts.get("gateway") is None and not self._configured["gateway"]):
+            # Not probed (or not available) when cached
+            return None
+        if facts["gateway"] and facts.get("gateway_index") != gateway_index(facts["gateway"]):
+            # Gateway interface changed - route may be stale
+            return None
+        return facts
+
+    def probe_facts(self,fingerprint=None,mountpoint=None):
+        if fingerprint is None:
+            (fingerprint,mountpoint) = self.fingerprint()
+        try:
+            (mtu,network) = bridge_facts(self.bridge)
+        except subprocess.CalledProcessError:
             raise ValueError(f"bridge not found: {self.bridge}")
-
-        self.mtu = bridge_mtu(self.bridge)
-        self.network = self.network or bridge_ipv6(self.bridge)
-        self.mountpoint = self.mountpoint or cmd("/sbin/zfs","list","-H","-o","mountpoint",self.zvol)
+        # Network comes from the same ifconfig call so is always probed,
+        # gateway only if not configured
+        gateway = None if self._configured["gateway"] else host_gateway()
+        facts = dict(fingerprint=fingerprint,
+                     mtu=mtu,
+                     network=str(network) if network else None,
+                     gateway=gateway,
+                     gateway_index=gateway_index(gateway) if gateway else None,
+                     mountpoint=mountpoint)
+        self.save_facts(facts)
+        return facts
+
+    def save_facts(self,facts):
+        if not self.facts_cache or facts["fingerprint"]["bridge_index"] is None:
+            return
+        try:
+            try:
+                with open(self.facts_cache) as f:
+                    cache = json.load(f)
+            except (OSError,ValueError):
+                cache = {}
+            cache[self._facts_key()] = facts
+            os.makedirs(os.path.dirname(self.facts_cache),exist_ok=True)
+            tmp = f"{self.facts_cache}.{os.getpid()}"
+            with open(tmp,"w") as f:
+                json.dump(cache,f)
+            os.replace(tmp,self.facts_cache)
+        except OSError:
+            # Cache is optional
+            pass
+
+    def apply_facts(self,facts):
+        self.mtu = facts["mtu"]
+        self.gateway = self._configured["gateway"] or facts["gateway"]
+        self.network = self._configured["network"] or \
+                            (facts["network"] and IPv6Network(facts["network"]))
+        self.mountpoint = self._configured["mountpoint"] or facts["mountpoint"]
+
+    def refresh(self):
+        """
+            Re-probe host facts and update cache
+        """
+        self.apply_facts(self.probe_facts())
 
 @dataclass
 class JailConfig(IniEncoderMixin):
@@ -75,4 +211,6 @@ class JailConfig(IniEncoderMixin):
     private:        bool = True
     proxy:          bool = False
     bpf_rule:       int = 10
-
+    epair_pool:     int = 0
+    clone_pool:     int = 0
+    rctl:           str = ''
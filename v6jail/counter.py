@@ -14,6 +14,25 @@ def locked_fd(filename):
         fcntl.lockf(fd,fcntl.LOCK_UN)
         os.close(fd)
 
+@contextmanager
+def try_locked(filename):
+    """
+        Non-blocking exclusive flock(2) on filename - yields False if held
+        elsewhere. flock locks belong to the open file so this also
+        excludes other threads/tasks in the same process
+    """
+    fd = os.open(filename,os.O_RDWR|os.O_CREAT)
+    try:
+        try:
+            fcntl.flock(fd,fcntl.LOCK_EX|fcntl.LOCK_NB)
+        except BlockingIOError:
+            yield False
+        else:
+            yield True
+    finally:
+        # Closing fd releases lock
+        os.close(fd)
+
 def counter(filename,n=1):
     with locked_fd(filename) as fd:
         c = os.read(fd,40)
@@ -0,0 +1,211 @@
+
+import json,os,os.path,subprocess,threading
+
+from .bulk import _error
+from .counter import locked_fd
+
+# Placement policies
+#   spread      - least loaded CPUs (jails share cores evenly)
+#   pack        - fill CPUs up to PACK_SHARE jails before using next CPU
+#                 (keeps remaining cores idle)
+#   dedicated   - exclusive CPUs (not used by any other jail)
+POLICIES = ("spread","pack","dedicated")
+
+# Max jails per CPU before pack policy moves to next CPU
+PACK_SHARE = 4
+
+def parse_cpulist(s):
+    # "0-3,6" -> [0,1,2,3,6]
+    cpus = []
+    for r in s.replace(" ","").split(","):
+        if r:
+            (lo,_,hi) = r.partition("-")
+            cpus.extend(range(int(lo),int(hi or lo) + 1))
+    return cpus
+
+def cpulist(cpus):
+    return ",".join(str(c) for c in sorted(cpus))
+
+def _sysctl(out):
+    return dict(l.split(": ",1) for l in out.split("\n") if ": " in l)
+
+def probe_topology(cmd):
+    """
+        CPU topology as {domain:[cpu,...]} (single domain unless the host
+        has multiple NUMA domains)
+    """
+    v = _sysctl(cmd("/sbin/sysctl","-i","kern.smp.cpus","vm.ndomains"))
+    ncpu = int(v["kern.smp.cpus"])
+    if int(v.get("vm.ndomains",1)) < 2:
+        return { "0":list(range(ncpu)) }
+    v = _sysctl(cmd("/sbin/sysctl","-i",*[ f"dev.cpu.{c}.%domain" for c in range(ncpu) ]))
+    domains = {}
+    for c in range(ncpu):
+        domains.setdefault(v.get(f"dev.cpu.{c}.%domain","0"),[]).append(c)
+    return domains
+
+class Placement:
+
+    """
+        Per-host CPU allocation table - started jails are assigned a set of
+        CPUs (applied with cpuset -j) which is released when the jail is
+        stopped.
+
+        The table is held in a JSON state file (updated under an exclusive
+        lock so that concurrent v6 processes see the same allocations)
+        together with the probed topology. If numa is set a jail's CPUs
+        are all allocated from a single domain where possible. CPUs in
+        reserve are never allocated (eg. left for the host)
+    """
+
+    def __init__(self,state,cmd,policy="spread",cpus=1,numa=False,reserve=""):
+        if policy not in POLICIES:
+            raise ValueError(f"Invalid cpuset policy: {policy} (expecting {'|'.join(POLICIES)})")
+        self.state = state
+        self.cmd = cmd
+        self.policy = policy
+        self.cpus = cpus
+        self.numa = numa
+        self.reserve = set(parse_cpulist(reserve))
+        # lockf() only excludes other processes
+        self.lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls,config,cmd):
+        # Returns None if placement is disabled
+        if config.cpuset:
+            return cls(config.cpuset,cmd,config.cpuset_policy,config.cpuset_cpus,
+                       config.cpuset_numa,config.cpuset_reserve)
+        return None
+
+    def load(self):
+        try:
+            with open(self.state) as f:
+                return self.decode(f.read())
+        except FileNotFoundError:
+            return self.decode("")
+
+    def decode(self,data):
+        state = json.loads(data) if data.strip() else {}
+        state.setdefault("topology",None)
+        state.setdefault("jails",{})
+        return state
+
+    def update(self,f):
+        """
+            Run f(state) under lock and write back state - returns result
+        """
+        os.makedirs(os.path.dirname(self.state) or ".",exist_ok=True)
+        with self.lock, locked_fd(self.state) as fd:
+            data = b""
+            while chunk := os.read(fd,1<<16):
+                data += chunk
+            state = self.decode(data.decode())
+            if state["topology"] is None:
+                state["topology"] = probe_topology(self.cmd)
+            result = f(state)
+            out = json.dumps(state,indent=1).encode()
+            os.lseek(fd,0,os.SEEK_SET)
+            os.write(fd,out)
+            os.ftruncate(fd,len(out))
+        return result
+
+    def allocate(self,state,policy,n,prefer=()):
+        """
+            Choose n CPUs for policy given current allocations (CPUs in
+            prefer are chosen over equally loaded CPUs)
+        """
+        load = {}
+        dedicated = set()
+        for a in state["jails"].values():
+            for c in a["cpus"]:
+                load[c] = load.get(c,0) + 1
+                if a["policy"] == "dedicated":
+                    dedicated.add(c)
+        domains = state["topology"].values()
+        groups = [ [ c for c in cpus if c not in self.reserve and c not in dedicated ]
+                        for cpus in (domains if self.numa else [sum(domains,[])]) ]
+        if policy == "dedicated":
+            groups = [ [ c for c in g if not load.get(c) ] for g in groups ]
+        rank = {
+            "spread":       lambda c: (load.get(c,0),),
+            "pack":         lambda c: (0,-load.get(c,0)) if load.get(c,0) < PACK_SHARE
+                                                       else (1,load.get(c,0)),
+            "dedicated":    lambda c: (),
+        }[policy]
+        key = lambda c: (*rank(c),c not in prefer,c)
+        candidates = [ sorted(g,key=key)[:n] for g in groups if len(g) >= n ]
+        if not candidates and self.numa and policy != "dedicated":
+            # No single domain large enough - allocate across domains
+            candidates = [ sorted(sum(groups,[]),key=key)[:n] ]
+        if not candidates or len(candidates[0]) < n:
+            raise ValueError(f"Not enough CPUs for {policy} cpuset ({n} cpus)")
+        if policy == "spread":
+            # Least loaded domain
+            return min(candidates,key=lambda cpus: sum(load.get(c,0) for c in cpus))
+        elif policy == "pack":
+            return min(candidates,key=lambda cpus: [ key(c) for c in cpus ])
+        return candidates[0]
+
+    def claim(self,name,jname,policy=None,cpus=None):
+        """
+            Allocate CPUs for jail (re-using existing allocation if policy
+            and size match) - returns list of CPUs. Allocations are applied
+            with apply() once the jail exists
+        """
+        policy = policy or self.policy
+        n = cpus or self.cpus
+        if policy not in POLICIES:
+            raise ValueError(f"Invalid cpuset policy: {policy} (expecting {'|'.join(POLICIES)})")
+        def _claim(state):
+            a = state["jails"].get(name)
+            if not (a and a["policy"] == policy and len(a["cpus"]) == n):
+                state["jails"].pop(name,None)
+                a = dict(jname=jname,policy=policy,cpus=self.allocate(state,policy,n))
+                state["jails"][name] = a
+            return a["cpus"]
+        return self.update(_claim)
+
+    def apply(self,jname,cpus):
+        self.cmd("/bin/cpuset","-l",cpulist(cpus),"-j",jname)
+
+    def release(self,name):
+        def _release(state):
+            return state["jails"].pop(name,None) is not None
+        return self.update(_release)
+
+    def rebalance(self,running,dry_run=False):
+        """
+            Drop allocations for jails which are not running (running is set
+            of jnames) and reallocate remaining jails from an empty table
+            (dedicated first, topology re-probed, current CPUs kept where
+            balanced). Changed cpusets are applied - a jail which fails
+            (eg. stopped since the jls snapshot) doesn't stop the others.
+
+            Returns [(name,old_cpus,new_cpus,error),...] for changed jails
+            (error is None if applied)
+        """
+        def _rebalance(state):
+            state["topology"] = probe_topology(self.cmd)
+            jails = { k:a for (k,a) in state["jails"].items() if a["jname"] in running }
+            state["jails"] = {}
+            for (name,a) in sorted(jails.items(),key=lambda i: (i[1]["policy"] != "dedicated",i[0])):
+                state["jails"][name] = dict(a,cpus=self.allocate(state,a["policy"],len(a["cpus"]),
+                                                                 a["cpus"]))
+            return [ (name,a["jname"],a["cpus"],state["jails"][name]["cpus"])
+                        for (name,a) in jails.items()
+                        if sorted(a["cpus"]) != sorted(state["jails"][name]["cpus"]) ]
+        if dry_run:
+            return [ (name,old,new,None) for (name,_,old,new) in _rebalance(self.load()) ]
+        changed = []
+        for (name,jname,old,new) in self.update(_rebalance):
+            try:
+                self.apply(jname,new)
+                changed.append((name,old,new,None))
+            except subprocess.CalledProcessError as e:
+                changed.append((name,old,new,_error(e)))
+        return changed
+
+    def rows(self):
+        return [ dict(name=name,jname=a["jname"],policy=a["policy"],cpus=cpulist(a["cpus"]))
+                    for (name,a) in sorted(self.load()["jails"].items()) ]
@@ -0,0 +1,193 @@
+
+import io,json,os,signal,socket,socketserver,sys,threading
+
+# Verbs which change host-wide state (run exclusively)
+HOST_VERBS = {"config","update-base","clone-base","gc-base","clone-pool","epair-pool",
+              "new-many","start-many","stop-many","destroy-many"}
+
+class RWLock:
+
+    """
+        Readers/writer lock - jail operations hold the lock shared, host
+        operations hold it exclusively
+    """
+
+    def __init__(self):
+        self.cond = threading.Condition()
+        self.readers = 0
+        self.writer = False
+
+    def acquire(self,exclusive=False):
+        with self.cond:
+            if exclusive:
+                while self.writer or self.readers:
+                    self.cond.wait()
+                self.writer = True
+            else:
+                while self.writer:
+                    self.cond.wait()
+                self.readers += 1
+
+    def release(self,exclusive=False):
+        with self.cond:
+            if exclusive:
+                self.writer = False
+            else:
+                self.readers -= 1
+            self.cond.notify_all()
+
+class ThreadLocalStream(io.TextIOBase):
+
+    """
+        Replacement for sys.stdout/sys.stderr which writes to a per-thread
+        buffer when one is set (used to capture command output per request)
+    """
+
+    def __init__(self,stream):
+        self.stream = stream
+        self.local = threading.local()
+
+    @property
+    def encoding(self):
+        return "utf-8"
+
+    @property
+    def errors(self):
+        return "strict"
+
+    def isatty(self):
+        return False
+
+    def write(self,s):
+        buf = getattr(self.local,"buf",None)
+        return (buf or self.stream).write(s)
+
+    def flush(self):
+        buf = getattr(self.local,"buf",None)
+        (buf or self.stream).flush()
+
+class Daemon(socketserver.ThreadingMixIn,socketserver.UnixStreamServer):
+
+    """
+        Serve CLI verbs over a Unix socket using a resident Host (host
+        discovery is done once at startup). Requests are JSON lines:
+
+            {"argv": ["start","name",...]} -> {"rc": 0, "output": "..."}
+
+        Operations on the same jail are serialised and host-wide
+        operations are run exclusively, other requests run concurrently
+    """
+
+    daemon_threads = True
+
+    def __init__(self,path,host,ddns):
+        self.host = host
+        self.ddns = ddns
+        self.host_lock = RWLock()
+        self.jail_locks = {}
+        self.jail_locks_lock = threading.Lock()
+        if os.path.exists(path):
+            os.unlink(path)
+        super().__init__(path,Handler)
+        os.chmod(path,0o600)
+        sys.stdout = ThreadLocalStream(sys.stdout)
+        sys.stderr = ThreadLocalStream(sys.stderr)
+
+    def jail_lock(self,name):
+        with self.jail_locks_lock:
+            return self.jail_locks.setdefault(name,threading.Lock())
+
+    def dispatch(self,argv):
+        import click
+        from .cli import cli
+        verb = argv[0] if argv else ""
+        command = cli.get_command(None,verb)
+        name = None
+        if command:
+            try:
+                ctx = command.make_context(verb,[*argv[1:]],resilient_parsing=True)
+                name = ctx.params.get("name")
+            except click.ClickException:
+                pass
+        exclusive = verb in HOST_VERBS
+        self.host_lock.acquire(exclusive)
+        lock = self.jail_lock(name) if isinstance(name,str) else None
+        try:
+            if lock:
+                lock.acquire()
+            return self.run(argv)
+        finally:
+            if lock:
+                lock.release()
+            self.host_lock.release(exclusive)
+
+    def run(self,argv):
+        import click
+        from .cli import cli
+        buf = io.StringIO()
+        sys.stdout.local.buf = sys.stderr.local.buf = buf
+        try:
+            cli.main(args=argv,prog_name="v6",standalone_mode=False,
+                     obj={"host":self.host,"ddns":self.ddns})
+            rc = 0
+        except click.ClickException as e:
+            e.show(file=buf)
+            rc = e.exit_code
+        except click.exceptions.Exit as e:
+            rc = e.exit_code
+        except click.exceptions.Abort:
+            rc = 1
+        except Exception as e:
+            buf.write(f"Error: {e}\n")
+            rc = 1
+        finally:
+            sys.stdout.local.buf = sys.stderr.local.buf = None
+        return (rc,buf.getvalue())
+
+class Handler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        try:
+            request = json.loads(self.rfile.readline())
+            (rc,output) = self.server.dispatch(request["argv"])
+        except (ValueError,KeyError) as e:
+            (rc,output) = (2,f"Error: invalid request: {e}\n")
+        self.wfile.write(json.dumps({"rc":rc,"output":output}).encode() + b"\n")
+
+def client(path,argv,quiet=False):
+    """
+        Send argv to v6jaild - prints output (unless quiet) and returns
+        exit code
+    """
+    with socket.socket(socket.AF_UNIX,socket.SOCK_STREAM) as s:
+        s.connect(path)
+        s.sendall(json.dumps({"argv":argv}).encode() + b"\n")
+        with s.makefile("rb") as f:
+            response = json.loads(f.readline())
+    if not quiet:
+        sys.stdout.write(response["output"])
+    return response["rc"]
+
+def main():
+    import argparse
+    from .cli import DEFAULT_SOCKET,load_host
+    parser = argparse.ArgumentParser(description='v6jail daemon')
+    parser.add_argument('--socket',default=os.environ.get('V6JAIL_SOCKET',DEFAULT_SOCKET),
+                        help='Socket path')
+    parser.add_argument('--config',type=argparse.FileType('r'),help='Host config')
+    parser.add_argument('--ddns',type=argparse.FileType('r'),help='DDNS config')
+    parser.add_argument('--base',help='Base')
+    parser.add_argument('--debug',action='store_true',help='Debug')
+    args = parser.parse_args()
+    (host,ddns) = load_host(args.debug,args.base,args.config,args.ddns)
+    signal.signal(signal.SIGTERM,lambda signum,frame: sys.exit(0))
+    with Daemon(args.socket,host,ddns) as server:
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            os.unlink(args.socket)
+
+if __name__ == '__main__':
+    main()
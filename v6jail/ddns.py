@@ -18,11 +18,51 @@ class DDNSConfig(IniEncoderMixin):
     tsig:           str = ''
     nsupdate:       str = '/usr/local/bin/knsupdate'
     debug:          bool = False
+    backend:        str = 'nsupdate'
+    batch_interval: float = 0.0
+    timeout:        float = 5.0
 
     def __post_init__(self):
         self.cmd = Command(self.debug)
+        self._client = None
+        self._queue = None
+
+    def client(self):
+        # Native RFC 2136 client (connection is reused between updates)
+        if self._client is None:
+            from .dnsupdate import DNSUpdateClient
+            self._client = DNSUpdateClient(self.server,self.zone,self.ttl,self.tsig,self.timeout)
+        return self._client
+
+    def queue(self):
+        # Coalesce concurrent updates into one message per batch_interval
+        if self._queue is None:
+            from .dnsupdate import UpdateQueue
+            self._queue = UpdateQueue(self.client(),self.batch_interval)
+        return self._queue
 
     def update(self,*cmds):
+        """
+            Send add/del commands (nsupdate syntax) as a single update
+        """
+        if self.backend == 'nsupdate':
+            return self.nsupdate_update(*cmds)
+        elif self.backend != 'native':
+            raise ValueError(f"Invalid DDNS backend: {self.backend}")
+        from .dnsupdate import UnsupportedRecordType
+        try:
+            if self.debug:
+                print("DDNS:",cmds)
+            if self.batch_interval:
+                return self.queue().submit(*cmds).result()
+            return self.client().update(*cmds)
+        except UnsupportedRecordType:
+            # Record types the native client can't encode (SRV, MX etc)
+            return self.nsupdate_update(*cmds)
+        except OSError as e:
+            raise ValueError(f"DDNS update failed: {self.server}: {e}")
+
+    def nsupdate_update(self,*cmds):
         request = [ f'server {self.server}'.encode(),
                     f'zone {self.zone}'.encode(),
                     f'origin {self.zone}'.encode(),
@@ -35,4 +75,3 @@ class DDNSConfig(IniEncoderMixin):
         request.append(b'send')
         request.append(b'answer')
         return self.cmd(self.nsupdate,input=b'\n'.join(request))
-
@@ -0,0 +1,377 @@
+
+import base64,hashlib,hmac,ipaddress,random,socket,struct,threading,time
+
+# RFC 2136 DNS UPDATE client with RFC 8945 TSIG signing (TCP transport).
+# Accepts the same add/del commands as nsupdate(1):
+#
+#   add <name> [ttl] [IN] <type> <data>
+#   del <name> [ttl] [IN] [<type> [<data>]]
+#
+# Names which are not fully qualified are relative to the zone
+
+OPCODE_UPDATE   = 5
+CLASS_IN        = 1
+CLASS_NONE      = 254
+CLASS_ANY       = 255
+TYPE_SOA        = 6
+TYPE_TSIG       = 250
+TYPE_ANY        = 255
+
+TYPES = { "A":1, "NS":2, "CNAME":5, "PTR":12, "TXT":16, "AAAA":28 }
+
+RCODES = { 0:"NOERROR", 1:"FORMERR", 2:"SERVFAIL", 3:"NXDOMAIN", 4:"NOTIMP",
+           5:"REFUSED", 6:"YXDOMAIN", 7:"YXRRSET", 8:"NXRRSET", 9:"NOTAUTH",
+           10:"NOTZONE", 16:"BADSIG", 17:"BADKEY", 18:"BADTIME" }
+
+TSIG_ALGORITHMS = { "hmac-md5":         ("hmac-md5.sig-alg.reg.int.",hashlib.md5),
+                    "hmac-sha1":        ("hmac-sha1.",hashlib.sha1),
+                    "hmac-sha224":      ("hmac-sha224.",hashlib.sha224),
+                    "hmac-sha256":      ("hmac-sha256.",hashlib.sha256),
+                    "hmac-sha384":      ("hmac-sha384.",hashlib.sha384),
+                    "hmac-sha512":      ("hmac-sha512.",hashlib.sha512) }
+
+class UnsupportedRecordType(ValueError):
+    pass
+
+class DNSUpdateError(ValueError):
+
+    def __init__(self,rcode,msg=""):
+        self.rcode = rcode
+        super().__init__(f"DNS UPDATE failed: {RCODES.get(rcode,rcode)}{' - ' + msg if msg else ''}")
+
+def encode_name(name):
+    name = name.rstrip(".")
+    out = b""
+    for label in name.split(".") if name else []:
+        label = label.encode("idna") if not label.isascii() else label.encode()
+        if not 0 < len(label) < 64:
+            raise ValueError(f"Invalid DNS name: {name}")
+        out += bytes([len(label)]) + label
+    return out + b"\0"
+
+def read_name(msg,off):
+    """
+        Decode (possibly compressed) name at offset - returns (name,next_offset)
+    """
+    labels = []
+    end = None
+    for _ in range(128):
+        n = msg[off]
+        if n & 0xc0 == 0xc0:
+            if end is None:
+                end = off + 2
+            off = struct.unpack_from("!H",msg,off)[0] & 0x3fff
+        elif n == 0:
+            return (".".join(labels) + ".",end if end is not None else off + 1)
+        else:
+            labels.append(msg[off+1:off+1+n].decode("ascii","replace"))
+            off += n + 1
+    raise ValueError("Invalid DNS name (loop)")
+
+def encode_rdata(rtype,data):
+    if rtype == "AAAA":
+        return ipaddress.IPv6Address(data).packed
+    elif rtype == "A":
+        return ipaddress.IPv4Address(data).packed
+    elif rtype in ("CNAME","PTR","NS"):
+        return encode_name(data)
+    elif rtype == "TXT":
+        text = data.strip('"').encode()
+        return b"".join(bytes([len(text[i:i+255])]) + text[i:i+255]
+                            for i in range(0,max(len(text),1),255))
+    raise ValueError(f"Unsupported record type: {rtype}")
+
+def encode_rr(name,rtype,rclass,ttl,rdata=b""):
+    return encode_name(name) + struct.pack("!HHIH",rtype,rclass,ttl,len(rdata)) + rdata
+
+def read_rr(msg,off):
+    """
+        Decode RR at offset - returns ((name,type,class,ttl,rdata),next_offset)
+    """
+    (name,off) = read_name(msg,off)
+    (rtype,rclass,ttl,rdlen) = struct.unpack_from("!HHIH",msg,off)
+    off += 10
+    return ((name,rtype,rclass,ttl,msg[off:off+rdlen]),off + rdlen)
+
+def parse_key(key):
+    """
+        Parse TSIG key in nsupdate(1) format: [alg:]name secret
+    """
+    (name,secret) = key.split()
+    (alg,_,name) = name.rpartition(":")
+    alg = alg or "hmac-sha256"
+    if alg not in TSIG_ALGORITHMS:
+        raise ValueError(f"Unsupported TSIG algorithm: {alg}")
+    return (name if name.endswith(".") else name + ".",alg,base64.b64decode(secret))
+
+def _tsig_mac(key,msg,time_signed,fudge,error=0,other=b"",request_mac=b""):
+    (key_name,alg,secret) = key
+    (alg_name,digest) = TSIG_ALGORITHMS[alg]
+    variables = encode_name(key_name.lower()) + struct.pack("!HI",CLASS_ANY,0) + \
+                encode_name(alg_name) + \
+                struct.pack("!HIHHH",time_signed >> 32,time_signed & 0xffffffff,fudge,error,len(other)) + \
+                other
+    prefix = struct.pack("!H",len(request_mac)) + request_mac if request_mac else b""
+    return hmac.new(secret,prefix + msg + variables,digest).digest()
+
+def tsig_sign(key,msg,request_mac=b"",fudge=300,error=0):
+    """
+        Append TSIG RR to message - returns (signed_message,mac)
+    """
+    (key_name,alg,secret) = key
+    time_signed = int(time.time())
+    mac = _tsig_mac(key,msg,time_signed,fudge,error,request_mac=request_mac)
+    (msg_id,) = struct.unpack_from("!H",msg)
+    rdata = encode_name(TSIG_ALGORITHMS[alg][0]) + \
+            struct.pack("!HIHH",time_signed >> 32,time_signed & 0xffffffff,fudge,len(mac)) + mac + \
+            struct.pack("!HHH",msg_id,error,0)
+    (arcount,) = struct.unpack_from("!H",msg,10)
+    signed = msg[:10] + struct.pack("!H",arcount + 1) + msg[12:] + \
+             encode_rr(key_name,TYPE_TSIG,CLASS_ANY,0,rdata)
+    return (signed,mac)
+
+def tsig_error(key,msg,error,fudge=300):
+    """
+        Append unsigned TSIG RR (empty MAC) carrying TSIG error (BADSIG/
+        BADKEY) to response - RFC 8945 5.3.2
+    """
+    (key_name,alg,_) = key
+    time_signed = int(time.time())
+    (msg_id,) = struct.unpack_from("!H",msg)
+    rdata = encode_name(TSIG_ALGORITHMS[alg][0]) + \
+            struct.pack("!HIHH",time_signed >> 32,time_signed & 0xffffffff,fudge,0) + \
+            struct.pack("!HHH",msg_id,error,0)
+    (arcount,) = struct.unpack_from("!H",msg,10)
+    return msg[:10] + struct.pack("!H",arcount + 1) + msg[12:] + \
+           encode_rr(key_name,TYPE_TSIG,CLASS_ANY,0,rdata)
+
+def tsig_verify(key,msg,request_mac=b""):
+    """
+        Verify TSIG RR (last additional record) - returns (mac,error) or
+        raises DNSUpdateError
+    """
+    (qdcount,ancount,nscount,arcount) = struct.unpack_from("!HHHH",msg,4)
+    if arcount == 0:
+        raise DNSUpdateError(16,"message not signed")
+    off = 12
+    for _ in range(qdcount):
+        off = read_name(msg,off)[1] + 4
+    for _ in range(ancount + nscount + arcount - 1):
+        off = read_rr(msg,off)[1]
+    start = off
+    ((name,rtype,_,_,rdata),_) = read_rr(msg,off)
+    if rtype != TYPE_TSIG:
+        raise DNSUpdateError(16,"message not signed")
+    if name.lower() != key[0].lower():
+        raise DNSUpdateError(17,f"unknown key: {name}")
+    (_,roff) = read_name(rdata,0)
+    (hi,lo,fudge,maclen) = struct.unpack_from("!HIHH",rdata,roff)
+    mac = rdata[roff+10:roff+10+maclen]
+    (orig_id,error,otherlen) = struct.unpack_from("!HHH",rdata,roff+10+maclen)
+    other = rdata[roff+16+maclen:roff+16+maclen+otherlen]
+    if error and not mac:
+        # Unsigned error response (BADSIG/BADKEY)
+        raise DNSUpdateError(error)
+    unsigned = struct.pack("!H",orig_id) + msg[2:10] + struct.pack("!H",arcount - 1) + msg[12:start]
+    time_signed = (hi << 32) | lo
+    expected = _tsig_mac(key,unsigned,time_signed,fudge,error,other,request_mac)
+    if not hmac.compare_digest(mac,expected):
+        raise DNSUpdateError(16,"bad signature")
+    if abs(time.time() - time_signed) > fudge:
+        raise DNSUpdateError(18,"bad time")
+    return (mac,error)
+
+class DNSUpdateClient:
+
+    """
+        Send RFC 2136 UPDATE messages to server over a persistent TCP
+        connection (reconnects once if the server has closed it)
+    """
+
+    def __init__(self,server,zone,ttl=60,tsig='',timeout=5.0):
+        (host,_,port) = server.partition(" ")
+        self.server = (host,int(port or 53))
+        self.zone = zone if zone.endswith(".") else zone + "."
+        self.ttl = ttl
+        self.key = parse_key(tsig) if tsig else None
+        self.timeout = timeout
+        self.sock = None
+        self.lock = threading.Lock()
+
+    def fqdn(self,name):
+        if name == "@":
+            return self.zone
+        return name if name.endswith(".") else f"{name}.{self.zone}"
+
+    def records(self,*cmds):
+        """
+            Encode add/del commands as update section RRs
+        """
+        rrs = []
+        for c in cmds:
+            (op,name,*args) = c.split()
+            if args and args[0].isdigit():
+                (ttl,*args) = args
+                ttl = int(ttl)
+            else:
+                ttl = self.ttl
+            if args and args[0].upper() == "IN":
+                args = args[1:]
+            rtype = args[0].upper() if args else None
+            if rtype and rtype not in TYPES:
+                raise UnsupportedRecordType(f"Unsupported record type: {rtype}")
+            data = " ".join(args[1:])
+            if op == "add":
+                if not (rtype and data):
+                    raise ValueError(f"Invalid add: {c}")
+                rrs.append(encode_rr(self.fqdn(name),TYPES[rtype],CLASS_IN,ttl,encode_rdata(rtype,data)))
+            elif op in ("del","delete"):
+                if rtype is None:
+                    rrs.append(encode_rr(self.fqdn(name),TYPE_ANY,CLASS_ANY,0))
+                elif not data:
+                    rrs.append(encode_rr(self.fqdn(name),TYPES[rtype],CLASS_ANY,0))
+                else:
+                    rrs.append(encode_rr(self.fqdn(name),TYPES[rtype],CLASS_NONE,0,
+                                         encode_rdata(rtype,data)))
+            else:
+                raise ValueError(f"Invalid update command: {c}")
+        return rrs
+
+    def message(self,rrs):
+        msg_id = random.getrandbits(16)
+        header = struct.pack("!HHHHHH",msg_id,OPCODE_UPDATE << 11,1,0,len(rrs),0)
+        zone = encode_name(self.zone) + struct.pack("!HH",TYPE_SOA,CLASS_IN)
+        return header + zone + b"".join(rrs)
+
+    def _connect(self):
+        self.sock = socket.create_connection(self.server,timeout=self.timeout)
+
+    def _recv(self,n):
+        data = b""
+        while len(data) < n:
+            chunk = self.sock.recv(n - len(data))
+            if not chunk:
+                raise ConnectionResetError("DNS server closed connection")
+            data += chunk
+        return data
+
+    def exchange(self,msg):
+        with self.lock:
+            for attempt in (0,1):
+                try:
+                    if self.sock is None:
+                        self._connect()
+                    self.sock.sendall(struct.pack("!H",len(msg)) + msg)
+                    (n,) = struct.unpack("!H",self._recv(2))
+                    return self._recv(n)
+                except OSError:
+                    self.close()
+                    if attempt:
+                        raise
+
+    def send(self,rrs):
+        msg = self.message(rrs)
+        request_mac = b""
+        if self.key:
+            (msg,request_mac) = tsig_sign(self.key,msg)
+        response = self.exchange(msg)
+        if response[:2] != msg[:2]:
+            raise DNSUpdateError(1,"response id mismatch")
+        (flags,) = struct.unpack_from("!H",response,2)
+        (arcount,) = struct.unpack_from("!H",response,10)
+        if self.key and (arcount or not flags & 0xf):
+            # Servers reply to requests failing TSIG checks unsigned (NOTAUTH)
+            (_,error) = tsig_verify(self.key,response,request_mac)
+            if error:
+                raise DNSUpdateError(error)
+        elif self.key and flags & 0xf == 9:
+            # NOTAUTH without TSIG RR - request signature rejected
+            raise DNSUpdateError(16,"request not authenticated")
+        if flags & 0xf:
+            raise DNSUpdateError(flags & 0xf)
+        return RCODES[0]
+
+    def update(self,*cmds):
+        return self.send(self.records(*cmds))
+
+    def close(self):
+        if self.sock:
+            try:
+                self.sock.close()
+            finally:
+                self.sock = None
+
+class UpdateQueue:
+
+    """
+        Coalesce update commands submitted by concurrent callers into a
+        single UPDATE message per flush interval. submit() returns a
+        concurrent.futures.Future which completes when the update is sent.
+        If a batch is rejected the submissions are retried separately so
+        that one bad update does not fail the others
+    """
+
+    def __init__(self,client,interval=0.1,max_batch=256):
+        self.client = client
+        self.interval = interval
+        self.max_batch = max_batch
+        self.pending = []
+        self.cond = threading.Condition()
+        self.thread = None
+
+    def submit(self,*cmds):
+        from concurrent.futures import Future
+        rrs = self.client.records(*cmds)
+        future = Future()
+        with self.cond:
+            self.pending.append((rrs,future))
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run,daemon=True)
+                self.thread.start()
+            if len(self.pending) == 1 or len(self.pending) >= self.max_batch:
+                # Wake worker - first submission starts the batch interval
+                self.cond.notify()
+        return future
+
+    def _take(self):
+        batch = []
+        while self.pending and len(batch) < self.max_batch:
+            batch.append(self.pending.pop(0))
+        return batch
+
+    def _send(self,batch):
+        try:
+            result = self.client.send([ rr for (rrs,_) in batch for rr in rrs ])
+            for (_,f) in batch:
+                f.set_result(result)
+        except DNSUpdateError as e:
+            if len(batch) == 1 or e.rcode >= 16:
+                # Single update or TSIG error (retrying separately won't help)
+                for (_,f) in batch:
+                    f.set_exception(e)
+            else:
+                for item in batch:
+                    self._send([item])
+        except Exception as e:
+            for (_,f) in batch:
+                f.set_exception(e)
+
+    def _run(self):
+        while True:
+            with self.cond:
+                while not self.pending:
+                    self.cond.wait()
+                self.cond.wait(self.interval)
+                batch = self._take()
+            self._send(batch)
+
+    def flush(self):
+        """
+            Send pending updates now
+        """
+        while True:
+            with self.cond:
+                batch = self._take()
+            if not batch:
+                break
+            self._send(batch)
@@ -0,0 +1,88 @@
+
+import subprocess,threading
+
+from .util import Command,op
+
+# Serialise operations on shared host resources (bridge membership)
+bridge_lock = threading.Lock()
+
+class EpairPool:
+
+    """
+        Pool of pre-created epair interfaces which are already MTU
+        configured and added to the bridge. Pool state is held by the
+        kernel using an interface group (host side of available epairs
+        are members of the group) so is shared between processes
+
+        A pair is claimed by removing the host side from the group and
+        renaming/configuring both sides. If two processes race for the
+        same pair the loser's ifconfig fails and it tries the next one.
+        Pairs are not returned to the pool on stop (addresses assigned
+        in the jail may persist) - they are destroyed and the pool
+        refilled to the low-water mark
+
+        Methods are ops (see util.op) - coroutines if cmd is an AsyncCommand
+    """
+
+    group = "v6pool"
+
+    def __init__(self,bridge,mtu,low_water=0,private=True,cmd=None):
+        self.bridge = bridge
+        self.mtu = mtu
+        self.low_water = low_water
+        self.private = private
+        self.cmd = cmd or Command()
+
+    @op
+    def available(self):
+        try:
+            out = yield self.cmd("/sbin/ifconfig","-g",self.group)
+        except subprocess.CalledProcessError:
+            return []
+        return out.split() if out else []
+
+    @op
+    def create(self):
+        epair = (yield self.cmd("/sbin/ifconfig","epair","create"))[:-1]
+        yield self.cmd("/sbin/ifconfig",f"{epair}b","mtu",str(self.mtu))
+        yield self.cmd("/sbin/ifconfig",f"{epair}a","inet6","-auto_linklocal","mtu",str(self.mtu),"up")
+        if self.private:
+            yield self.cmd.locked(bridge_lock,lambda: self.cmd("/sbin/ifconfig",self.bridge,
+                                            "addm",f"{epair}a","private",f"{epair}a"))
+        else:
+            yield self.cmd.locked(bridge_lock,lambda: self.cmd("/sbin/ifconfig",self.bridge,
+                                            "addm",f"{epair}a"))
+        # Only make available when fully configured
+        yield self.cmd("/sbin/ifconfig",f"{epair}a","group",self.group)
+        return epair
+
+    @op
+    def fill(self):
+        n = max(0,self.low_water - len((yield self.available())))
+        for _ in range(n):
+            yield self.create()
+        return n
+
+    @op
+    def drain(self):
+        available = yield self.available()
+        for a in available:
+            yield self.cmd.nocheck("/sbin/ifconfig",a,"destroy")
+        return len(available)
+
+    @op
+    def claim(self,host_args,jail_args,tries=3):
+        """
+            Claim pooled epair - host_args/jail_args are the ifconfig
+            arguments (starting with 'name <new>') applied to each side.
+            Returns False if no pair could be claimed
+        """
+        for a in (yield self.available())[:tries]:
+            try:
+                yield self.cmd("/sbin/ifconfig",a,*host_args,"-group",self.group)
+            except subprocess.CalledProcessError:
+                # Claimed by another process (or name conflict)
+                continue
+            yield self.cmd("/sbin/ifconfig",f"{a[:-1]}b",*jail_args)
+            return True
+        return False
@@ -0,0 +1,859 @@
+
+import json,os,os.path,shutil,socket,struct,subprocess,threading,time
+
+class FakeError(Exception):
+
+    def __init__(self,msg,rc=1):
+        super().__init__(msg)
+        self.msg = msg
+        self.rc = rc
+
+def _opts(args,flags='',params=''):
+    """
+        Minimal getopt: returns (opts,args) where flags are boolean options
+        and params take a value (repeated params are collected in a list)
+    """
+    opts = {}
+    args = list(args)
+    while args and args[0].startswith('-') and args[0] != '-':
+        a = args.pop(0)
+        for i,c in enumerate(a[1:]):
+            if c in params:
+                v = a[i+2:] or args.pop(0)
+                opts.setdefault(c,[]).append(v)
+                break
+            elif c in flags:
+                opts[c] = True
+            else:
+                raise FakeError(f"illegal option -- {c}",2)
+    return opts,args
+
+class FakeFreeBSD:
+
+    """
+        In-process stateful emulation of the FreeBSD commands used by
+        v6jail (zfs, jls, ifconfig, route, mount, jail, jexec, sysrc, pw).
+
+        Can be used as a Command executor to drive the full jail lifecycle
+        on non-FreeBSD hosts (for benchmarking/load testing). If `root` is
+        set ZFS mountpoints are created under this directory so that jail
+        file operations work. If `state` is set the emulated state is
+        loaded from/saved to a JSON file (allowing use across processes)
+    """
+
+    def __init__(self,zvol='zroot/jail',base='base',bridge='bridge0',
+                      network='2001:db8::/64',root=None,state=None):
+        self.lock = threading.RLock()
+        self.root = root
+        self.state = state
+        self.calls = []
+        if state and os.path.exists(state):
+            with open(state) as f:
+                self.__dict__.update(json.load(f))
+            self.calls = []
+            return
+        self.clock = int(time.time())
+        self.next_jid = 1
+        self.next_epair = 0
+        self.next_ether = 1
+        self.hostname = 'fake.example.com'
+        self.datasets = {}
+        self.interfaces = {}
+        self.jails = {}
+        self.mounts = []
+        self.routes = {}
+        self.sysrc = {}
+        self.users = {}
+        self.cpus = 8
+        self.domains = 2
+        pool = zvol.split('/')[0]
+        self._add_dataset(pool,mountpoint=self._path(f'/{pool}'))
+        self._add_dataset(zvol,mountpoint=self._path(f'/{zvol}'))
+        self._add_dataset(f'{zvol}/{base}')
+        if root:
+            for d in ('dev','etc','home','root','tmp'):
+                os.makedirs(f'{self._mountpoint(f"{zvol}/{base}")}/{d}',exist_ok=True)
+        self._snapshot(f'{zvol}/{base}@{self.clock}')
+        self._add_interface('em0')
+        self._add_interface(bridge,groups=['bridge'],members=[],
+                            inet6=[f'{network.split("/")[0]}1/{network.split("/")[1]}'])
+        self.routes['default'] = ('fe80::1%em0','em0')
+
+    def _path(self,p):
+        return f'{self.root}{p}' if self.root else p
+
+    def save(self,path=None):
+        state = { k:v for k,v in self.__dict__.items()
+                        if k not in ('lock','calls','state','root') }
+        with open(path or self.state,'w') as f:
+            json.dump(state,f)
+
+    # Executor interface
+
+    def run(self,args,input=None,capture=True):
+        with self.lock:
+            self.calls.append(args)
+            cmd = os.path.basename(args[0])
+            handler = getattr(self,f'_cmd_{cmd}',None)
+            if handler is None:
+                raise FileNotFoundError(2,'No such file or directory',args[0])
+            try:
+                out = handler(list(args[1:]),input) or ''
+                rc,err = 0,''
+            except FakeError as e:
+                out,rc,err = '',e.rc,f'{cmd}: {e.msg}'
+            if self.state:
+                self.save()
+        if not capture:
+            # Output of uncaptured commands is discarded
+            return subprocess.CompletedProcess(args,rc)
+        return subprocess.CompletedProcess(args,rc,out.encode(),err.encode())
+
+    def pipe(self,src,dst,progress=None):
+        with self.lock:
+            self.calls.append((*src,'|',*dst))
+            sopts,sargs = _opts(src[2:],'cwvLeDpPRn','it')
+            ropts,rargs = _opts(dst[2:],'vFsnuMe','oxd')
+            source = sargs[0] if sargs else None
+            if source not in self.datasets:
+                return (1,1)
+            dest = rargs[0]
+            if dest in self.datasets:
+                if not ('F' in ropts and 'i' in sopts):
+                    return (0,1)
+            else:
+                self._add_dataset(dest)
+                self._copy_tree(source.split('@')[0],dest)
+            self._snapshot(f"{dest}@{source.split('@')[1]}")
+            # Snapshot guid is preserved by send/recv
+            self.datasets[f"{dest}@{source.split('@')[1]}"]['guid'] = self.datasets[source]['guid']
+            if self.state:
+                self.save()
+            return (0,0)
+
+    def stream(self,args,output,timeout=None):
+        from .util import _stream_result
+        return _stream_result(self.run(args),output)
+
+    # ZFS
+
+    def _add_dataset(self,name,origin=None,mountpoint=None,props=None):
+        self.clock += 1
+        self.datasets[name] = dict(type='snapshot' if '@' in name else 'filesystem',
+                                   origin=origin or '-',
+                                   creation=self.clock,
+                                   guid=abs(hash((name,self.clock))),
+                                   props=dict(props or {}))
+        if mountpoint:
+            self.datasets[name]['props']['mountpoint'] = mountpoint
+        mp = self._mountpoint(name)
+        if self.root and mp not in ('-','none'):
+            os.makedirs(mp,exist_ok=True)
+
+    def _snapshot(self,name):
+        (fs,_) = name.split('@')
+        if fs not in self.datasets:
+            raise FakeError(f"cannot open '{fs}': dataset does not exist")
+        if name in self.datasets:
+            raise FakeError(f"cannot create snapshot '{name}': dataset already exists")
+        self._add_dataset(name)
+
+    def _copy_tree(self,src,dst):
+        if self.root and self._mountpoint(dst) != 'none':
+            shutil.copytree(self._mountpoint(src),self._mountpoint(dst),
+                            symlinks=True,dirs_exist_ok=True)
+
+    def _mountpoint(self,name):
+        if '@' in name:
+            return '-'
+        ds = self.datasets.get(name,{})
+        if 'mountpoint' in ds.get('props',{}):
+            return ds['props']['mountpoint']
+        parent,_,leaf = name.rpartition('/')
+        if parent and self._mountpoint(parent) == 'none':
+            return 'none'
+        return f'{self._mountpoint(parent)}/{leaf}' if parent else f'/{name}'
+
+    def _prop(self,name,prop):
+        ds = self.datasets[name]
+        if prop == 'name':
+            return name
+        elif prop == 'mountpoint':
+            return self._mountpoint(name)
+        elif prop == 'clones':
+            return ','.join(sorted(k for k,v in self.datasets.items() if v['origin'] == name)) \
+                        if ds['type'] == 'snapshot' else '-'
+        elif prop in ('origin','creation','guid','type'):
+            return str(ds[prop])
+        elif prop == 'createtxg':
+            return str(ds['creation'])
+        elif prop in ('used','referenced','written'):
+            return '0'
+        elif prop == 'receive_resume_token':
+            return '-'
+        elif prop in ds['props']:
+            return ds['props'][prop]
+        elif ':' in prop:
+            # User property - inherited
+            parent = name.split('@')[0].rpartition('/')[0]
+            return self._prop(parent,prop) if parent else '-'
+        else:
+            return '-'
+
+    def _select(self,names,recurse,depth,types):
+        selected = []
+        for n in names:
+            if n not in self.datasets:
+                raise FakeError(f"cannot open '{n}': dataset does not exist")
+            for d in sorted(self.datasets):
+                if d == n:
+                    pass
+                elif recurse and (d.startswith(f'{n}/') or d.startswith(f'{n}@')):
+                    rel = d[len(n):].lstrip('/')
+                    if depth is not None and rel.count('/') + 1 > depth:
+                        continue
+                else:
+                    continue
+                t = self.datasets[d]['type']
+                if types is None and d != n and t == 'snapshot':
+                    continue
+                if types is not None and t not in types:
+                    continue
+                selected.append(d)
+        return selected
+
+    def _types(self,opts):
+        if 't' not in opts:
+            return None
+        types = set()
+        for t in ','.join(opts['t']).split(','):
+            types.add({'snap':'snapshot','fs':'filesystem'}.get(t,t))
+        return types
+
+    def _zfs_list(self,args):
+        opts,names = _opts(args,'Hrp','dostS')
+        depth = int(opts['d'][0]) if 'd' in opts else None
+        recurse = 'r' in opts or depth is not None or not names
+        names = names or [ d for d in self.datasets if '/' not in d and '@' not in d ]
+        selected = self._select(names,recurse,depth,self._types(opts))
+        for s in opts.get('s',[]):
+            selected.sort(key=lambda d:self._sortkey(d,s))
+        for s in opts.get('S',[]):
+            selected.sort(key=lambda d:self._sortkey(d,s),reverse=True)
+        props = ','.join(opts.get('o',['name,used,avail,refer,mountpoint'])).split(',')
+        sep = '\t' if 'H' in opts else '  '
+        return '\n'.join(sep.join(self._prop(d,p) for p in props) for d in selected)
+
+    def _sortkey(self,d,prop):
+        v = self._prop(d,prop)
+        return (0,int(v),'') if v.isdigit() else (1,0,v)
+
+    def _zfs_get(self,args):
+        opts,args = _opts(args,'Hrp','dost')
+        depth = int(opts['d'][0]) if 'd' in opts else None
+        props = args[0].split(',')
+        names = args[1:]
+        selected = self._select(names,'r' in opts or depth is not None,depth,self._types(opts))
+        fields = ','.join(opts.get('o',['name,property,value,source'])).split(',')
+        out = []
+        for d in selected:
+            for p in props:
+                row = dict(name=d,property=p,value=self._prop(d,p),source='local')
+                out.append('\t'.join(row[f] for f in fields))
+        return '\n'.join(out)
+
+    def _zfs_set(self,args):
+        (*props,name) = args
+        if name not in self.datasets:
+            raise FakeError(f"cannot open '{name}': dataset does not exist")
+        for p in props:
+            k,v = p.split('=',1)
+            self.datasets[name]['props'][k] = v
+
+    def _zfs_inherit(self,args):
+        opts,(prop,*names) = _opts(args,'rS')
+        for n in names:
+            self.datasets[n]['props'].pop(prop,None)
+
+    def _zfs_clone(self,args):
+        opts,(snap,target) = _opts(args,'p','o')
+        if snap not in self.datasets:
+            raise FakeError(f"cannot open '{snap}': dataset does not exist")
+        if target in self.datasets:
+            raise FakeError(f"cannot create '{target}': dataset already exists")
+        self._check_parent(target)
+        props = dict(o.split('=',1) for o in opts.get('o',[]))
+        self._add_dataset(target,origin=snap,props=props)
+        self._copy_tree(snap.split('@')[0],target)
+
+    def _zfs_send(self,args):
+        # Dry run only (stream size estimate) - use pipe for transfer
+        opts,args = _opts(args,'cwvLeDpPRn','it')
+        if 'n' not in opts:
+            raise FakeError('stream must be sent using pipe')
+        if args[0] not in self.datasets:
+            raise FakeError(f"cannot open '{args[0]}': dataset does not exist")
+        return 'size\t0'
+
+    def _zfs_create(self,args):
+        opts,(name,) = _opts(args,'pu','o')
+        if name in self.datasets:
+            raise FakeError(f"cannot create '{name}': dataset already exists")
+        self._check_parent(name)
+        props = dict(o.split('=',1) for o in opts.get('o',[]))
+        self._add_dataset(name,props=props)
+
+    def _check_parent(self,name):
+        parent = name.rpartition('/')[0]
+        if parent not in self.datasets:
+            raise FakeError(f"cannot create '{name}': parent does not exist")
+
+    def _zfs_snapshot(self,args):
+        opts,names = _opts(args,'r','o')
+        for n in names:
+            self._snapshot(n)
+
+    def _zfs_rename(self,args):
+        opts,(src,dst) = _opts(args,'fpu')
+        if src not in self.datasets:
+            raise FakeError(f"cannot open '{src}': dataset does not exist")
+        if dst in self.datasets:
+            raise FakeError(f"cannot rename to '{dst}': dataset already exists")
+        self._check_parent(dst)
+        src_mp = self._mountpoint(src)
+        for d in [ d for d in self.datasets if d == src or d.startswith(f'{src}@') or d.startswith(f'{src}/') ]:
+            nd = dst + d[len(src):]
+            self.datasets[nd] = self.datasets.pop(d)
+            for v in self.datasets.values():
+                if v['origin'] == d:
+                    v['origin'] = nd
+        if self.root:
+            dst_mp = self._mountpoint(dst)
+            if os.path.exists(src_mp) and dst_mp != 'none':
+                os.rename(src_mp,dst_mp)
+            elif dst_mp != 'none' and self.datasets[dst]['origin'] != '-':
+                self._copy_tree(self.datasets[dst]['origin'].split('@')[0],dst)
+
+    def _zfs_destroy(self,args):
+        opts,(name,) = _opts(args,'fnprRvd')
+        if '@' in name:
+            (fs,snaps) = name.split('@')
+            names = [ f'{fs}@{s}' for s in snaps.split(',') ]
+        else:
+            names = [name]
+        out = []
+        for n in names:
+            if n not in self.datasets:
+                raise FakeError(f"could not find any snapshots to destroy; check snapshot names.") \
+                        if '@' in n else FakeError(f"cannot open '{n}': dataset does not exist")
+            children = [ d for d in self.datasets if d.startswith(f'{n}/') or d.startswith(f'{n}@') ]
+            clones = [ d for d,v in self.datasets.items() if v['origin'] == n ]
+            if (children or clones) and not ('r' in opts or 'R' in opts):
+                raise FakeError(f"cannot destroy '{n}': filesystem has children")
+            for d in [n,*children]:
+                if 'v' in opts:
+                    out.append(f'destroy\t{d}')
+                if 'n' not in opts:
+                    mp = self._mountpoint(d)
+                    del self.datasets[d]
+                    if self.root and mp not in ('-','none') and '/' in d:
+                        shutil.rmtree(mp,ignore_errors=True)
+        if 'p' in opts:
+            out.append('reclaim\t0')
+        return '\n'.join(out)
+
+    def _cmd_zfs(self,args,input):
+        if not args:
+            raise FakeError('missing command',2)
+        sub = args.pop(0)
+        handler = getattr(self,f'_zfs_{sub}',None)
+        if handler is None:
+            raise FakeError(f"unrecognized command '{sub}'",2)
+        return handler(args)
+
+    # Network
+
+    def _add_interface(self,name,**kwargs):
+        ether = f'02:00:00:00:{self.next_ether // 256:02x}:{self.next_ether % 256:02x}'
+        self.next_ether += 1
+        self.interfaces[name] = dict(dict(mtu=1500,up=False,ether=ether,inet6=[],
+                                          linklocal=False,vnet=None,groups=[],peer=None),
+                                     **kwargs)
+
+    def _lladdr(self,i):
+        e = i['ether'].split(':')
+        return 'fe80::{:x}:{:x}:{:x}:{:x}'.format((int(e[0],16) ^ 2) << 8 | int(e[1],16),
+                                                  int(e[2],16) << 8 | 0xff,
+                                                  0xfe00 | int(e[3],16),
+                                                  int(e[4],16) << 8 | int(e[5],16))
+
+    def _show(self,name,i):
+        flags = 'UP,BROADCAST,RUNNING,SIMPLEX,MULTICAST' if i['up'] else 'BROADCAST,SIMPLEX,MULTICAST'
+        out = [ f"{name}: flags=8843<{flags}> metric 0 mtu {i['mtu']}",
+                f"\tether {i['ether']}" ]
+        for a in i['inet6']:
+            (addr,prefixlen) = a.split('/')
+            out.append(f"\tinet6 {addr} prefixlen {prefixlen}")
+        if i['linklocal'] and i['up']:
+            out.append(f"\tinet6 {self._lladdr(i)}%{name} prefixlen 64 scopeid 0x1")
+        for m in i.get('members') or []:
+            out.append(f"\tmember: {m} flags=143<LEARNING,DISCOVER,AUTOEDGE,AUTOPTP>")
+        if i['groups']:
+            out.append(f"\tgroups: {' '.join(i['groups'])}")
+        return '\n'.join(out)
+
+    def _iface(self,name,vnet=None):
+        i = self.interfaces.get(name)
+        if i is None or i['vnet'] != vnet:
+            raise FakeError(f"interface {name} does not exist")
+        return i
+
+    def _ifconfig(self,args,vnet=None):
+        if not args:
+            return '\n'.join(self._show(k,v) for k,v in self.interfaces.items() if v['vnet'] == vnet)
+        if args[0] == '-l':
+            return ' '.join(k for k,v in self.interfaces.items() if v['vnet'] == vnet)
+        if args[0] == '-g':
+            return '\n'.join(k for k,v in self.interfaces.items()
+                                    if v['vnet'] == vnet and args[1] in v['groups'])
+        name = args.pop(0)
+        if name.startswith('epair') and args[:1] == ['create']:
+            args.pop(0)
+            n = self.next_epair
+            self.next_epair += 1
+            self._add_interface(f'epair{n}a',groups=['epair'],peer=f'epair{n}b')
+            self._add_interface(f'epair{n}b',groups=['epair'],peer=f'epair{n}a')
+            name = f'epair{n}a'
+            if not args:
+                return name
+        i = self._iface(name,vnet)
+        if not args or args == ['inet6']:
+            return self._show(name,i)
+        while args:
+            a = args.pop(0)
+            if a in ('inet6','up','-ifdisabled','ifdisabled'):
+                i['up'] = i['up'] or a == 'up'
+            elif a == 'down':
+                i['up'] = False
+            elif a == 'auto_linklocal':
+                i['linklocal'] = True
+            elif a == '-auto_linklocal':
+                i['linklocal'] = False
+            elif a == 'mtu':
+                i['mtu'] = int(args.pop(0))
+            elif a == 'name':
+                new = args.pop(0)
+                if new in self.interfaces:
+                    raise FakeError(f"ioctl SIOCSIFNAME (set name): File exists")
+                self.interfaces[new] = self.interfaces.pop(name)
+                for v in self.interfaces.values():
+                    if v['peer'] == name:
+                        v['peer'] = new
+                    if name in (v.get('members') or []):
+                        v['members'][v['members'].index(name)] = new
+                name = new
+            elif a in ('addm','deletem'):
+                m = args.pop(0)
+                self._iface(m,vnet)
+                if a == 'addm':
+                    if m in i['members']:
+                        raise FakeError(f"BRDGADD {m}: File exists")
+                    i['members'].append(m)
+                elif m in i['members']:
+                    i['members'].remove(m)
+            elif a in ('private','-private','edge','-edge'):
+                args.pop(0)
+            elif a == 'group':
+                i['groups'].append(args.pop(0))
+            elif a == '-group':
+                g = args.pop(0)
+                if g in i['groups']:
+                    i['groups'].remove(g)
+            elif a == 'vnet':
+                jname = args.pop(0)
+                if jname not in self.jails:
+                    raise FakeError(f'jail "{jname}" not found')
+                i['vnet'] = jname
+            elif a == '-vnet':
+                jname = args.pop(0)
+                if jname not in self.jails:
+                    raise FakeError(f'jail "{jname}" not found')
+                j = self._iface(name,jname)
+                j['vnet'] = None
+            elif a == 'destroy':
+                for n in (name,i['peer']):
+                    if n:
+                        self.interfaces.pop(n,None)
+                        for v in self.interfaces.values():
+                            if n in (v.get('members') or []):
+                                v['members'].remove(n)
+                return
+            elif ':' in a:
+                i['inet6'].append(f"{a}/{args.pop(1) if args[:1] == ['prefixlen'] else 64}")
+            else:
+                raise FakeError(f"{a}: bad value")
+
+    def _cmd_ifconfig(self,args,input):
+        return self._ifconfig(args)
+
+    def _cmd_route(self,args,input):
+        opts,args = _opts(args,'6nq')
+        op = args.pop(0)
+        if op == 'get':
+            dest = args[0]
+            (gateway,interface) = self.routes.get(dest,self.routes['default'])
+            return '\n'.join([f'   route to: {dest}',
+                              f'destination: {"default" if dest == "default" else dest}',
+                              f'    gateway: {gateway}',
+                              f'        fib: 0',
+                              f'  interface: {interface}'])
+        elif op == 'add':
+            (dest,gateway) = args[-2:]
+            self.routes[dest] = (gateway,gateway.split('%')[-1])
+        elif op == 'delete':
+            if self.routes.pop(args[0],None) is None:
+                raise FakeError(f'writing to routing socket: No such process')
+
+    # Mounts
+
+    def _cmd_mount(self,args,input):
+        opts,args = _opts(args,'apfuvlr','to')
+        if not args:
+            mounts = [ m for m in self.mounts if 't' not in opts or m[2] in opts['t'] ]
+            if 'p' in opts:
+                return '\n'.join(f'{d}\t\t{p}\t{t}\t{o.replace(", ",",")}\t0 0' for (d,p,t,o) in mounts)
+            return '\n'.join(f'{d} on {p} ({t}, {o})' for (d,p,t,o) in mounts)
+        (device,path) = args
+        self.mounts.append((device,path,opts.get('t',['ufs'])[0],'local'))
+
+    def _cmd_umount(self,args,input):
+        opts,args = _opts(args,'afv')
+        for path in args:
+            for m in self.mounts:
+                if m[1] == path:
+                    self.mounts.remove(m)
+                    break
+            else:
+                raise FakeError(f'{path}: not a file system root directory')
+
+    # Jails
+
+    def _jail_create(self,params):
+        jname = params['name']
+        if jname in self.jails:
+            raise FakeError(f'jail "{jname}" already exists')
+        jid = self.next_jid
+        self.next_jid += 1
+        self.jails[jname] = dict(jid=jid,name=jname,path=params.get('path','/'),
+                                 vnet=1 if params.get('vnet') == 'new' else 2,
+                                 osrelease=params.get('osrelease','13.0-RELEASE'),
+                                 params=params)
+        for i in params.get('vnet.interface','').split(','):
+            if i:
+                self._iface(i)['vnet'] = jname
+        if params.get('mount.devfs') == 'true':
+            self.mounts.append(('devfs',f"{params['path']}/dev",'devfs','local, multilabel'))
+        if params.get('persist') == 'false':
+            self._jail_remove(jname)
+        return f'{jname}: created'
+
+    def _jail_remove(self,jname):
+        if jname not in self.jails:
+            raise FakeError(f'"{jname}" not found')
+        for i in self.interfaces.values():
+            if i['vnet'] == jname:
+                i['vnet'] = None
+                i['inet6'] = []
+        del self.jails[jname]
+        return f'{jname}: removed'
+
+    def _cmd_jail(self,args,input):
+        opts,args = _opts(args,'cmrRvdqi','fJ')
+        if 'R' in opts or 'r' in opts:
+            return '\n'.join(self._jail_remove(j) for j in args)
+        if 'f' in opts:
+            return self._jail_conf(opts['f'][0],args,input)
+        params = {}
+        for a in args:
+            k,_,v = a.partition('=')
+            params[k] = v or 'true'
+        return self._jail_create(params)
+
+    def _jail_conf(self,path,names,input):
+        # jail -f <conf> -c [name ...] (dependencies created first)
+        from . import jailconf
+        if path == '-':
+            conf = jailconf.parse((input or b'').decode())
+        else:
+            with open(path) as f:
+                conf = jailconf.parse(f.read())
+        order = []
+        def _add(name):
+            if name not in conf:
+                raise FakeError(f'"{name}" not found')
+            if name not in order:
+                for d in conf[name].get('depend',[]):
+                    _add(d)
+                order.append(name)
+        for name in names or conf:
+            _add(name)
+        return '\n'.join(self._jail_create({ **{ k:','.join(v) or 'true' for k,v in conf[n].items() },
+                                              'name':n }) for n in order)
+
+    def _cmd_jls(self,args,input):
+        libxo = [ a for a in args if a.startswith('--libxo') ]
+        opts,args = _opts([ a for a in args if a not in libxo ],'Nnvsdqh','j')
+        jails = list(self.jails.values())
+        if 'j' in opts:
+            jails = [ j for j in jails if opts['j'][0] in (j['name'],str(j['jid'])) ]
+            if not jails:
+                raise FakeError(f'jail "{opts["j"][0]}" not found')
+        params = args or ['jid','name','path']
+        if libxo:
+            return json.dumps({'__version':'2',
+                               'jail-information':{'jail':[{ p:j.get(p,j['params'].get(p))
+                                                                for p in params } for j in jails]}})
+        return '\n'.join(' '.join(str(j.get(p,j['params'].get(p,''))) for p in params) for j in jails)
+
+    def _cmd_jexec(self,args,input):
+        opts,(jname,*args) = _opts(args,'l','uU')
+        if jname not in self.jails:
+            raise FakeError(f'jail "{jname}" not found')
+        if args and os.path.basename(args[0]) == 'ifconfig':
+            return self._ifconfig(args[1:],vnet=jname)
+        if args and os.path.basename(args[0]) == 'echo':
+            return ' '.join(args[1:]) + '\n'
+        if args and os.path.basename(args[0]) == 'false':
+            raise FakeError('',1)
+
+    def _cmd_sysrc(self,args,input):
+        opts,args = _opts(args,'vaAcdeFinNqx','Rf')
+        root = opts.get('R',['/'])[0]
+        rc = self.sysrc.setdefault(root,{})
+        out = []
+        if 'a' in opts:
+            return '\n'.join(f'{k}: {v}' for k,v in rc.items())
+        for a in args:
+            k,eq,v = a.partition('=')
+            if eq:
+                out.append(f'{k}: {rc.get(k,"")} -> {v}')
+                rc[k] = v
+            elif k in rc:
+                out.append(f'{k}: {rc[k]}')
+            else:
+                raise FakeError(f'unknown variable \'{k}\'')
+        return '\n'.join(out)
+
+    def _cmd_pw(self,args,input):
+        opts,(op,*args) = _opts(args,'','RV')
+        root = opts.get('R',['/'])[0]
+        users = self.users.setdefault(root,{})
+        opts,_ = _opts(args,'mh','nsGdcug')
+        user = opts['n'][0]
+        if op == 'useradd':
+            if user in users:
+                raise FakeError(f'user \'{user}\' already exists',65)
+            uid = 1001 + len(users)
+            users[user] = dict(uid=uid,gid=uid,groups=[],shell=opts.get('s',['/bin/sh'])[0])
+            if 'm' in opts and self.root:
+                os.makedirs(f'{root}/home/{user}',exist_ok=True)
+        elif op == 'usershow':
+            if user not in users:
+                raise FakeError(f'no such user `{user}\'',67)
+            u = users[user]
+            return f"{user}:*:{u['uid']}:{u['gid']}::0:0:User &:/home/{user}:{u['shell']}"
+        elif op == 'usermod':
+            if user not in users:
+                raise FakeError(f'no such user `{user}\'',67)
+            users[user]['groups'] = opts.get('G',[''])[0].split(',')
+
+    # Misc
+
+    def _cmd_sysctl(self,args,input):
+        opts,args = _opts(args,'nie')
+        (ncpu,ndomains) = (getattr(self,'cpus',8),getattr(self,'domains',1))
+        values = { 'kern.smp.cpus':ncpu,'vm.ndomains':ndomains,
+                   **{ f'dev.cpu.{c}.%domain':c * ndomains // ncpu for c in range(ncpu) } }
+        out = []
+        for k in args:
+            if k in values:
+                out.append(str(values[k]) if 'n' in opts else f'{k}: {values[k]}')
+            elif 'i' not in opts:
+                raise FakeError(f'unknown oid \'{k}\'')
+        return '\n'.join(out)
+
+    def _cmd_rctl(self,args,input):
+        opts,args = _opts(args,'ahlnru')
+        rules = self.__dict__.setdefault('rctl',[])
+        if 'a' in opts:
+            for r in args:
+                (subject,_,rest) = r.partition(':')
+                f = rest.split(':')
+                if subject != 'jail' or len(f) != 3 or '=' not in f[2]:
+                    raise FakeError(f'failed to add rule \'{r}\': Invalid argument')
+            rules.extend(args)
+        elif 'r' in opts:
+            n = len(rules)
+            rules[:] = [ r for r in rules if not any(r.startswith(f'{a}:') for a in args) ]
+            if len(rules) == n:
+                raise FakeError(f'failed to remove rule \'{args[0]}\': No such process')
+        elif 'u' in opts:
+            jname = args[0].split(':')[1]
+            if jname not in self.jails:
+                raise FakeError(f'failed to get resource usage: No such process')
+            return '\n'.join(f'{r}=0' for r in ('cputime','memoryuse','maxproc','openfiles',
+                                                 'readbps','writebps','pcpu'))
+        else:
+            return '\n'.join(r for r in rules if not args or any(r.startswith(f'{a}:') for a in args))
+
+    def _cmd_cpuset(self,args,input):
+        opts,args = _opts(args,'g','lj')
+        jname = opts['j'][0]
+        j = self.jails.get(jname) or next((j for j in self.jails.values() if str(j['jid']) == jname),None)
+        if j is None:
+            raise FakeError(f'jail "{jname}" not found')
+        if 'l' in opts:
+            j['cpuset'] = opts['l'][0]
+        else:
+            return f"jail {j['jid']} mask: {j.get('cpuset','0-%d' % (getattr(self,'cpus',8) - 1))}"
+
+    def _cmd_hostname(self,args,input):
+        return self.hostname
+
+    def _cmd_uname(self,args,input):
+        return '13.0-RELEASE'
+
+    def _cmd_chroot(self,args,input):
+        pass
+
+    def _cmd_knsupdate(self,args,input):
+        pass
+
+class FakeDNSServer:
+
+    """
+        Stand-in authoritative server for RFC 2136 updates (TCP) used to
+        test the native DDNS client. Records are held in `records` as
+        {name:{(type,rdata),...}} and the number of update messages received
+        in `messages`. If `tsig` (nsupdate key format) is set requests must
+        be signed and responses are signed
+
+            with FakeDNSServer("example.com") as server:
+                DDNSConfig(server=f"::1 {server.port}",zone="example.com",
+                           backend="native").update(...)
+    """
+
+    def __init__(self,zone,tsig='',host='::1',port=0):
+        import socketserver
+        from . import dnsupdate
+        self.zone = zone if zone.endswith('.') else zone + '.'
+        self.key = dnsupdate.parse_key(tsig) if tsig else None
+        self.records = {}
+        self.messages = 0
+        self.lock = threading.Lock()
+        server = self
+
+        class Handler(socketserver.BaseRequestHandler):
+            def handle(self):
+                while (hdr := self._recv(2)):
+                    (n,) = struct.unpack('!H',hdr)
+                    response = server.response(self._recv(n))
+                    self.request.sendall(struct.pack('!H',len(response)) + response)
+            def _recv(self,n):
+                data = b''
+                while len(data) < n:
+                    chunk = self.request.recv(n - len(data))
+                    if not chunk:
+                        return b''
+                    data += chunk
+                return data
+
+        class Server(socketserver.ThreadingMixIn,socketserver.TCPServer):
+            address_family = socket.AF_INET6 if ':' in host else socket.AF_INET
+            daemon_threads = True
+            allow_reuse_address = True
+
+        self.server = Server((host,port),Handler)
+        self.port = self.server.server_address[1]
+
+    def response(self,msg):
+        from . import dnsupdate
+        (msg_id,flags,zocount,prcount,upcount,adcount) = struct.unpack_from('!HHHHHH',msg)
+        request_mac = b''
+        rcode = 0
+        if self.key:
+            try:
+                (request_mac,_) = dnsupdate.tsig_verify(self.key,msg)
+            except dnsupdate.DNSUpdateError as e:
+                # NOTAUTH with unsigned TSIG RR carrying BADSIG/BADKEY
+                response = struct.pack('!HHHHHH',msg_id,0x8000 | (5 << 11) | 9,0,0,0,0)
+                return dnsupdate.tsig_error(self.key,response,e.rcode)
+        (zone,off) = dnsupdate.read_name(msg,12)
+        off += 4
+        if (flags >> 11) & 0xf != dnsupdate.OPCODE_UPDATE:
+            rcode = 4
+        elif zone.lower() != self.zone.lower():
+            rcode = 10
+        else:
+            updates = []
+            for _ in range(prcount + upcount):
+                (rr,off) = dnsupdate.read_rr(msg,off)
+                updates.append(rr)
+            with self.lock:
+                self.messages += 1
+                for (name,rtype,rclass,ttl,rdata) in updates[prcount:]:
+                    name = name.lower()
+                    if rclass == dnsupdate.CLASS_IN:
+                        self.records.setdefault(name,set()).add((rtype,rdata))
+                    elif rclass == dnsupdate.CLASS_ANY and rtype == dnsupdate.TYPE_ANY:
+                        self.records.pop(name,None)
+                    elif rclass == dnsupdate.CLASS_ANY:
+                        self.records[name] = { r for r in self.records.get(name,()) if r[0] != rtype }
+                    elif rclass == dnsupdate.CLASS_NONE:
+                        self.records.get(name,set()).discard((rtype,rdata))
+                    else:
+                        rcode = 1
+        response = struct.pack('!HHHHHH',msg_id,0x8000 | (5 << 11) | rcode,0,0,0,0)
+        if self.key:
+            (response,_) = dnsupdate.tsig_sign(self.key,response,request_mac)
+        return response
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever,daemon=True).start()
+        return self
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self,*args):
+        self.close()
+
+if __name__ == '__main__':
+
+    import argparse,collections,tempfile
+    from .util import set_executor
+    from .config import HostConfig
+    from .host import Host
+
+    parser = argparse.ArgumentParser(description='Drive jail lifecycle against fake backend')
+    parser.add_argument('count',type=int,nargs='?',default=100,help='Number of jails')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as root:
+        fake = FakeFreeBSD(root=root)
+        set_executor(fake)
+        host = Host(HostConfig())
+        jails = [ host.jail(f'jail{n}') for n in range(args.count) ]
+        for phase in ('create_fs','start','stop','remove'):
+            ncalls = len(fake.calls)
+            start = time.perf_counter()
+            for j in jails:
+                getattr(j,phase)()
+            elapsed = time.perf_counter() - start
+            ncalls = len(fake.calls) - ncalls
+            print(f'{phase:10s} {args.count:6d} jails {elapsed:8.3f}s ' \
+                  f'{ncalls/args.count:6.1f} cmds/jail {elapsed/args.count*1000:8.3f}ms/jail')
@@ -1,35 +1,73 @@
 
-import base64,hashlib,ipaddress,re,os.path,struct,subprocess,time
+import base64,dataclasses,fnmatch,functools,hashlib,ipaddress,re,os.path,struct,subprocess,threading,time
 
-from .util import Command
+from .util import Command,StepTimer,op,timed
 from .config import HostConfig,JailConfig
 
+from .bulk import merge_results
+from .clonepool import ClonePool
+from .cpuset import Placement
+from .epair import EpairPool
 from .jail import Jail
+from . import jailconf,manifest,rctl
+from .jailindex import JailIndex
+from .metrics import Metrics
+from .mounts import MountTable
+from .snapshots import SnapshotIndex
+from .status import JLS_PARAMS,is_vnet,parse_jls
 
-class Host:
+# Max number of cached JailConfig objects per Host
+CONFIG_CACHE_SIZE = 4096
 
-    def __init__(self,config:HostConfig,debug:bool=False):
+@functools.lru_cache(maxsize=CONFIG_CACHE_SIZE)
+def jail_digest(name,salt):
+    return hashlib.blake2b(name.encode("utf8"),digest_size=8,salt=salt).digest()
+
+class BaseHost:
+
+    """
+        Host logic shared by Host and aio.AsyncHost - methods which run
+        commands are ops (see util.op) so block or return awaitables
+        depending on the command class
+    """
+
+    command = None
+    jail_class = None
+
+    def __init__(self,config:HostConfig,debug:bool=False,rctl_profiles:dict=None):
         self.config = config
         self.debug = debug
-        self.cmd = Command(self.debug)
+        # Named rctl profiles ({name:RctlProfile}) - shared with jails
+        self.rctl_profiles = rctl_profiles or {}
+        self.cmd = self.command(self.debug)
+        # Shared indexes/placement table use blocking commands (ops load
+        # the indexes with self.cmd first)
+        self.snapshots = SnapshotIndex(f"{self.config.zvol}/{self.config.base}",self.cmd.sync())
+        self.jail_index = JailIndex(self.config.zvol,self.cmd.sync())
+        self._clone_pool = ClonePool(f"{self.config.zvol}/{self.config.base}",self.config.clone_pool,
+                                     self.cmd,self.snapshots)
+        self._configs = {}
+        self._configs_lock = threading.Lock()
+        # Lifecycle metrics (None if disabled) - shared with jails
+        self.metrics = Metrics.from_config(self.config)
+        self.steps = StepTimer(self.cmd,self.metrics)
+        # CPU placement (None if disabled) - shared with jails
+        self.placement = Placement.from_config(self.config,self.cmd.sync())
+
+    @op
+    def check_base(self):
         try:
-            self.cmd('/sbin/zfs', 'list', '-Ho', 'name', f'{self.config.zvol}/{self.config.base}')
+            yield self.cmd('/sbin/zfs', 'list', '-Ho', 'name', f'{self.config.zvol}/{self.config.base}')
         except subprocess.CalledProcessError as e:
             raise ValueError(f'Invalid base: {self.config.base}')
 
     def generate_addr(self,name):
-        digest = hashlib.blake2b(name.encode("utf8"),
-                                      digest_size=8,
-                                      salt=self.config.salt).digest()
+        digest = jail_digest(name,self.config.salt)
         host_address = struct.unpack("L",digest)[0] & int(self.config.network.hostmask) 
         return self.config.network.network_address + host_address
 
     def generate_hash(self,name):
-        return base64.b32encode(
-                    hashlib.blake2b(name.encode("utf8"),
-                                    digest_size=8,
-                                    salt=self.config.salt).digest()
-               ).lower().rstrip(b"=").decode()
+        return base64.b32encode(jail_digest(name,self.config.salt)).lower().rstrip(b"=").decode()
 
     def generate_gateway(self,interface):
         if "%" in self.config.gateway:
@@ -40,10 +78,22 @@ class Host:
             return self.config.gateway
 
     def generate_jail_config(self,name):
-        digest = hashlib.blake2b(name.encode("utf8"),
-                                 digest_size=8,
-                                 salt=self.config.salt).digest()
-        b32_digest = base64.b32encode(digest).lower().rstrip(b"=").decode()
+        # Cached on name and the host config fields the jail config is
+        # derived from (a copy is returned as JailConfig is mutable)
+        c = self.config
+        key = (name,c.salt,c.network,c.base,c.zvol,c.mountpoint,c.gateway,
+               c.bridge,c.mtu,c.proxy,c.epair_pool,c.clone_pool,c.rctl)
+        config = self._configs.get(key)
+        if config is None:
+            config = self._generate_jail_config(name)
+            with self._configs_lock:
+                if len(self._configs) >= CONFIG_CACHE_SIZE:
+                    self._configs.pop(next(iter(self._configs)))
+                self._configs[key] = config
+        return dataclasses.replace(config)
+
+    def _generate_jail_config(self,name):
+        b32_digest = self.generate_hash(name)
         address = self.generate_addr(name)
         gateway = self.generate_gateway(f"{b32_digest}B")
         #if '%' in gateway:
@@ -67,11 +117,28 @@ class Host:
                           mtu = self.config.mtu,
                           base = self.config.base,
                           proxy = self.config.proxy,
+                          epair_pool = self.config.epair_pool,
+                          clone_pool = self.config.clone_pool,
+                          rctl = self.config.rctl,
         )
 
+    @op
+    def lookup(self,key):
+        """
+            Return jail name from hash, jname, epair interface name or IPv6
+            address (None if not found)
+        """
+        if not self.jail_index.loaded:
+            self.jail_index.update((yield self.cmd(*self.jail_index.list_args())))
+        return self.jail_index.lookup(key)
+
+    @op
     def name_from_hash(self,jail_hash):
+        name = yield self.lookup(jail_hash)
+        if name:
+            return name
         try:
-            name = self.cmd("/sbin/zfs","list","-Ho","jail:name",f"{self.config.zvol}/{jail_hash}")
+            name = yield self.cmd("/sbin/zfs","list","-Ho","jail:name",f"{self.config.zvol}/{jail_hash}")
             if name == "-":
                 raise ValueError(f"jail:name not found: {self.config.zvol}/{jail_hash}")
             return name
@@ -79,68 +146,663 @@ class Host:
             pass
         raise ValueError(f"ZFS volume not found: {self.config.zvol}/{jail_hash}")
 
+    @op
     def get_latest_snapshot(self):
-        out = self.cmd("/sbin/zfs", "list", "-Hrt", "snap", "-d", "1", "-s", "creation", "-o", "name", 
-                              f"{self.config.zvol}/{self.config.base}")
-        if out:
-            return out.split("\n")[-1]
-        else:
-            raise ValueError(f"No snapshots found: {self.config.zvol}/{self.config.base}")
+        if not self.snapshots.loaded:
+            self.snapshots.update((yield self.cmd(*self.snapshots.list_args())))
+        return self.snapshots.latest()
 
+    @op
+    def jls_snapshot(self):
+        # Running jails keyed by jname (see status.jls_snapshot)
+        return parse_jls((yield self.cmd("/usr/sbin/jls","--libxo=json",*JLS_PARAMS)))
+
+    @op
     def snapshot_base(self):
-        self.cmd("/sbin/zfs","snapshot",
-                    f"{self.config.zvol}/{self.config.base}@{time.strftime('%s')}")
+        now = int(time.time())
+        snapshot = f"{self.config.zvol}/{self.config.base}@{now}"
+        yield self.cmd("/sbin/zfs","snapshot",snapshot)
+        self.snapshots.add(snapshot,now)
+        if self.config.clone_pool:
+            # Spare clones of previous snapshot are stale
+            pool = self.clone_pool()
+            yield pool.invalidate(snapshot)
+            pool.refill(snapshot)
+
+    @op
+    def gc_base(self,keep=3,dry_run=False):
+        """
+            Destroy base snapshots which are not needed - the latest `keep`
+            snapshots, snapshots with clones (jails/spare clones) and
+            snapshots shared with a derived base (incremental clone_base
+            source) are retained. Remaining snapshots are destroyed with a
+            single zfs destroy (or reclaimable space reported if dry_run)
+
+            Returns (rows,reclaim_bytes)
+        """
+        base_zvol = f"{self.config.zvol}/{self.config.base}"
+        (snapshots,destroy) = self.gc_plan((yield self.cmd(*self.gc_args())),keep)
+        reclaim = 0
+        if destroy:
+            # Single batched destroy (fs@snap1,snap2,...)
+            target = f"{base_zvol}@{','.join(destroy)}"
+            out = yield self.cmd("/sbin/zfs","destroy","-nvp",target)
+            m = re.search("^reclaim\t(\d+)",out,re.M)
+            reclaim = int(m.group(1)) if m else 0
+            if not dry_run:
+                yield self.cmd("/sbin/zfs","destroy",target)
+                self.snapshots.remove(*[ f"{base_zvol}@{s}" for s in destroy ])
+        return (snapshots,reclaim)
 
+    def gc_args(self):
+        return ("/sbin/zfs","list","-Hp","-r","-d","2","-t","snapshot",
+                "-o","name,guid,creation,used,clones",self.config.zvol)
+
+    def gc_plan(self,out,keep=3):
+        # Snapshot rows (with action/reason) and snapshot names to destroy
+        # from gc_args output
+        base_zvol = f"{self.config.zvol}/{self.config.base}"
+        (snapshots,guids) = ([],{})
+        for l in out.split("\n"):
+            if l:
+                (name,guid,creation,used,*clones) = l.split("\t")
+                clones = [ c for c in ",".join(clones).split(",") if c not in ("","-") ]
+                if name.startswith(f"{base_zvol}@"):
+                    snapshots.append(dict(snapshot=name,guid=guid,creation=int(creation),
+                                          used=int(used),clones=len(clones)))
+                else:
+                    guids[guid] = name
+        snapshots.sort(key=lambda s:s["creation"])
+        latest = { s["snapshot"] for s in snapshots[-max(1,keep):] }
+        for s in snapshots:
+            if s["snapshot"] in latest:
+                (s["action"],s["reason"]) = ("keep","latest")
+            elif s["clones"]:
+                (s["action"],s["reason"]) = ("keep",f"{s['clones']} clone(s)")
+            elif s["guid"] in guids:
+                (s["action"],s["reason"]) = ("keep",f"shared: {guids[s['guid']]}")
+            else:
+                (s["action"],s["reason"]) = ("destroy","")
+        destroy = [ s["snapshot"].split("@")[1] for s in snapshots if s["action"] == "destroy" ]
+        return (snapshots,destroy)
+
+    @op
     def chroot_base(self,cmds=None,snapshot=True):
-        self.cmd("/sbin/mount","-t","devfs","-o","ruleset=2","devfs",
-                    f"{self.config.mountpoint}/{self.config.base}/dev")
+        yield self.cmd("/sbin/mount","-t","devfs","-o","ruleset=2","devfs",
+                          f"{self.config.mountpoint}/{self.config.base}/dev")
         if cmds:
-            subprocess.run(["/usr/sbin/chroot",
-                            f"{self.config.mountpoint}/{self.config.base}","/bin/sh"],
-                           input=b"\n".join([c.encode() for c in cmds]))
+            yield self.cmd.run("/usr/sbin/chroot",f"{self.config.mountpoint}/{self.config.base}","/bin/sh",
+                               input=b"\n".join([c.encode() for c in cmds]),capture=False,check=False)
         else:
-            subprocess.run(["/usr/sbin/chroot",
-                            f"{self.config.mountpoint}/{self.config.base}","/bin/sh"])
-        self.cmd("/sbin/umount","-f",f"{self.config.mountpoint}/{self.config.base}/dev")
+            yield self.cmd.run("/usr/sbin/chroot",f"{self.config.mountpoint}/{self.config.base}","/bin/sh",
+                               capture=False,check=False)
+        yield self.cmd("/sbin/umount","-f",f"{self.config.mountpoint}/{self.config.base}/dev")
         if snapshot:
-            self.snapshot_base()
+            yield self.snapshot_base()
+
+    @op
+    def snapshot_guids(self,dataset):
+        # Return {guid:snapshot} for dataset ({} if dataset doesn't exist)
+        # and receive_resume_token ('-' if none)
+        return self.decode_snapshot_guids(dataset,
+                        (yield self.cmd.run(*self.snapshot_guids_args(dataset),check=False)))
+
+    def snapshot_guids_args(self,dataset):
+        return ("/sbin/zfs","list","-Hp","-r","-d","1","-t","filesystem,snapshot",
+                "-s","createtxg","-o","name,guid,receive_resume_token",dataset)
+
+    def decode_snapshot_guids(self,dataset,result):
+        if result.returncode != 0:
+            return ({},"-")
+        (guids,token) = ({},"-")
+        for l in result.stdout.decode().strip().split("\n"):
+            (n,guid,t) = l.split("\t")
+            if n == dataset:
+                token = t
+            else:
+                guids[guid] = n
+        return (guids,token)
 
-    def clone_base(self,name):
-        source = self.get_latest_snapshot()
+    @op
+    def send_size(self,send_args):
+        # Estimated stream size (bytes) from dry-run send (0 if unknown)
+        try:
+            out = yield self.cmd("/sbin/zfs","send","-nP",*send_args)
+            (size,) = re.search("^size\t(\d+)",out,re.M).groups()
+            return int(size)
+        except (subprocess.CalledProcessError,AttributeError):
+            return 0
+
+    @op
+    @timed("clone_base")
+    def clone_base(self,name,incremental=True,compressed=True,raw=False,resume=True,progress=None):
+        """
+            Copy latest snapshot of base to zvol/<name> (zfs send|recv)
+
+            If the destination has an interrupted receive it is resumed
+            (resume=True) and if it already has a snapshot in common with
+            base only the delta is sent (incremental=True - note that
+            zfs recv -F rolls back any local changes to the destination).
+            Streams are compressed (-c) or raw (-w) if requested.
+
+            progress(nbytes,total) is called as data is transferred.
+            Returns dict with transfer statistics
+        """
+        source = yield self.get_latest_snapshot()
         dest = f"{self.config.zvol}/{name}"
-        with subprocess.Popen(["/sbin/zfs","send",source],
-                              stdout=subprocess.PIPE) as send:
-            with subprocess.Popen(["/sbin/zfs","recv","-v",dest],
-                                  stdin=send.stdout) as recv:
-                if recv.wait() != 0:
-                    send.kill()
-                    raise ValueError("ZFS recv failed")
-                else:
-                    if send.wait() != 0:
-                        raise ValueError("ZFS send failed")
+        flags = ["-w"] if raw else ["-c"] if compressed else []
+        stats = dict(source=source,dest=dest,mode=None,base=None,size=0,bytes=0,elapsed=0.0)
+
+        def _transfer(mode,send_args,recv_flags,base=None):
+            with self.steps("size"):
+                size = yield self.send_size(send_args)
+            sent = [size]
+            def _progress(n):
+                sent[0] = n
+                progress(n,size)
+            start = time.perf_counter()
+            with self.steps(mode):
+                (send_rc,recv_rc) = yield self.cmd.pipe(["/sbin/zfs","send",*send_args],
+                                                        ["/sbin/zfs","recv","-s",*recv_flags,dest],
+                                                        progress=_progress if progress else None)
+            if recv_rc != 0:
+                raise ValueError("ZFS recv failed")
+            elif send_rc != 0:
+                raise ValueError("ZFS send failed")
+            stats.update(mode=mode,base=base,size=stats["size"]+size,bytes=stats["bytes"]+sent[0],
+                         elapsed=stats["elapsed"]+time.perf_counter()-start)
+
+        (dest_guids,token) = yield self.snapshot_guids(dest)
+        if token != "-":
+            if not resume:
+                raise ValueError(f"Interrupted receive on {dest} (resume or 'zfs recv -A {dest}')")
+            yield from _transfer("resume",["-t",token],["-v"])
+            (dest_guids,token) = yield self.snapshot_guids(dest)
+
+        if not dest_guids:
+            yield from _transfer("full",[*flags,source],["-v"])
+        else:
+            (source_guids,_) = yield self.snapshot_guids(source.split("@")[0])
+            base = self.common_base(source,dest,source_guids,dest_guids)
+            if base == source:
+                stats["mode"] = stats["mode"] or "current"
+            elif not incremental:
+                raise ValueError(f"Destination exists: {dest} (incremental disabled)")
+            else:
+                yield from _transfer("incremental",[*flags,"-i",base,source],["-v","-F"],base)
+        return stats
+
+    def common_base(self,source,dest,source_guids,dest_guids):
+        # Most recent common snapshot (ordered by createtxg)
+        common = [ (source_guids[g],dest_guids[g]) for g in dest_guids if g in source_guids ]
+        if not common:
+            raise ValueError(f"No common snapshot: {source} -> {dest}")
+        order = { s:i for (i,s) in enumerate(source_guids.values()) }
+        (base,_) = max(common,key=lambda c:order[c[0]])
+        return base
 
     def list_jails(self,status=False):
-        out = self.cmd("/sbin/zfs","list","-r","-H","-o","name,jail:name,jail:base,jail:ipv6",
-                    "-s","jail:name", self.config.zvol)
-        jails = re.findall("(.*)\t(.*)\t(.*)\t(.*)",out)
-        if status:
-            return [dict(name=name,
-                         base=base,
-                         volume=os.path.basename(vol),
-                         jid=f"j_{os.path.basename(vol)}",
-                         ipv6=ipv6,
-                         running=self.cmd.check("jls","-Nj","j_"+os.path.basename(vol)))
-                    for (vol,name,base,ipv6) in jails if base != "-"]
+        return self.select_jails(status)
+
+    def list_jails_args(self):
+        return ("/sbin/zfs","list","-r","-H","-o","name,jail:name,jail:base,jail:ipv6",
+                "-s","jail:name",self.config.zvol)
+
+    @op
+    def select_jails(self,status=False,running=None,base=None,name_glob=None):
+        """
+            Jail rows (as list_jails) filtered on base/name glob and (if
+            running is not None) status. Filters are applied to the zfs
+            listing before the single jls status probe, which is skipped if
+            no jails match
+        """
+        jails = self.match_rows((yield self.cmd(*self.list_jails_args())),base,name_glob)
+        if (status or running is not None) and jails:
+            # Single jls snapshot joined by jname (constant number of subprocesses)
+            return [*self.status_rows(jails,(yield self.jls_snapshot()),running)]
         else:
-            return [dict(name=name,
-                         base=base,
-                         volume=os.path.basename(vol),
-                         jid=f"j_{os.path.basename(vol)}",
-                         ipv6=ipv6)
-                    for (vol,name,base,ipv6) in jails if base != "-"]
+            return [*self.status_rows(jails,None)]
+
+    def match_rows(self,out,base=None,name_glob=None):
+        # (vol,name,base,ipv6) for jail datasets from list_jails_args() output
+        jails = []
+        for l in out.split("\n"):
+            f = l.split("\t")
+            if len(f) == 4 and f[2] != "-" and \
+                    (base is None or f[2] == base) and \
+                    (name_glob is None or fnmatch.fnmatch(f[1],name_glob)):
+                jails.append(f)
+        return jails
+
+    def status_rows(self,jails,jls=None,running=None):
+        # Rows with status if jls snapshot given (optionally only running or
+        # stopped jails)
+        for (vol,name,base,ipv6) in jails:
+            volume = os.path.basename(vol)
+            if jls is None:
+                yield dict(name=name,
+                           base=base,
+                           volume=volume,
+                           jid=f"j_{volume}",
+                           ipv6=ipv6)
+                continue
+            j = jls.get(f"j_{volume}")
+            if running is not None and running != (j is not None):
+                continue
+            yield dict(name=name,
+                       base=base,
+                       volume=volume,
+                       jname=f"j_{volume}",
+                       jid=j["jid"] if j else None,
+                       ipv6=ipv6,
+                       running=j is not None,
+                       vnet=is_vnet(j) if j else None,
+                       path=j["path"] if j else f"{self.config.mountpoint}/{volume}",
+                       osrelease=j.get("osrelease") if j else None)
+
+    def jail_rows(self,out,jls=None):
+        return [*self.status_rows(self.match_rows(out),jls)]
+
+    def clone_pool(self):
+        # Single pool shared with jails
+        return self._clone_pool
+
+    def epair_pool(self):
+        return EpairPool(self.config.bridge,self.config.mtu,self.config.epair_pool,cmd=self.cmd)
 
     def jail(self,name,params=None,debug=None):
         if debug is None:
             debug = self.debug
-        return Jail(self.generate_jail_config(name),params,debug)
-        
+        return self.jail_class(self.generate_jail_config(name),params,debug,self)
+
+    def load_args(self):
+        return ("/sbin/zfs","get","-Hp","-r","-d","1","-t","filesystem",
+                "-o","name,value","jail:config",self.config.zvol)
+
+    @op
+    def load_jails(self,cls=None):
+        """
+            Rebuild all jails from their stored jail:config property (single
+            zfs get) - returns {name:Jail}
+        """
+        return self.decode_jails((yield self.cmd(*self.load_args())),cls)
+
+    def decode_jails(self,out,cls=None):
+        # Property values are multi-line (INI) so split output on dataset
+        # names rather than lines
+        cls = cls or self.jail_class
+        jails = {}
+        records = re.split(f"^({re.escape(self.config.zvol)}/[^\t\n]+)\t",out,flags=re.M)
+        for i in range(1,len(records),2):
+            value = records[i+1].rstrip("\n")
+            if value != "-":
+                jail = cls.from_text(value,debug=self.debug,host=self)
+                jails[jail.config.name] = jail
+        return jails
+
+    @op
+    def match_jails(self,patterns):
+        """
+            Expand list of names/glob patterns against existing jails
+        """
+        names = None
+        matched = {}
+        for p in patterns:
+            if any(c in p for c in "*?["):
+                if names is None:
+                    names = [ j["name"] for j in (yield self.list_jails()) ]
+                matched.update(dict.fromkeys(fnmatch.filter(names,p)))
+            else:
+                matched[p] = None
+        return [*matched]
+
+    def run_bulk(self,f,names,workers=8):
+        """
+            Run f(name) for each name with at most `workers` in flight
+            (worker pool or event loop) - f returns the op result
+
+            Returns ([BulkResult,...],wall_time) with results in input order
+        """
+        return self.cmd.bulk(f,names,workers)
+
+    @op
+    def create_many(self,names,workers=8,atomic=True):
+        """
+            Create jail filesystems on worker pool - if atomic is set and
+            any jail fails the jails created by this call are destroyed
+        """
+        names = [*dict.fromkeys(names)]
+        (results,elapsed) = yield self.run_bulk(lambda name: self.jail(name).create_fs(refill=False),
+                                                names,workers)
+        if atomic and not all(r.ok for r in results):
+            created = [ r.name for r in results if r.ok ]
+            yield self.run_bulk(lambda name: self.jail(name).destroy_fs(),created,workers)
+            for r in results:
+                if r.ok:
+                    (r.ok,r.error) = (False,"rolled back")
+        if self.config.clone_pool:
+            self.clone_pool().refill((yield self.get_latest_snapshot()))
+        return (results,elapsed)
+
+    @op
+    def setup_many(self,names,workers=8,setup=None):
+        """
+            Create jails and call setup(jail) on worker pool, then add rctl
+            rules for the configured jails in batches - jails which don't
+            exist or are already running fail before any rules are added.
+            Returns ({name:Jail},[BulkResult,...])
+        """
+        jails = {}
+        with self.steps("status"):
+            rows = { j["name"]:j for j in (yield self.list_jails(status=True)) }
+        def _setup(name):
+            if name not in rows:
+                raise ValueError(f"Jail FS not found: {name}")
+            if rows[name]["running"]:
+                raise ValueError(f"Jail running: {name} ({rows[name]['jname']})")
+            jail = jails[name] = self.jail(name)
+            if setup:
+                setup(jail)
+            # Check profile exists
+            jail.rctl_rules()
+        (results,_) = yield self.run_bulk(_setup,(yield self.match_jails(names)),workers)
+        yield self.add_rctl_rules([ jails[r.name] for r in results if r.ok ])
+        return (jails,results)
+
+    @op
+    def add_rctl_rules(self,jails):
+        """
+            Add rctl rules for jails with batched rctl(8) calls (at most
+            rctl.RULES_PER_CALL rules each) - if a call fails its jails add
+            their own rules on start so that errors are reported per jail
+        """
+        for batch in rctl.batches(jails):
+            with self.steps("rctl"):
+                ok = yield self.cmd.check("/usr/bin/rctl","-a",*[ r for (_,rules) in batch for r in rules ])
+            for (jail,_) in batch:
+                jail.rctl_applied = ok
+
+    @op
+    def start_many(self,names,workers=8,setup=None):
+        """
+            Start jails on worker pool - setup(jail) is called to configure
+            each jail before it is started (rctl rules for all jails are
+            added first in batches)
+        """
+        start = time.perf_counter()
+        (jails,results) = yield self.setup_many(names,workers,setup)
+        def _start(name):
+            try:
+                yield jails[name].start()
+            except Exception:
+                # Failed before prepare_start - remove rules added by batch
+                if jails[name].rctl_applied and not (yield jails[name].is_running()):
+                    yield jails[name].rctl_remove()
+                raise
+        (started,_) = yield self.run_bulk(lambda name: self.cmd.drive(_start(name)),
+                                          [ r.name for r in results if r.ok ],workers)
+        return (merge_results(results,started),time.perf_counter()-start)
+
+    @op
+    def exec_all(self,args,patterns=None,base=None,workers=8,timeout=None,output=None):
+        """
+            Run command (jexec) in running jails matching name glob patterns
+            and base on worker pool. Each jail is limited to timeout seconds
+            and output(name,line) is called for each line of output as it
+            is produced.
+
+            Returns ([BulkResult,...],wall_time) (returncode set for failed
+            jails, None if timed out)
+        """
+        names = [ j["name"] for j in (yield self.select_jails(running=True,base=base))
+                    if not patterns or any(fnmatch.fnmatch(j["name"],p) for p in patterns) ]
+        def _exec(name):
+            rc = yield self.jail(name).jexec_stream(*args,timeout=timeout,
+                        output=(lambda line: output(name,line)) if output else (lambda line: None))
+            if rc != 0:
+                raise subprocess.CalledProcessError(rc,args)
+        return (yield self.run_bulk(lambda name: self.cmd.drive(_exec(name)),names,workers))
+
+    @op
+    def jail_conf(self,names,hooks=True,depend=None,setup=None):
+        """
+            Render jail.conf fragment for jails (depend maps name to list of
+            names of jails it depends on and setup(jail) is called to
+            configure each jail)
+        """
+        return self.render_conf((yield self.match_jails(names)),hooks,depend,setup)
+
+    def render_conf(self,names,hooks=True,depend=None,setup=None):
+        # jail.conf for matched names (no commands run)
+        jails = {}
+        for name in names:
+            jail = self.jail(name)
+            if setup:
+                setup(jail)
+            jails[jail.config.jname] = jail.conf_params(hooks,
+                        [ f"j_{self.generate_hash(d)}" for d in (depend or {}).get(name,[]) ])
+        return jailconf.render(jails)
+
+    @op
+    @timed("boot_many")
+    def boot_many(self,names,workers=8,setup=None,depend=None):
+        """
+            Start jails with a single jail(8) invocation - host side setup
+            (epair/rc.conf) is run on worker pool and the jails are then
+            created from a generated jail.conf (jail -f - -c j1 j2 ...) so
+            that the configuration is parsed once and jail(8) orders the
+            jails using depend (see jail_conf)
+
+            Returns ([BulkResult,...],wall_time)
+        """
+        start = time.perf_counter()
+        prepared = {}
+        (jails,results) = yield self.setup_many(names,workers,setup)
+        def _prepare(name):
+            try:
+                prepared[name] = (jails[name],(yield jails[name].prepare_start()))
+            except Exception:
+                yield jails[name].abort_start()
+                raise
+        with self.steps("prepare"):
+            (ready,_) = yield self.run_bulk(lambda name: self.cmd.drive(_prepare(name)),
+                                            [ r.name for r in results if r.ok ],workers)
+            results = merge_results(results,ready)
+        ready = [ r.name for r in results if r.ok ]
+        if ready:
+            conf = { prepared[n][0].config.jname:prepared[n][0].conf_params(False,
+                            [ f"j_{self.generate_hash(d)}" for d in (depend or {}).get(n,[]) ])
+                      for n in ready }
+            with self.steps("jail"):
+                result = yield self.cmd.run("/usr/sbin/jail","-f","-","-cv" if self.debug else "-c",*conf,
+                                            input=jailconf.render(conf).encode(),check=False)
+            running = (yield self.jls_snapshot()) if result.returncode != 0 else None
+            for r in results:
+                jail = prepared[r.name][0] if r.ok else None
+                if jail and running is not None and jail.config.jname not in running:
+                    # Not created - remove epair/cpuset claim
+                    yield jail.abort_start()
+                    (r.ok,r.error) = (False,"jail(8) failed" +
+                                            (f": {result.stderr.strip().decode()}" if result.stderr else ""))
+            if self.config.proxy or self.placement:
+                # Proxy routes/cpuset need the jail to exist
+                with self.steps("finish"):
+                    yield self.run_bulk(lambda name: prepared[name][0].finish_start(prepared[name][1]),
+                                        [ r.name for r in results if r.ok ],workers)
+        return (results,time.perf_counter()-start)
+
+    @op
+    def apply_state(self):
+        """
+            Snapshot of actual state for manifest.plan() - zfs datasets
+            (with applied spec), running jails and host interfaces with one
+            command each
+        """
+        (out,jls,ifaces) = yield self.cmd.gather(self.cmd(*self.apply_state_args()),
+                                                 self.cmd("/usr/sbin/jls","--libxo=json",*JLS_PARAMS),
+                                                 self.cmd("/sbin/ifconfig","-l"))
+        return (self.decode_apply_state(out,parse_jls(jls)),set(ifaces.split()))
+
+    def apply_state_args(self):
+        return ("/sbin/zfs","list","-r","-H","-o","name,jail:name,jail:base,jail:spec",
+                self.config.zvol)
+
+    def decode_apply_state(self,out,running):
+        actual = {}
+        for l in out.split("\n"):
+            f = l.split("\t")
+            if len(f) == 4 and f[2] != "-":
+                volume = os.path.basename(f[0])
+                actual[f[1]] = dict(running=f"j_{volume}" in running,spec=f[3],epair=f"{volume}A")
+        return actual
+
+    def ddns_cmds(self,actions,jails,names):
+        # DDNS update commands for applied jails
+        cmds = []
+        for name in names:
+            if "ddns-add" in actions[name]:
+                cmds.append(f"add {name} AAAA {jails[name].config.address}")
+            elif "ddns-del" in actions[name]:
+                cmds.append(f"del {name}")
+        return cmds
+
+    def applied_digest(self,spec,actions,actual,published):
+        # jail:spec value recorded for applied spec
+        digest = spec.digest()
+        if not published and ({"ddns-add","ddns-del"} & set(actions)):
+            # Keep previous DDNS flag (update retried on next apply)
+            digest = digest[:-1] + ("1" if manifest.published(actual) else "0")
+        return digest
+
+    @op
+    @timed("apply")
+    def apply(self,specs,workers=8,prune=False,dry_run=False,ddns=None):
+        """
+            Reconcile jails with manifest specs ({name:JailSpec}) - actual
+            state is scanned once and only the actions computed by
+            manifest.plan() are run (jails in parallel on worker pool).
+
+            DDNS changes are sent as a single update with ddns(*cmds) (eg.
+            DDNSConfig.update - blocking, run in an executor by AsyncHost)
+            before the applied spec is recorded, so that records which
+            could not be published are retried on next apply.
+
+            Returns (actions,[BulkResult,...],wall_time,ddns_error)
+        """
+        start = time.perf_counter()
+        with self.steps("state"):
+            (actual,epairs) = yield self.apply_state()
+        actions = manifest.plan(specs,actual,epairs,prune)
+        if dry_run or not actions:
+            return (actions,[],time.perf_counter()-start,None)
+        mounts = yield self.bulk_mounts()
+        jails = {}
+        def _apply(name):
+            spec = specs.get(name)
+            jail = jails[name] = self.bulk_jail(name,mounts)
+            for action in actions[name]:
+                if action == "create":
+                    yield jail.create_fs(refill=False)
+                elif action == "users":
+                    for (user,pk) in spec.users:
+                        if user == "root" or not (yield jail.cmd.check("/usr/sbin/pw","-R",
+                                                        jail.config.path,"usershow","-n",user)):
+                            yield jail.adduser(user,pk)
+                    for user in spec.wheel:
+                        yield jail.usermod(user,"-G","wheel")
+                elif action == "start":
+                    spec.configure(jail)
+                    yield jail.start()
+                elif action == "restart":
+                    yield jail.stop()
+                    spec.configure(jail)
+                    yield jail.start()
+                elif action == "stop":
+                    yield jail.stop()
+                elif action == "cleanup":
+                    yield jail.destroy_epair()
+                elif action == "destroy":
+                    yield jail.remove(force=True)
+        with self.steps("actions"):
+            (results,_) = yield self.run_bulk(lambda name: self.cmd.drive(_apply(name)),
+                                              [*actions],workers)
+        if self.config.clone_pool and any("create" in a for a in actions.values()):
+            self.clone_pool().refill((yield self.get_latest_snapshot()))
+
+        ok = [ r.name for r in results if r.ok ]
+        cmds = self.ddns_cmds(actions,jails,ok)
+        (published,error) = (False,None)
+        if cmds and ddns:
+            with self.steps("ddns"):
+                try:
+                    yield self.cmd.blocking(ddns,*cmds)
+                    published = True
+                except ValueError as e:
+                    error = str(e)
+
+        def _record(name):
+            digest = self.applied_digest(specs[name],actions[name],actual.get(name),published)
+            return jails[name].zfs_set(f"jail:spec={digest}")
+        with self.steps("record"):
+            (recorded,_) = yield self.run_bulk(_record,[ n for n in ok if "record" in actions[n] ],
+                                               workers)
+        failed = { r.name:r for r in recorded if not r.ok }
+        results = [ failed.get(r.name,r) for r in results ]
+        return (actions,results,time.perf_counter()-start,error)
+
+    @op
+    def rebalance_cpus(self,dry_run=False):
+        """
+            Reallocate CPUs for running jails (allocations for jails which
+            are no longer running are dropped) - returns changed jails as
+            [(name,old_cpus,new_cpus,error),...]
+        """
+        if not self.placement:
+            raise ValueError("CPU placement not enabled (cpuset not set in config)")
+        running = yield self.jls_snapshot()
+        return (yield self.cmd.blocking(self.placement.rebalance,running,dry_run))
+
+    @op
+    def bulk_mounts(self):
+        # Mount table snapshot shared by jails in bulk operation
+        mounts = MountTable(self.cmd.sync())
+        mounts.update((yield self.cmd(*mounts.list_args())))
+        return mounts
+
+    def bulk_jail(self,name,mounts):
+        # Jail sharing mount table snapshot with other jails in bulk operation
+        jail = self.jail(name)
+        jail.mounts = mounts
+        return jail
+
+    @op
+    def stop_many(self,names,workers=8):
+        names = yield self.match_jails(names)
+        mounts = (yield self.bulk_mounts()) if names else None
+        return (yield self.run_bulk(lambda name: self.bulk_jail(name,mounts).stop(),names,workers))
+
+    @op
+    def remove_many(self,names,workers=8,force=False):
+        names = yield self.match_jails(names)
+        mounts = (yield self.bulk_mounts()) if names else None
+        return (yield self.run_bulk(lambda name: self.bulk_jail(name,mounts).remove(force=force),
+                                    names,workers))
+
+class Host(BaseHost):
+
+    """
+        Host with blocking commands (bulk operations run on a worker pool)
+    """
+
+    command = Command
+    jail_class = Jail
+
+    def __init__(self,config:HostConfig,debug:bool=False,rctl_profiles:dict=None):
+        super().__init__(config,debug,rctl_profiles)
+        self.check_base()
+
+    def iter_jails(self,status=False,running=None,base=None,name_glob=None):
+        """
+            Generate jail rows (see select_jails)
+        """
+        yield from self.select_jails(status,running,base,name_glob)
@@ -6,48 +6,100 @@ from enum import Enum
 from dataclasses import fields
 from ipaddress import IPv6Network,IPv6Address
 
+def _unsupported(t):
+    def _codec(v):
+        raise ValueError("Unsupported field type:",t)
+    return _codec
+
+def _encoder(t):
+    if t in (str,int,float,bool,IPv6Network,IPv6Address):
+        return str
+    elif t is bytes:
+        return lambda v: binascii.hexlify(v).decode('ascii')
+    elif t is datetime:
+        return datetime.isoformat
+    elif isinstance(t,type) and issubclass(t,Enum):
+        return lambda v: v.name
+    return _unsupported(t)
+
+def _decoder(t):
+    if t in (str,int,float,IPv6Network,IPv6Address):
+        return t
+    elif t is bool:
+        return lambda v: v.lower() == 'true'
+    elif t is bytes:
+        return binascii.unhexlify
+    elif t is datetime:
+        return datetime.fromisoformat
+    elif isinstance(t,type) and issubclass(t,Enum):
+        return lambda v: t[v]
+    return _unsupported(t)
+
+def parse_sections(text):
+    """
+        Parse INI text as written by ConfigParser.write (no interpolation,
+        lower case keys) as {section:{key:value}} - much cheaper than
+        ConfigParser for bulk decoding
+    """
+    sections = {}
+    section = key = None
+    for l in text.split('\n'):
+        if not l.strip() or l[0] in '#;':
+            continue
+        elif l[0] == '[':
+            section = sections.setdefault(l.strip()[1:-1],{})
+        elif l[0] in ' \t' and key is not None:
+            # Continuation line
+            section[key] += '\n' + l.strip()
+        elif section is None:
+            raise ValueError(f"Invalid config (no section): {l}")
+        else:
+            (key,sep,value) = l.partition('=')
+            if not sep:
+                (key,sep,value) = l.partition(':')
+            key = key.strip().lower()
+            section[key] = value.strip()
+    return sections
+
 class IniEncoderMixin:
 
     """
         Mixin for dataclass which supports automatic encoding/decoding
         to/from INI file using type hints from dataclass fields
+
+        Field encoders/decoders are built once per class (_codecs)
     """
 
+    @classmethod
+    def _codecs(cls):
+        # {name:(field,encode,decode)} - cached on the class itself (not
+        # inherited as subclasses may add fields)
+        codecs = cls.__dict__.get('_ini_codecs')
+        if codecs is None:
+            codecs = { f.name:(f,_encoder(f.type),_decoder(f.type)) for f in fields(cls) }
+            cls._ini_codecs = codecs
+        return codecs
+
     def _encode(self,field):
-        if field.type in (str,int,float,bool):
-            return str(getattr(self,field.name))
-        elif field.type is bytes:
-            return binascii.hexlify(getattr(self,field.name)).decode('ascii')
-        elif field.type is datetime:
-            return getattr(self,field.name).isoformat()
-        elif field.type in (IPv6Network,IPv6Address):
-            return str(getattr(self,field.name))
-        elif issubclass(field.type,Enum):
-            return getattr(self,field.name).name
-        else:
-            raise ValueError("Invalid field type:", field) 
+        return self._codecs()[field.name][1](getattr(self,field.name))
 
     def write_config(self,section,c=None):
         c = c or configparser.ConfigParser(interpolation=None)
-        c[section] = { f.name:self._encode(f) for f in fields(self) }
+        c[section] = { name:encode(getattr(self,name))
+                            for (name,(_,encode,_)) in self._codecs().items() }
         return c
 
     @classmethod
     def _decode(cls,field,value):
-        if field.type in (str,int,float):
-            return field.type(value)
-        elif field.type is bool:
-            return (value.lower() == 'true')
-        elif field.type is bytes:
-            return binascii.unhexlify(value)
-        elif field.type is datetime:
-            return datetime.fromisoformat(value)
-        elif field.type in (IPv6Network,IPv6Address):
-            return field.type(value)
-        elif issubclass(field.type,Enum):
-            return field.type[value]
-        else:
-            raise ValueError("Unsupported type:",field)
+        return cls._codecs()[field.name][2](value)
+
+    @classmethod
+    def from_section(cls,params):
+        """
+            Create from {key:value} (section of parsed config)
+        """
+        codecs = cls._codecs()
+        return cls(**{k:codecs[k][2](v) for k,v in params.items()})
 
     @classmethod
     def read_config(cls,section,c=None,f=None):
@@ -56,7 +108,4 @@ class IniEncoderMixin:
         if c is None:
             c = configparser.ConfigParser(interpolation=None)
             c.read_file(f)
-        params = dict(c[section])
-        fieldmap = { f.name:f for f in fields(cls) }
-        return cls(**{k:cls._decode(fieldmap[k],v) for k,v in params.items()})
-
+        return cls.from_section(dict(c[section]))
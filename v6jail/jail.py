@@ -1,36 +1,50 @@
 
-import configparser,functools,io,os,pathlib,re,shutil,subprocess,tempfile
+import collections,configparser,functools,io,os,pathlib,re,shutil,subprocess,tempfile
 
-from .util import Command
+from .util import Command,StepTimer,op,op_body,timed
+from .clonepool import ClonePool
 from .config import JailConfig
+from .ini_encoder import parse_sections
+from .epair import EpairPool,bridge_lock
 from .jailparam import JailParam
+from .mounts import MountTable,parse_fstab
+from .snapshots import SnapshotIndex
 
-# Use decorators to check state
+# Use decorators to check state (inside @op)
 def check_running(f):
     @functools.wraps(f)
     def _wrapper(self,*args,**kwargs):
-        if not self.is_running():
+        if not (yield self.is_running()):
             raise ValueError(f"Jail not running: {self.config.name} ({self.config.jname})")
-        return f(self,*args,**kwargs)
+        return (yield from op_body(f(self,*args,**kwargs)))
     return _wrapper
 
 def check_not_running(f):
     @functools.wraps(f)
     def _wrapper(self,*args,**kwargs):
-        if self.is_running():
+        if (yield self.is_running()):
             raise ValueError(f"Jail running: {self.config.name} ({self.config.jname})")
-        return f(self,*args,**kwargs)
+        return (yield from op_body(f(self,*args,**kwargs)))
     return _wrapper
 
 def check_fs_exists(f):
     @functools.wraps(f)
     def _wrapper(self,*args,**kwargs):
-        if not self.check_fs():
+        if not (yield self.check_fs()):
             raise ValueError(f"Jail FS not found: {self.config.name} ({self.config.zpath})")
-        return f(self,*args,**kwargs)
+        return (yield from op_body(f(self,*args,**kwargs)))
     return _wrapper
 
-class Jail:
+class BaseJail:
+
+    """
+        Jail logic shared by Jail and aio.AsyncJail. Methods which run
+        commands are ops (see util.op) or return the command result
+        directly, so they block (Jail) or return awaitables (AsyncJail)
+        depending on the command class
+    """
+
+    command = None
 
     @classmethod
     def from_config(cls,f,jail_section="jail",jailparam_section="jail_params",debug=False):
@@ -40,14 +54,47 @@ class Jail:
         params = JailParam.read_config(jailparam_section,c=c)
         return cls(config,params,debug)
 
-    def __init__(self,config,params=None,debug=False):
+    @classmethod
+    def from_text(cls,text,jail_section="jail",jailparam_section="jail_params",debug=False,host=None):
+        # Decode stored config (get_config output) without ConfigParser
+        sections = parse_sections(text)
+        return cls(JailConfig.from_section(sections[jail_section]),
+                   JailParam.from_section(sections[jailparam_section]),debug,host)
+
+    def __init__(self,config,params=None,debug=False,host=None):
 
         # Jail params
         self.config = config
         self.debug = debug
         self.params = params or self.generate_jail_params()
 
-        self.cmd = Command(self.debug)
+        self.cmd = self.command(self.debug)
+        self.steps = StepTimer(self.cmd,host.metrics if host else None)
+
+        # CPU placement (policy/cpus default to host config if None) -
+        # allocated CPUs are claimed before start and applied after
+        self.placement = host.placement if host else None
+        self.cpu_policy = None
+        self.cpus = None
+        self.allocated_cpus = None
+
+        # Named rctl profiles - rules for config.rctl profile are added before
+        # start (unless already added by bulk start) and removed on stop
+        self.rctl_profiles = host.rctl_profiles if host else {}
+        self.rctl_applied = False
+
+        # Shared host state (if created from Host)
+        self.host = host
+        self.snapshots = host.snapshots if host else \
+                            SnapshotIndex(self.config.base_zvol,self.cmd.sync())
+
+        # Mount table snapshot (bulk operations on Host share a single table)
+        self.mounts = MountTable(self.cmd.sync())
+        self.epair_pool = EpairPool(self.config.bridge,self.config.mtu,
+                                    self.config.epair_pool,self.config.private,self.cmd)
+        self.clone_pool = host.clone_pool() if host else \
+                            ClonePool(self.config.base_zvol,self.config.clone_pool,
+                                      self.cmd,self.snapshots)
 
         # Useful commands
         self.ifconfig       = lambda *args: self.cmd("/sbin/ifconfig",*args)
@@ -61,14 +108,15 @@ class Jail:
         self.jail_stop      = lambda : self.cmd("/usr/sbin/jail","-Rv",self.config.jname)
         self.useradd        = lambda user:  self.cmd("/usr/sbin/pw","-R",self.config.path,
                                                 "useradd","-n",user,"-m","-s","/bin/sh","-h","-")
-        self.usershow       = lambda user:  self.cmd("/usr/sbin/pw","-R",self.config.path,
-                                                "usershow","-n",user).split(":")
         self.usermod        = lambda user,*args: self.cmd("/usr/sbin/pw","-R",self.config.path,
                                                 "usermod","-n",user,*args)
-        self.umount_devfs   = lambda : self.cmd("/sbin/umount",f"{self.config.path}/dev")
+        self.set_rc         = lambda *args: self.cmd("/usr/sbin/sysrc","-R",self.config.path,*args)
+        self.rctl_add       = lambda *rules: self.cmd("/usr/bin/rctl","-a",*rules)
+        self.rctl_remove    = lambda : self.cmd.nocheck("/usr/bin/rctl","-r",
+                                                f"jail:{self.config.jname}")
         self.osrelease      = lambda : self.cmd("/usr/bin/uname","-r")
         self.mounted_fs     = lambda : self.cmd("/sbin/mount")
-        self.umount_fs      = lambda args : self.cmd("/sbin/mount","-f",*args)
+        self.umount_fs      = lambda args : self.cmd("/sbin/umount","-f",*args)
 
     def write_jail_file(self,jail_path,contents,mode=0o644,binary=False):
         if jail_path.startswith('/'):
@@ -80,13 +128,21 @@ class Jail:
             dest.write_text(contents)
         dest.chmod(mode)
 
+    @op
     def get_latest_snapshot(self):
-        out = self.cmd("/sbin/zfs", "list", "-Hrt", "snap", "-d", "1", "-s", "creation", "-o", "name", 
-                              f"{self.config.base_zvol}")
-        if out:
-            return out.split("\n")[-1]
-        else:
-            raise ValueError(f"No snapshots found: {self.config.base_zvol}")
+        if not self.snapshots.loaded:
+            self.snapshots.update((yield self.cmd(*self.snapshots.list_args())))
+        return self.snapshots.latest()
+
+    @op
+    def load_mounts(self):
+        if not self.mounts.loaded:
+            self.mounts.update((yield self.cmd(*self.mounts.list_args())))
+        return self.mounts
+
+    @op
+    def usershow(self,user):
+        return (yield self.cmd("/usr/sbin/pw","-R",self.config.path,"usershow","-n",user)).split(":")
 
     def generate_jail_params(self):
         params = JailParam.default()
@@ -101,61 +157,128 @@ class Jail:
         params.set("host.hostuuid",self.config.name)
         return params
 
-    def create_epair(self):
-        if self.check_epair():
-            self.destroy_epair()
-        epair = self.ifconfig("epair","create")[:-1]
-        self.ifconfig(f"{epair}a","name",self.config.epair_host)
-        self.ifconfig(f"{epair}b","name",self.config.epair_jail)
+    def epair_host_args(self):
         # If bridge has IPv6 address can't configure link-local address
-        self.ifconfig(self.config.epair_host,"inet6","-auto_linklocal","mtu",str(self.config.mtu),"up")
-        self.ifconfig(self.config.epair_jail,"inet6","auto_linklocal","-ifdisabled","mtu",str(self.config.mtu),"up")
+        return ("name",self.config.epair_host,
+                "inet6","-auto_linklocal","mtu",str(self.config.mtu),"up")
+
+    def epair_jail_args(self):
+        return ("name",self.config.epair_jail,
+                "inet6","auto_linklocal","-ifdisabled","mtu",str(self.config.mtu),"up")
+
+    @op
+    def create_epair(self):
+        if self.config.epair_pool and \
+                (yield self.epair_pool.claim(self.epair_host_args(),self.epair_jail_args())):
+            return
+        # Rename and configure each side in a single ifconfig call - only
+        # check for a stale epair if the rename fails
+        epair = (yield self.ifconfig("epair","create"))[:-1]
+        try:
+            yield self.ifconfig(f"{epair}a",*self.epair_host_args())
+        except subprocess.CalledProcessError:
+            if not (yield self.check_epair()):
+                yield self.try_ifconfig(f"{epair}a","destroy")
+                raise
+            yield self.destroy_epair()
+            yield self.ifconfig(f"{epair}a",*self.epair_host_args())
+        yield self.ifconfig(f"{epair}b",*self.epair_jail_args())
         if self.config.private:
-            self.ifconfig(self.config.bridge,"addm",self.config.epair_host,
-                                             "private",self.config.epair_host)
+            yield self.cmd.locked(bridge_lock,lambda: self.ifconfig(self.config.bridge,"addm",
+                                    self.config.epair_host,"private",self.config.epair_host))
         else:
-            self.ifconfig(self.config.bridge,"addm",self.config.epair_host)
+            yield self.cmd.locked(bridge_lock,lambda: self.ifconfig(self.config.bridge,"addm",
+                                    self.config.epair_host))
 
     def destroy_epair(self):
-        self.try_ifconfig(self.config.epair_host,"destroy")
+        return self.try_ifconfig(self.config.epair_host,"destroy")
 
     def remove_vnet(self):
-        self.try_ifconfig(self.config.epair_jail,"-vnet",self.config.jname)
+        return self.try_ifconfig(self.config.epair_jail,"-vnet",self.config.jname)
 
+    def local_mounts(self):
+        """
+            Mounts from jail fstab which are mounted under the jail root
+            (deepest first) - other mounts under the root (eg. nullfs mounts
+            made from the host) are left in place until the jail is stopped
+        """
+        try:
+            with open(f"{self.config.path}/etc/fstab") as f:
+                fstab = collections.Counter(f"{self.config.path}{p}" for p in parse_fstab(f.read()))
+        except FileNotFoundError:
+            return []
+        fs = []
+        for m in self.mounts.under(self.config.path):
+            # Stacked mounts are unmounted once per fstab entry
+            if fstab[m.path] > 0:
+                fstab[m.path] -= 1
+                fs.append(m.path)
+        return fs
+
+    @op
     def umount_local(self):
-        if os.path.exists(f"{self.config.path}/etc/fstab"):
-            self.jexec("umount","-af")
+        # Unmount jail fstab filesystems (as umount -af in the jail) from
+        # host in deepest-first order - any left are forced after jail
+        # stopped
+        yield self.load_mounts()
+        fs = self.local_mounts()
+        if fs:
+            if (yield self.cmd.check("/sbin/umount",*fs)):
+                self.mounts.remove(*fs)
+            else:
+                self.mounts.invalidate()
 
+    @op
+    def umount_devfs(self):
+        yield self.cmd("/sbin/umount",f"{self.config.path}/dev")
+        self.mounts.remove(f"{self.config.path}/dev")
+
+    @op
     def force_umount(self):
-        fs = re.findall(f".* on ({self.config.path}/.*) \(.*\)",self.mounted_fs())
+        fs = [ m.path for m in (yield self.load_mounts()).under(self.config.path) ]
         if fs:
-            self.umount_fs(fs)
+            yield self.umount_fs(fs)
+            self.mounts.remove(*fs)
 
+    @op
     def get_lladdr(self,interface,jail=False):
-        (lladdr,) = re.search("inet6 (fe80::.*?)%",
-                              self.jexec('/sbin/ifconfig',interface) if jail else self.ifconfig(interface)
-                    ).groups()
+        if jail:
+            out = (yield self.jexec('/sbin/ifconfig',interface,capture=True)).stdout.decode()
+        else:
+            out = yield self.ifconfig(interface)
+        (lladdr,) = re.search("inet6 (fe80::.*?)%",out).groups()
         return lladdr
 
+    @op
     def get_ether(self,interface):
         (ether,) = re.search("ether (.*)",
-                             self.ifconfig(interface)
+                             (yield self.ifconfig(interface))
                    ).groups()
         return ether
 
+    @op
+    def get_link(self,interface):
+        # Get (lladdr,ether) from single ifconfig call
+        out = yield self.ifconfig(interface)
+        (lladdr,) = re.search("inet6 (fe80::.*?)%",out).groups()
+        (ether,) = re.search("ether (.*)",out).groups()
+        return (lladdr,ether)
+
+    @op
     def get_gateway(self,address):
         (gateway,) = re.search("gateway: (.*)",
-                               self.route6("get",address)
+                               (yield self.route6("get",address))
                      ).groups()
         return gateway
 
     def add_proxy_route(self,lladdr_jail,ether_jail):
-        self.route6("add",str(self.config.address),f"{lladdr_jail}%{self.config.bridge}")
+        return self.route6("add",str(self.config.address),f"{lladdr_jail}%{self.config.bridge}")
         #self.cmd('/usr/sbin/ndp','-ns',f"{lladdr_jail}%{self.config.bridge}",ether_jail)
         #self.jexec('/usr/sbin/ndp','-ns',str(self.config.gateway),self.get_ether(self.config.bridge))
 
+    @op
     def delete_proxy_route(self):
-        gw = self.get_gateway(str(self.config.address))
+        gw = yield self.get_gateway(str(self.config.address))
         #self.route6("delete",str(self.config.address))
         #self.cmd('/usr/sbin/ndp','-nd',gw)
 
@@ -168,25 +291,35 @@ class Jail:
     def check_epair(self):
         return self.cmd.check("ifconfig",self.config.epair_host)
 
+    @op
     def check_devfs(self):
-        out = self.cmd("mount","-t","devfs")
-        return re.search(f"{self.config.path}/dev",out) is not None
+        m = (yield self.load_mounts()).get(f"{self.config.path}/dev")
+        return m is not None and m.fstype == "devfs"
 
+    @op
     def is_vnet(self):
         try:
-            return self.cmd("/usr/sbin/jls","-j",self.config.jname,"vnet") == "1"
+            return (yield self.cmd("/usr/sbin/jls","-j",self.config.jname,"vnet")) == "1"
         except subprocess.CalledProcessError:
             return False
 
+    @op
     @check_running
     def jexec(self,*args,capture=False,check=False):
-        return subprocess.run(["/usr/sbin/jexec","-l",self.config.jname,*args],
-                              capture_output=capture,check=check)
+        return (yield self.cmd.run("/usr/sbin/jexec","-l",self.config.jname,*args,
+                                   capture=capture,check=check))
+
+    def jexec_stream(self,*args,output,timeout=None):
+        # Run command in jail calling output(line) as output is produced
+        return self.cmd.stream("/usr/sbin/jexec","-l",self.config.jname,*args,
+                               output=output,timeout=timeout)
 
+    @op
     @check_fs_exists
     def sysrc(self,*args):
-        return self.cmd("/usr/sbin/sysrc","-R",self.config.path,*args)
+        return (yield self.set_rc(*args))
 
+    @op
     @check_fs_exists
     def install(self,source,dest,mode="0755",user=None,group=None):
         try:
@@ -215,35 +348,38 @@ class Jail:
             s.close()
             d.close()
 
+    @op
     @check_fs_exists
     def mkstemp(self,suffix=None,prefix=None,dir=None,text=False):
         jdir = f"{self.config.path}/{dir}" if dir else f"{self.config.path}/tmp"
         fd,path = tempfile.mkstemp(suffix,prefix,jdir,text)
         return (fd, path[len(self.config.path):])
 
+    @op
     @check_fs_exists
     def adduser(self,user,pk):
         if user == "root":
             # Just add ssh key
-            try:
-                os.mkdir(f"{self.config.path}/root/.ssh",mode=0o700)
-            except FileExistsError:
-                pass
-            with open(f"{self.config.path}/root/.ssh/authorized_keys","a") as f:
-                f.write(f"\n{pk}\n")
-            os.chmod(f"{self.config.path}/root/.ssh/authorized_keys",0o600)
+            self.add_authorized_key("/root",pk)
         else:
-            self.useradd(user)
-            (name,_,uid,gid,*_) = self.usershow(user)
-            try:
-                os.mkdir(f"{self.config.path}/home/{user}/.ssh",mode=0o700)
-            except FileExistsError:
-                pass
-            with open(f"{self.config.path}/home/{user}/.ssh/authorized_keys","a") as f:
+            yield self.useradd(user)
+            (name,_,uid,gid,*_) = yield self.usershow(user)
+            self.add_authorized_key(f"/home/{user}",pk,int(uid),int(gid))
+
+    def add_authorized_key(self,home,pk,uid=None,gid=None):
+        ssh_dir = f"{self.config.path}{home}/.ssh"
+        try:
+            os.mkdir(ssh_dir,mode=0o700)
+        except FileExistsError:
+            pass
+        with open(f"{ssh_dir}/authorized_keys","a+") as f:
+            f.seek(0)
+            if pk.strip() not in f.read().split("\n"):
                 f.write(f"\n{pk}\n")
-            os.chown(f"{self.config.path}/home/{user}/.ssh",int(uid),int(gid))
-            os.chown(f"{self.config.path}/home/{user}/.ssh/authorized_keys",int(uid),int(gid))
-            os.chmod(f"{self.config.path}/home/{user}/.ssh/authorized_keys",0o600)
+        if uid is not None:
+            os.chown(ssh_dir,uid,gid)
+            os.chown(f"{ssh_dir}/authorized_keys",uid,gid)
+        os.chmod(f"{ssh_dir}/authorized_keys",0o600)
 
     def fastboot_script(self,services=None,cmds=None):
         services = [f"service {s} start" for s in services]
@@ -266,80 +402,230 @@ class Jail:
     def write_fastboot(self,services=None,cmds=None):
         self.write_jail_file("/etc/fastboot",self.fastboot_script(services,cmds),0o755)
 
-    def create_fs(self):
-        if self.check_fs():
-            raise ValueError(f"Jail FS exists: {self.config.name} ({self.config.zpath})")
-        self.zfs_clone(self.get_latest_snapshot(),self.config.zpath)
-        self.zfs_set(f"jail:name={self.config.name}",
-                     f"jail:ipv6={self.config.address}",
-                     f"jail:base={self.config.base}")
-        self.zfs_set(f"jail:config={self.get_config()}")
+    def fs_props(self):
+        return [f"jail:name={self.config.name}",
+                f"jail:ipv6={self.config.address}",
+                f"jail:base={self.config.base}",
+                f"jail:config={self.get_config()}"]
+
+    @op
+    @timed("create_fs")
+    def create_fs(self,refill=True):
+        with self.steps("check"):
+            if (yield self.check_fs()):
+                raise ValueError(f"Jail FS exists: {self.config.name} ({self.config.zpath})")
+            snapshot = yield self.get_latest_snapshot()
+        with self.steps("clone"):
+            if self.config.clone_pool and (yield self.clone_pool.claim(snapshot,self.config.zpath)):
+                yield self.zfs_set(*self.fs_props())
+            else:
+                # Clone and set properties in single command
+                yield self.zfs_clone(*[ a for p in self.fs_props() for a in ("-o",p) ],
+                                     snapshot,self.config.zpath)
+                self.snapshots.add_clone(snapshot)
+        if self.host:
+            self.host.jail_index.add(self.config.hash,self.config.name,self.config.address)
+        if self.config.clone_pool and refill:
+            with self.steps("refill"):
+                self.clone_pool.refill(snapshot)
+
+    def config_parser(self):
+        c = self.config.write_config("jail")
+        return self.params.write_config("jail_params",c)
 
     def get_config(self):
-        c = self.config.write_config("jail")
-        c = self.params.write_config("jail_params",c)
+        c = self.config_parser()
         with io.StringIO('w') as f:
             c.write(f)
             f.seek(0)
             return f.read()
 
+    def vnet_rc(self):
+        return [f"network_interfaces=lo0 {self.config.epair_jail}",
+                f"ifconfig_{self.config.epair_jail}_ipv6=inet6 {self.config.address}/{self.config.prefixlen}",
+                f"ipv6_defaultrouter={self.config.gateway}",
+                f"ifconfig_lo0=inet 127.0.0.1 up",
+                f"ifconfig_lo0_ipv6=inet6 up"]
+
+    @op
     @check_fs_exists
     def configure_vnet(self):
-        self.sysrc(f"network_interfaces=lo0 {self.config.epair_jail}",
-                   f"ifconfig_{self.config.epair_jail}_ipv6=inet6 {self.config.address}/{self.config.prefixlen}",
-                   f"ipv6_defaultrouter={self.config.gateway}",
-                   f"ifconfig_lo0=inet 127.0.0.1 up",
-                   f"ifconfig_lo0_ipv6=inet6 up")
+        yield self.set_rc(*self.vnet_rc())
 
+    @op
+    @timed("start")
     @check_fs_exists
     @check_not_running
     def start(self):
-        self.create_epair()
-        self.configure_vnet()
-        flags = "-cv" if self.debug else "-c"
-        lladdr_jail = self.get_lladdr(self.config.epair_jail)
-        ether_jail = self.get_ether(self.config.epair_jail)
-        subprocess.run(["/usr/sbin/jail",flags,*self.params.jail_params()],
-                       check=True)
+        # Step timings/command counts are available from self.steps
+        try:
+            link = yield self.prepare_start()
+            with self.steps("jail"):
+                flags = "-cv" if self.debug else "-c"
+                yield self.cmd.run("/usr/sbin/jail",flags,*self.params.jail_params(),capture=False)
+                # Jail start mounts devfs/fstab
+                self.mounts.invalidate()
+        except Exception:
+            yield self.abort_start()
+            raise
+        yield self.finish_start(link)
+
+    def rctl_rules(self):
+        # Rules for config.rctl profile (rctl -a format)
+        if not self.config.rctl:
+            return []
+        profile = self.rctl_profiles.get(self.config.rctl)
+        if profile is None:
+            raise ValueError(f"rctl profile not found: {self.config.rctl}")
+        return profile.rules(self.config.jname)
+
+    @op
+    def prepare_start(self):
+        # Host side setup before jail is created (FS/status already checked)
+        # - returns jail (lladdr,ether) if proxy is set
+        rules = self.rctl_rules()
+        if rules and not self.rctl_applied:
+            # Limits apply from first process in jail
+            with self.steps("rctl"):
+                yield self.rctl_add(*rules)
+                self.rctl_applied = True
+        if self.placement:
+            # Claimed first so that start fails before any host setup
+            with self.steps("cpuset"):
+                self.allocated_cpus = yield self.cmd.blocking(self.placement.claim,
+                                            self.config.name,self.config.jname,
+                                            self.cpu_policy,self.cpus)
+        with self.steps("epair"):
+            yield self.create_epair()
+        with self.steps("sysrc"):
+            yield self.set_rc(*self.vnet_rc())
+        if self.config.proxy:
+            with self.steps("link"):
+                return (yield self.get_link(self.config.epair_jail))
+
+    @op
+    def abort_start(self):
+        # Undo prepare_start (and rctl rules added by bulk start) if the
+        # jail was not created
+        with self.steps("rollback"):
+            yield self.destroy_epair()
+            if self.allocated_cpus:
+                yield self.cmd.blocking(self.placement.release,self.config.name)
+                self.allocated_cpus = None
+            if self.rctl_applied:
+                yield self.rctl_remove()
+                self.rctl_applied = False
+
+    @op
+    def finish_start(self,link):
+        # Host side setup after jail is created
         if self.config.proxy:
-            self.add_proxy_route(lladdr_jail,ether_jail)
+            with self.steps("proxy"):
+                yield self.add_proxy_route(*link)
+        if self.allocated_cpus:
+            with self.steps("cpuset"):
+                yield self.cmd.blocking(self.placement.apply,self.config.jname,self.allocated_cpus)
+
+    def prestart_script(self):
+        # Shell equivalent of prepare_start (without epair pool/proxy) for
+        # jail.conf exec.prestart - no single quotes so that the value can
+        # be single-quoted in jail.conf (no variable expansion)
+        private = f" private {self.config.epair_host}" if self.config.private else ""
+        rc = " ".join(f'"{v}"' for v in self.vnet_rc())
+        return (f"e=$(/sbin/ifconfig epair create) && "
+                f"/sbin/ifconfig $e {' '.join(self.epair_host_args())} && "
+                f"/sbin/ifconfig ${{e%a}}b {' '.join(self.epair_jail_args())} && "
+                f"/sbin/ifconfig {self.config.bridge} addm {self.config.epair_host}{private} && "
+                f"/usr/sbin/sysrc -R \"{self.config.path}\" {rc} >/dev/null")
+
+    def conf_params(self,hooks=True,depend=()):
+        """
+            Copy of jail params for jail.conf export - if hooks is set the
+            epair is created by exec.prestart and destroyed by exec.poststop
+            (depend is list of jnames)
+        """
+        params = JailParam(**self.params.data)
+        if hooks:
+            prestart = self.params.data.get("exec.prestart")
+            rctl = " ".join(self.rctl_rules())
+            params["exec.prestart"] = (f"/usr/bin/rctl -a {rctl} && " if rctl else "") + \
+                                        self.prestart_script() + (f" && {prestart}" if prestart else "")
+            params["exec.poststop"] = f"/sbin/ifconfig {self.config.epair_host} destroy" + \
+                                        (f"; /usr/bin/rctl -r jail:{self.config.jname}" if rctl else "")
+        if depend:
+            params["depend"] = ",".join(depend)
+        return params
 
+    @op
+    @timed("stop")
     @check_running
     def stop(self):
-        self.umount_local()
-        self.remove_vnet()
-        self.destroy_epair()
-        self.jail_stop()
-        self.umount_devfs()
-        self.force_umount()
+        with self.steps("umount"):
+            yield self.umount_local()
+        with self.steps("epair"):
+            yield self.remove_vnet()
+            yield self.destroy_epair()
+        with self.steps("jail"):
+            yield self.jail_stop()
+        if self.rctl_profiles:
+            # All rules for jail (profile may have changed since start)
+            with self.steps("rctl"):
+                yield self.rctl_remove()
+        if self.placement:
+            with self.steps("cpuset"):
+                yield self.cmd.blocking(self.placement.release,self.config.name)
+        with self.steps("devfs"):
+            yield self.umount_devfs()
+            yield self.force_umount()
         if self.config.proxy:
-            self.delete_proxy_route()
-
+            with self.steps("proxy"):
+                yield self.delete_proxy_route()
+        if self.config.epair_pool:
+            # Recycle epair - refill pool to low-water mark
+            with self.steps("epair_pool"):
+                yield self.epair_pool.fill()
+
+    @op
     @check_fs_exists
     def destroy_fs(self):
-        self.cmd("/sbin/zfs","destroy","-f",self.config.zpath)
+        yield self.cmd("/sbin/zfs","destroy","-f",self.config.zpath)
+        if self.host:
+            self.host.jail_index.remove(self.config.hash)
 
+    @op
+    @timed("remove")
     def remove(self,force=False):
-        if self.is_running():
+        if (yield self.is_running()):
             if force:
-                self.stop()
+                yield self.stop()
             else:
                 raise ValueError(f"Jail running: {self.config.name} ({self.config.jname})")
-        if self.check_devfs():
-            self.umount_devfs()
-        if self.check_epair():
-            self.destroy_epair()
-        self.destroy_fs()
-
+        with self.steps("cleanup"):
+            if (yield self.check_devfs()):
+                yield self.umount_devfs()
+            if (yield self.check_epair()):
+                yield self.destroy_epair()
+        with self.steps("destroy_fs"):
+            yield self.destroy_fs()
+
+    @op
     def cleanup(self,force=False,destroy_fs=False):
-        if self.is_running() and force:
-            self.stop()
+        if (yield self.is_running()) and force:
+            yield self.stop()
         else:
             raise ValueError(f"Jail running: {self.config.name} ({self.config.jname})")
-        if self.check_devfs():
-            self.umount_devfs()
-        if self.check_epair():
-            self.destroy_epair()
-        if self.check_fs() and destroy_fs:
-            self.destroy_fs()
+        if (yield self.check_devfs()):
+            yield self.umount_devfs()
+        if (yield self.check_epair()):
+            yield self.destroy_epair()
+        if (yield self.check_fs()) and destroy_fs:
+            yield self.destroy_fs()
+
+class Jail(BaseJail):
+
+    """
+        Jail with blocking commands
+    """
+
+    command = Command
 
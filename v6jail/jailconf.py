@@ -0,0 +1,124 @@
+
+import re
+
+from .jailparam import JailParam
+
+# jail.conf(5) rendering/parsing for JailParam sets. Values which are not
+# simple words are single-quoted where possible (no variable expansion) so
+# that hook scripts can use shell variables
+
+_TOKEN = re.compile(r"""
+      (?P<space>\s+|\#[^\n]*|//[^\n]*|/\*.*?\*/)
+    | (?P<squote>'[^']*')
+    | (?P<dquote>"(?:[^"\\]|\\.)*")
+    | (?P<op>\+=|[{}=;,])
+    | (?P<word>[^\s{}=;,'"]+)
+""",re.X|re.S)
+
+_BARE = re.compile(r"[\w.:/@%+-]+")
+
+def quote(v):
+    v = str(v)
+    if _BARE.fullmatch(v):
+        return v
+    elif "'" not in v:
+        return f"'{v}'"
+    return '"' + re.sub(r'([\\"$])',r'\\\1',v) + '"'
+
+def _values(k,v):
+    if k in JailParam._list_params:
+        return v
+    elif k == "depend":
+        return [ d for d in v.split(",") if d ]
+    elif k in JailParam._bool_params:
+        return [str(v).lower()]
+    return [v]
+
+def render_block(name,params):
+    """
+        Render JailParam as jail.conf block (name param is the block name)
+    """
+    lines = [f"{name} {{"]
+    for (k,v) in params.data.items():
+        if k == "name":
+            continue
+        values = _values(k,v)
+        lines.append(f"    {k} = {', '.join(quote(x) for x in values)};" if values else f"    {k};")
+    lines.append("}")
+    return "\n".join(lines)
+
+def render(jails):
+    """
+        Render {name:JailParam} as jail.conf fragment
+    """
+    return "\n\n".join(render_block(name,params) for (name,params) in jails.items()) + "\n"
+
+def _tokens(text):
+    pos = 0
+    while pos < len(text):
+        m = _TOKEN.match(text,pos)
+        if not m:
+            raise ValueError(f"Invalid jail.conf syntax at offset {pos}: {text[pos:pos+20]!r}")
+        pos = m.end()
+        if m.lastgroup == "squote":
+            yield ("str",m.group()[1:-1])
+        elif m.lastgroup == "dquote":
+            yield ("str",re.sub(r"\\(.)",r"\1",m.group()[1:-1]))
+        elif m.lastgroup != "space":
+            yield (m.lastgroup,m.group())
+
+def parse(text):
+    """
+        Parse jail.conf blocks as {name:{param:[values]}} (a param with
+        no value is [] - see to_param). Global parameters and variable
+        substitution are not supported
+    """
+    jails = {}
+    tokens = _tokens(text)
+    for (kind,name) in tokens:
+        if kind not in ("word","str") or next(tokens,(None,None))[1] != "{":
+            raise ValueError(f"Invalid jail.conf: expected block at {name!r}")
+        block = jails.setdefault(name,{})
+        for (kind,k) in tokens:
+            if k == "}":
+                break
+            (kind,op) = next(tokens)
+            values = []
+            if op in ("=","+="):
+                for (kind,v) in tokens:
+                    if v == ";":
+                        break
+                    if v != ",":
+                        values.append(v)
+            elif op != ";":
+                raise ValueError(f"Invalid jail.conf: {name}: {k} {op}")
+            block[k] = block.get(k,[]) + values if op == "+=" else values
+        else:
+            raise ValueError(f"Invalid jail.conf: unterminated block {name!r}")
+    return jails
+
+def to_param(name,values):
+    """
+        Convert parsed block to JailParam (inverse of render_block)
+    """
+    j = JailParam(name=name)
+    for (k,v) in values.items():
+        if not v:
+            # Boolean without value - [param] sets true, [prefix.]no<param> false
+            (prefix,_,p) = k.rpartition(".")
+            if k not in JailParam._bool_params and p.startswith("no"):
+                j[f"{prefix}.{p[2:]}" if prefix else p[2:]] = False
+            else:
+                j[k] = True
+        elif k in JailParam._bool_params:
+            j[k] = (v[0].lower() in ("true","1","yes","on"))
+        elif k in JailParam._int_params:
+            j[k] = int(v[0])
+        elif k in JailParam._list_params:
+            j[k] = v
+        else:
+            j[k] = ",".join(v)
+    return j
+
+def read(text):
+    return { name:to_param(name,values) for (name,values) in parse(text).items() }
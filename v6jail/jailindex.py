@@ -0,0 +1,90 @@
+
+import ipaddress,os.path,threading
+
+from .util import Command
+
+class JailIndex:
+
+    """
+        Reverse index from jail hash, jname (j_<hash>), epair interface
+        (<hash>A/<hash>B) and IPv6 address to jail name. Loaded with a single
+        zfs get on first use and updated as jails are created/destroyed
+    """
+
+    def __init__(self,zvol,cmd=None):
+        self.zvol = zvol
+        self.cmd = cmd or Command()
+        self.lock = threading.RLock()
+        self.jails = None
+        self.keys = None
+
+    def list_args(self):
+        return ("/sbin/zfs","get","-H","-r","-d","1","-t","filesystem",
+                "-o","name,property,value","jail:name,jail:ipv6",self.zvol)
+
+    def update(self,out):
+        """
+            Rebuild index from output of list_args() command
+        """
+        props = {}
+        for l in out.split("\n"):
+            if l:
+                (vol,prop,value) = l.split("\t")
+                if vol != self.zvol and value != "-":
+                    props.setdefault(os.path.basename(vol),{})[prop] = value
+        with self.lock:
+            (self.jails,self.keys) = ({},{})
+            for (jail_hash,p) in props.items():
+                if "jail:name" in p:
+                    self._add(jail_hash,p["jail:name"],p.get("jail:ipv6"))
+
+    def load(self):
+        with self.lock:
+            if self.jails is None:
+                self.update(self.cmd(*self.list_args()))
+            return self.jails
+
+    @property
+    def loaded(self):
+        return self.jails is not None
+
+    def invalidate(self):
+        with self.lock:
+            self.jails = self.keys = None
+
+    def _keys(self,jail_hash,address):
+        keys = [jail_hash,f"j_{jail_hash}",f"{jail_hash}A",f"{jail_hash}B"]
+        if address:
+            keys.append(str(ipaddress.IPv6Address(address)))
+        return keys
+
+    def _add(self,jail_hash,name,address=None):
+        self.jails[jail_hash] = (name,address)
+        for k in self._keys(jail_hash,address):
+            self.keys[k] = name
+
+    def add(self,jail_hash,name,address=None):
+        with self.lock:
+            if self.jails is not None:
+                self.remove(jail_hash)
+                self._add(jail_hash,name,address and str(address))
+
+    def remove(self,jail_hash):
+        with self.lock:
+            if self.jails is not None and jail_hash in self.jails:
+                (name,address) = self.jails.pop(jail_hash)
+                for k in self._keys(jail_hash,address):
+                    self.keys.pop(k,None)
+
+    def lookup(self,key):
+        """
+            Return jail name for hash/jname/epair/IPv6 address (or None)
+        """
+        self.load()
+        name = self.keys.get(key)
+        if name is None:
+            try:
+                name = self.keys.get(str(ipaddress.IPv6Address(key.split("%")[0])))
+            except ValueError:
+                pass
+        return name
@@ -59,18 +59,19 @@ class JailParam(UserDict):
         self.update(values)
 
     def __setitem__(self,k,v):
-        if k in self._int_params:
+        kind = self._kinds.get(k)
+        if kind is int:
             self.data[k] = check(k,v,int)
-        elif k in self._str_params | self._pseudo_params:
+        elif kind is str:
             self.data[k] = check(k,v,str)
-        elif k in self._bool_params:
+        elif kind is bool:
             self.data[k] = check(k,v,bool)
-        elif k in self._control_params:
+        elif kind == 'control':
             if v in ('new','inherit','disable'):
                 self.data[k] = v
             else:
                 raise ValueError(f'Invalid jail param: {k}={v} (expecting new|inherit|disable)')
-        elif k in self._list_params:
+        elif kind is list:
             for i in v:
                 check(k,i,str)
             self.data[k] = v
@@ -151,13 +152,14 @@ class JailParam(UserDict):
 
     def set_kvpair(self,kv):
         k,v = kv.split('=',maxsplit=1)
-        if k in self._bool_params:
-            self.data[k] = v.lower == 'true'
-        elif k in self._int_params:
+        kind = self._kinds.get(k)
+        if kind is bool:
+            self.data[k] = v.lower() == 'true'
+        elif kind is int:
             self.data[k] = int(v)
-        elif k in self._list_params:
+        elif kind is list:
             self.data[k] = v.split(',')
-        elif k in self._str_params|self._pseudo_params|self._control_params:
+        elif kind in (str,'control'):
             self.data[k] = v
         else:
             raise ValueError(f"Invalid value: {k}={v}")
@@ -165,14 +167,13 @@ class JailParam(UserDict):
     def jail_params(self):
         params = []
         for k,v in self.data.items():
-            if k in self._bool_params:
+            kind = self._kinds.get(k)
+            if kind is bool:
                 params.append(f'{k}={str(v).lower()}')
-            elif k in self._int_params:
-                params.append(f'{k}={v}')
-            elif k in self._str_params|self._pseudo_params|self._control_params:
-                params.append(f'{k}={v}')
-            elif k in self._list_params:
+            elif kind is list:
                 params.append(f'{k}={",".join(v)}')
+            elif kind is not None:
+                params.append(f'{k}={v}')
             else:
                 raise ValueError(f"Invalid value: {k}={v}")
         return params
@@ -181,14 +182,11 @@ class JailParam(UserDict):
         c = c or configparser.ConfigParser(interpolation=None)
         params = {}
         for k,v in self.data.items():
-            if k in self._bool_params    |\
-                    self._int_params     |\
-                    self._str_params     |\
-                    self._pseudo_params  |\
-                    self._control_params:
-                params[k] = str(v)
-            elif k in self._list_params:
+            kind = self._kinds.get(k)
+            if kind is list:
                 params[k] = ','.join(v)
+            elif kind is not None:
+                params[k] = str(v)
             else:
                 raise ValueError(f"Invalid value: {k}={v}")
         c[section] = params
@@ -206,18 +204,36 @@ class JailParam(UserDict):
         if c is None:
             c = configparser.ConfigParser(interpolation=None)
             c.read_file(f)
+        return cls.from_section(dict(c[section]))
+
+    @classmethod
+    def from_section(cls,params):
+        """
+            Create from {key:value} (section of parsed config) - values are
+            decoded directly (already validated by type table)
+        """
         j = cls()
-        params = {}
-        for k,v in dict(c[section]).items():
-            if k in cls._bool_params:
-                j[k] = (v == 'True')
-            elif k in cls._int_params:
-                j[k] = int(v)
-            elif k in cls._str_params|cls._pseudo_params|cls._control_params:
+        data = j.data
+        for k,v in params.items():
+            kind = cls._kinds.get(k)
+            if kind is bool:
+                data[k] = (v == 'True')
+            elif kind is int:
+                data[k] = int(v)
+            elif kind is list:
+                data[k] = v.split(',')
+            elif kind == 'control':
                 j[k] = v
-            elif k in cls._list_params:
-                j[k] = v.split(',')
+            elif kind is str:
+                data[k] = v
             else:
                 raise ValueError(f"Invalid value: {k}={v}")
         return j
 
+# Param name -> kind (int/str/bool/list/'control') - precomputed so that
+# assignment/encoding is a single dict lookup
+JailParam._kinds = { **{ k:int for k in JailParam._int_params },
+                     **{ k:str for k in JailParam._str_params | JailParam._pseudo_params },
+                     **{ k:bool for k in JailParam._bool_params },
+                     **{ k:'control' for k in JailParam._control_params },
+                     **{ k:list for k in JailParam._list_params } }
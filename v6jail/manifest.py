@@ -0,0 +1,167 @@
+
+import configparser,hashlib
+from dataclasses import dataclass,field
+
+from .cpuset import POLICIES
+
+# Desired jail states
+STATES = ("running","stopped","absent")
+
+@dataclass
+class JailSpec:
+
+    """
+        Desired state of a jail from manifest section:
+
+            [jail web1]
+            state = running
+            params = allow.mount=true
+                     allow.raw_sockets=false
+            linux = false
+            fastboot = syslogd cron sshd
+            users = alice ssh-ed25519 AAAA...
+            wheel = alice
+            ddns = true
+            cpus = 2
+            cpu_policy = dedicated
+            rctl = build
+
+        state is running|stopped|absent, params/users are one per line
+        (users as "<user> <pk>"), fastboot lists the fastboot services (if
+        set), wheel the users added to wheel, ddns publishes an AAAA record,
+        cpus/cpu_policy set CPU placement (if enabled) and rctl the rctl
+        profile. Values can't have trailing comments
+    """
+
+    name:           str
+    state:          str = "running"
+    params:         list = field(default_factory=list)
+    linux:          bool = False
+    fastboot:       list = None
+    users:          list = field(default_factory=list)
+    wheel:          list = field(default_factory=list)
+    ddns:           bool = False
+    cpus:           int = None
+    cpu_policy:     str = None
+    rctl:           str = None
+
+    def digest(self):
+        """
+            Applied spec as stored in jail:spec property - separate digests
+            for start-time config (restart needed if changed) and users,
+            plus ddns flag
+        """
+        run = repr((sorted(self.params),self.linux,self.fastboot,self.cpus,self.cpu_policy,
+                    self.rctl)).encode()
+        users = repr((sorted(self.users),sorted(self.wheel))).encode()
+        return f"{hashlib.sha1(run).hexdigest()[:12]}:" \
+               f"{hashlib.sha1(users).hexdigest()[:12]}:" \
+               f"{int(self.ddns and self.state == 'running')}"
+
+    def configure(self,jail):
+        # As CLI --jail-params/--linux/--fastboot-service
+        for p in self.params:
+            jail.params.set_kvpair(p)
+        if self.fastboot is not None:
+            jail.write_fastboot(services=self.fastboot)
+            jail.params.set("exec.start","/bin/sh /etc/fastboot")
+        if self.linux:
+            jail.params.enable_linux()
+        (jail.cpus,jail.cpu_policy) = (self.cpus,self.cpu_policy)
+        if self.rctl is not None:
+            jail.config.rctl = self.rctl
+
+def _lines(v):
+    return [ l.strip() for l in v.split("\n") if l.strip() ]
+
+def read_manifest(f):
+    """
+        Read manifest ([jail <name>] sections) - returns {name:JailSpec}
+    """
+    c = configparser.ConfigParser(interpolation=None)
+    c.read_file(f)
+    specs = {}
+    for section in c.sections():
+        (kind,_,name) = section.partition(" ")
+        if kind != "jail" or not name.strip():
+            raise ValueError(f"Invalid manifest section: [{section}]")
+        s = c[section]
+        unknown = set(s) - {"state","params","linux","fastboot","users","wheel","ddns",
+                            "cpus","cpu_policy","rctl"}
+        if unknown:
+            raise ValueError(f"Invalid manifest key: [{section}] {','.join(sorted(unknown))}")
+        spec = JailSpec(name=name.strip(),
+                        state=s.get("state","running"),
+                        params=_lines(s.get("params","")),
+                        linux=s.getboolean("linux",False),
+                        fastboot=s["fastboot"].split() if "fastboot" in s else None,
+                        users=[ tuple(u.split(None,1)) for u in _lines(s.get("users","")) ],
+                        wheel=s.get("wheel","").split(),
+                        ddns=s.getboolean("ddns",False),
+                        cpus=s.getint("cpus"),
+                        cpu_policy=s.get("cpu_policy"),
+                        rctl=s.get("rctl"))
+        if spec.state not in STATES:
+            raise ValueError(f"Invalid state: [{section}] {spec.state} (expecting {'|'.join(STATES)})")
+        if spec.cpu_policy and spec.cpu_policy not in POLICIES:
+            raise ValueError(f"Invalid cpu_policy: [{section}] {spec.cpu_policy} "
+                             f"(expecting {'|'.join(POLICIES)})")
+        if any(len(u) != 2 for u in spec.users):
+            raise ValueError(f"Invalid users: [{section}] (expecting <user> <pk>)")
+        specs[spec.name] = spec
+    return specs
+
+def plan(specs,actual,epairs,prune=False):
+    """
+        Compute actions needed to move actual state to specs
+
+            actual: {name:dict(running=bool,spec=str,epair=str)} for existing
+                    jails (spec is jail:spec property - "-" if not applied)
+            epairs: set of host interfaces
+
+        Returns {name:[action,...]} (only jails which need changes) - actions
+        for a jail are run in order, jails are independent
+    """
+    actions = {}
+    for (name,spec) in specs.items():
+        a = actual.get(name)
+        if spec.state == "absent":
+            if a:
+                actions[name] = [*(["ddns-del"] if published(a) else []),"destroy"]
+            continue
+        digest = spec.digest()
+        (run,users,_) = digest.split(":")
+        (a_run,a_users,_) = (a["spec"].split(":") + ["","",""])[:3] if a else ("","","")
+        steps = []
+        if not a:
+            steps.append("create")
+        if a_users != users and (spec.users or spec.wheel):
+            steps.append("users")
+        running = a and a["running"]
+        if spec.state == "running":
+            if not running:
+                steps.append("start")
+            elif a_run != run and a["spec"] != "-":
+                # (Jails not previously applied are adopted without restart)
+                steps.append("restart")
+        elif running:
+            steps.append("stop")
+        elif a and a["epair"] in epairs:
+            # Stale epair left by jail which was not stopped cleanly
+            steps.append("cleanup")
+        was_published = published(a)
+        if spec.ddns and spec.state == "running" and (not was_published or "start" in steps):
+            steps.append("ddns-add")
+        elif was_published and not (spec.ddns and spec.state == "running"):
+            steps.append("ddns-del")
+        if steps or (a and a["spec"] != digest):
+            actions[name] = [*steps,"record"]
+    if prune:
+        for name in actual:
+            if name not in specs:
+                actions[name] = [*(["ddns-del"] if published(actual[name]) else []),"destroy"]
+    return actions
+
+def published(a):
+    # DDNS record published by previous apply (a is actual state or None)
+    return bool(a) and a["spec"].endswith(":1")
@@ -0,0 +1,199 @@
+
+import json,os,os.path,threading
+
+from .counter import locked_fd
+
+# Histogram upper bounds - phase durations (seconds) and commands per phase
+DURATION_BUCKETS = (0.005,0.01,0.025,0.05,0.1,0.25,0.5,1.0,2.5,5.0,10.0,30.0,60.0,300.0)
+COMMAND_BUCKETS = (0,1,2,3,5,8,13,21,34,55)
+
+class Histogram:
+
+    """
+        Cumulative histogram (Prometheus semantics - bucket counts include
+        all observations <= le, plus implicit +Inf bucket == count)
+    """
+
+    def __init__(self,buckets,counts=None,count=0,sum=0.0):
+        self.buckets = buckets
+        self.counts = list(counts) if counts else [0] * len(buckets)
+        self.count = count
+        self.sum = sum
+
+    def observe(self,value):
+        for (i,le) in enumerate(self.buckets):
+            if value <= le:
+                self.counts[i] += 1
+        self.count += 1
+        self.sum += value
+
+    def merge(self,other):
+        for i in range(len(self.buckets)):
+            self.counts[i] += other.counts[i]
+        self.count += other.count
+        self.sum += other.sum
+
+    def quantile(self,q):
+        # Estimate from bucket bounds (upper bound of bucket containing q)
+        if not self.count:
+            return None
+        rank = q * self.count
+        for (le,n) in zip(self.buckets,self.counts):
+            if n >= rank:
+                return le
+        return float("inf")
+
+    def to_dict(self):
+        return dict(counts=self.counts,count=self.count,sum=self.sum)
+
+    @classmethod
+    def from_dict(cls,buckets,d):
+        return cls(buckets,d["counts"],d["count"],d["sum"])
+
+class Metrics:
+
+    """
+        Per-phase lifecycle metrics (duration and number of commands run)
+        recorded by StepTimer, keyed by (operation,phase).
+
+        Observations are held in memory and merged into the JSON state file
+        by flush() (under an exclusive lock so that concurrent v6 processes
+        accumulate correctly). If textfile is set a Prometheus exposition
+        file is (atomically) rewritten from the merged state for the
+        node_exporter textfile collector
+    """
+
+    def __init__(self,state,textfile=""):
+        self.state = state
+        self.textfile = textfile
+        self.lock = threading.Lock()
+        # lockf() only excludes other processes - serialise flush() threads
+        self.flush_lock = threading.Lock()
+        self.phases = {}
+        self.errors = {}
+
+    @classmethod
+    def from_config(cls,config):
+        # Returns None if metrics are disabled
+        if config.metrics:
+            return cls(config.metrics,config.metrics_textfile)
+        return None
+
+    def observe(self,operation,phase,elapsed,cmds):
+        key = (operation or "-",phase)
+        with self.lock:
+            if key not in self.phases:
+                self.phases[key] = (Histogram(DURATION_BUCKETS),Histogram(COMMAND_BUCKETS))
+            (duration,commands) = self.phases[key]
+            duration.observe(elapsed)
+            commands.observe(cmds)
+
+    def error(self,operation):
+        with self.lock:
+            self.errors[operation] = self.errors.get(operation,0) + 1
+
+    def _take(self):
+        with self.lock:
+            (phases,errors) = (self.phases,self.errors)
+            (self.phases,self.errors) = ({},{})
+        return (phases,errors)
+
+    def flush(self):
+        """
+            Merge observations into state file and rewrite textfile.
+            Returns merged state
+        """
+        (phases,errors) = self._take()
+        if not (phases or errors) and os.path.exists(self.state):
+            return self.load()
+        os.makedirs(os.path.dirname(self.state) or ".",exist_ok=True)
+        with self.flush_lock, locked_fd(self.state) as fd:
+            data = b""
+            while chunk := os.read(fd,1<<16):
+                data += chunk
+            state = self.decode(data)
+            for ((operation,phase),(duration,commands)) in phases.items():
+                p = state["phases"].setdefault(operation,{}).get(phase)
+                if p:
+                    duration.merge(Histogram.from_dict(DURATION_BUCKETS,p["duration"]))
+                    commands.merge(Histogram.from_dict(COMMAND_BUCKETS,p["commands"]))
+                state["phases"][operation][phase] = dict(duration=duration.to_dict(),
+                                                         commands=commands.to_dict())
+            for (operation,n) in errors.items():
+                state["errors"][operation] = state["errors"].get(operation,0) + n
+            out = json.dumps(state,indent=1).encode()
+            os.lseek(fd,0,os.SEEK_SET)
+            os.write(fd,out)
+            os.ftruncate(fd,len(out))
+            if self.textfile:
+                self.write_textfile(state)
+        return state
+
+    def decode(self,data):
+        state = json.loads(data) if data.strip() else {}
+        state.setdefault("phases",{})
+        state.setdefault("errors",{})
+        return state
+
+    def load(self):
+        try:
+            with open(self.state,"rb") as f:
+                return self.decode(f.read())
+        except FileNotFoundError:
+            return self.decode(b"")
+
+    def write_textfile(self,state):
+        # Write to temp file and rename (collector may read concurrently)
+        tmp = f"{self.textfile}.{os.getpid()}.tmp"
+        with open(tmp,"w") as f:
+            f.write(prometheus(state))
+        os.replace(tmp,self.textfile)
+
+def _histograms(state):
+    for (operation,phases) in sorted(state["phases"].items()):
+        for (phase,p) in sorted(phases.items()):
+            yield (operation,phase,
+                   Histogram.from_dict(DURATION_BUCKETS,p["duration"]),
+                   Histogram.from_dict(COMMAND_BUCKETS,p["commands"]))
+
+def summary(state):
+    """
+        Summarise state as {operation:{phase:{...}}} (quantiles are
+        estimated from the histogram buckets)
+    """
+    out = {}
+    for (operation,phase,duration,commands) in _histograms(state):
+        out.setdefault(operation,{})[phase] = dict(
+                count=duration.count,
+                mean=duration.sum / duration.count if duration.count else None,
+                p50=duration.quantile(0.5),
+                p90=duration.quantile(0.9),
+                p99=duration.quantile(0.99),
+                cmds=commands.sum / commands.count if commands.count else None)
+    return dict(phases=out,errors=state["errors"])
+
+def _le(v):
+    return f"{v:g}"
+
+def prometheus(state):
+    """
+        Render state in Prometheus text exposition format
+    """
+    lines = []
+    for (metric,help,index) in (("v6jail_phase_duration_seconds","Lifecycle phase duration",2),
+                                ("v6jail_phase_commands","Commands run per lifecycle phase",3)):
+        lines.append(f"# HELP {metric} {help}")
+        lines.append(f"# TYPE {metric} histogram")
+        for h in _histograms(state):
+            (operation,phase,hist) = (h[0],h[1],h[index])
+            labels = f'operation="{operation}",phase="{phase}"'
+            for (le,n) in zip(hist.buckets,hist.counts):
+                lines.append(f'{metric}_bucket{{{labels},le="{_le(le)}"}} {n}')
+            lines.append(f'{metric}_bucket{{{labels},le="+Inf"}} {hist.count}')
+            lines.append(f"{metric}_sum{{{labels}}} {hist.sum:g}")
+            lines.append(f"{metric}_count{{{labels}}} {hist.count}")
+    lines.append("# HELP v6jail_operation_errors_total Lifecycle operations which raised an error")
+    lines.append("# TYPE v6jail_operation_errors_total counter")
+    for (operation,n) in sorted(state["errors"].items()):
+        lines.append(f'v6jail_operation_errors_total{{operation="{operation}"}} {n}')
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,108 @@
+
+import bisect,collections,threading
+
+from .util import Command
+
+Mount = collections.namedtuple("Mount","device path fstype options")
+
+def _unescape(s):
+    # mount -p uses fstab(5) encoding for spaces/tabs
+    return s.replace("\\040"," ").replace("\\011","\t")
+
+def parse_fstab(text):
+    """
+        Return mount points from fstab(5) contents (in file order - swap
+        and comment lines are skipped)
+    """
+    paths = []
+    for l in text.split("\n"):
+        f = l.split()
+        if len(f) >= 3 and not f[0].startswith("#") and f[1].startswith("/") and f[2] != "swap":
+            paths.append(_unescape(f[1]).rstrip("/") or "/")
+    return paths
+
+class MountTable:
+
+    """
+        Snapshot of the host mount table (single mount -p call) indexed by
+        mount point so that the mounts under a jail root can be found by
+        prefix without re-reading/re-parsing the table. A table can be shared
+        across a bulk stop/remove - unmounts are recorded with remove()
+
+        Each mount point holds a stack of mounts in mount order (mount -p
+        lists stacked mounts bottom first) so the top mount is last
+    """
+
+    def __init__(self,cmd=None):
+        self.cmd = cmd or Command()
+        self.lock = threading.RLock()
+        self.mounts = None
+        self.paths = None
+
+    def list_args(self):
+        return ("/sbin/mount","-p")
+
+    def update(self,out):
+        """
+            Rebuild table from output of list_args() command
+        """
+        mounts = {}
+        for l in out.split("\n"):
+            f = l.split()
+            if len(f) >= 4:
+                m = Mount(_unescape(f[0]),_unescape(f[1]),f[2],f[3])
+                mounts.setdefault(m.path,[]).append(m)
+        with self.lock:
+            self.mounts = mounts
+            self.paths = sorted(mounts)
+
+    def load(self):
+        with self.lock:
+            if self.mounts is None:
+                self.update(self.cmd(*self.list_args()))
+            return self.mounts
+
+    @property
+    def loaded(self):
+        return self.mounts is not None
+
+    def invalidate(self):
+        with self.lock:
+            self.mounts = self.paths = None
+
+    def get(self,path):
+        # Top mount at path (None if not mounted)
+        stack = self.load().get(path)
+        return stack[-1] if stack else None
+
+    def under(self,prefix,include_root=False):
+        """
+            Return mounts below prefix ordered deepest first (ie. in the
+            order they need to be unmounted - stacked mounts are listed
+            once each, top first)
+        """
+        with self.lock:
+            self.load()
+            prefix = prefix.rstrip("/")
+            # Paths starting with prefix + "/" sort between prefix + "/"
+            # and prefix + "0" ("/" < "0")
+            lo = bisect.bisect_left(self.paths,prefix + "/")
+            hi = bisect.bisect_left(self.paths,prefix + "0",lo)
+            paths = self.paths[lo:hi]
+            if include_root and prefix in self.mounts:
+                paths.append(prefix)
+            mounts = [ (i,m) for p in paths for (i,m) in enumerate(self.mounts[p]) ]
+        return [ m for (i,m) in sorted(mounts,key=lambda e:(e[1].path.count("/"),e[1].path,e[0]),
+                                       reverse=True) ]
+
+    def remove(self,*paths):
+        # Each unmount of path removes the top mount
+        with self.lock:
+            if self.mounts is not None:
+                for p in paths:
+                    stack = self.mounts.get(p)
+                    if stack:
+                        stack.pop()
+                        if not stack:
+                            del self.mounts[p]
+                            self.paths.remove(p)
@@ -0,0 +1,95 @@
+
+import configparser,re
+from dataclasses import dataclass,field
+
+# Profile resources -> default rctl(8) action (I/O limits are throttled,
+# other resources denied - for pcpu deny throttles the jail's CPU)
+RESOURCES = {
+    'pcpu':         'deny',
+    'memoryuse':    'deny',
+    'readbps':      'throttle',
+    'writebps':     'throttle',
+    'readiops':     'throttle',
+    'writeiops':    'throttle',
+    'maxproc':      'deny',
+    'openfiles':    'deny',
+}
+
+ACTIONS = ('deny','log','devctl','throttle')
+
+# Max rules per rctl(8) invocation for batched adds
+RULES_PER_CALL = 256
+
+_AMOUNT = re.compile(r'\d+[kmgtpe]?',re.I)
+
+@dataclass
+class RctlProfile:
+
+    """
+        Named resource limits from host config section:
+
+            [rctl build]
+            pcpu = 200
+            memoryuse = 4g
+            readbps = 50m
+            writebps = log=100m
+            maxproc = 512
+            openfiles = 4096
+
+        Values are [action=]amount (pcpu is % of a single CPU) - values
+        can't have trailing comments
+    """
+
+    name:           str
+    limits:         dict = field(default_factory=dict)  # resource -> (action,amount)
+
+    def rules(self,jname):
+        return [ f'jail:{jname}:{r}:{a}={v}' for (r,(a,v)) in self.limits.items() ]
+
+    @classmethod
+    def from_section(cls,name,section):
+        limits = {}
+        for (r,v) in section.items():
+            if r not in RESOURCES:
+                raise ValueError(f"Invalid rctl resource: [rctl {name}] {r} "
+                                 f"(expecting {'|'.join(RESOURCES)})")
+            (action,_,amount) = v.strip().rpartition('=')
+            action = action or RESOURCES[r]
+            if action not in ACTIONS and not action.startswith('sig'):
+                raise ValueError(f"Invalid rctl action: [rctl {name}] {r}={v}")
+            if not _AMOUNT.fullmatch(amount):
+                raise ValueError(f"Invalid rctl amount: [rctl {name}] {r}={v}")
+            limits[r] = (action,amount)
+        return cls(name,limits)
+
+def read_profiles(f):
+    """
+        Read [rctl <name>] sections from config file - returns
+        {name:RctlProfile} (other sections are ignored)
+    """
+    c = configparser.ConfigParser(interpolation=None)
+    c.read_file(f)
+    profiles = {}
+    for section in c.sections():
+        (kind,_,name) = section.partition(' ')
+        if kind == 'rctl' and name.strip():
+            profiles[name.strip()] = RctlProfile.from_section(name.strip(),c[section])
+    return profiles
+
+def batches(jails):
+    """
+        Group jails for batched rctl -a calls - each batch has at most
+        RULES_PER_CALL rules (a jail's rules are not split) and jails
+        without rules are skipped. Yields [(jail,rules),...]
+    """
+    (batch,count) = ([],0)
+    for jail in jails:
+        rules = jail.rctl_rules()
+        if rules:
+            if batch and count + len(rules) > RULES_PER_CALL:
+                yield batch
+                (batch,count) = ([],0)
+            batch.append((jail,rules))
+            count += len(rules)
+    if batch:
+        yield batch
@@ -0,0 +1,85 @@
+
+import threading,time
+
+from .util import Command
+
+class SnapshotIndex:
+
+    """
+        Index of the snapshots of a base dataset (creation time and clone
+        count) ordered by creation. Loaded with a single zfs list on first
+        use and then updated incrementally (add/add_clone) so that creating
+        jails does not re-list snapshots. Call invalidate() if snapshots
+        may have been changed by another process
+    """
+
+    def __init__(self,base_zvol,cmd=None):
+        self.base_zvol = base_zvol
+        self.cmd = cmd or Command()
+        self.lock = threading.RLock()
+        self.snapshots = None
+
+    def list_args(self):
+        return ("/sbin/zfs","list","-Hp","-t","snapshot","-d","1",
+                "-o","name,creation,clones",self.base_zvol)
+
+    def update(self,out):
+        """
+            Rebuild index from output of list_args() command
+        """
+        snapshots = []
+        for l in out.split("\n"):
+            if l:
+                # Output is stripped so empty clones field may be missing
+                (name,creation,*clones) = l.split("\t")
+                clones = [ c for c in ",".join(clones).split(",") if c not in ("","-") ]
+                snapshots.append((int(creation),name,len(clones)))
+        with self.lock:
+            self.snapshots = { name:dict(creation=creation,clones=clones)
+                                    for (creation,name,clones) in sorted(snapshots) }
+
+    def load(self):
+        with self.lock:
+            if self.snapshots is None:
+                self.update(self.cmd(*self.list_args()))
+            return self.snapshots
+
+    @property
+    def loaded(self):
+        return self.snapshots is not None
+
+    def invalidate(self):
+        with self.lock:
+            self.snapshots = None
+
+    def latest(self):
+        snapshots = self.load()
+        if snapshots:
+            return next(reversed(snapshots))
+        raise ValueError(f"No snapshots found: {self.base_zvol}")
+
+    def add(self,snapshot,creation=None):
+        """
+            Record new snapshot (assumed to be the latest)
+        """
+        with self.lock:
+            if self.snapshots is not None:
+                self.snapshots.pop(snapshot,None)
+                self.snapshots[snapshot] = dict(creation=creation or int(time.time()),clones=0)
+
+    def remove(self,*snapshots):
+        with self.lock:
+            if self.snapshots is not None:
+                for s in snapshots:
+                    self.snapshots.pop(s,None)
+
+    def add_clone(self,snapshot,n=1):
+        with self.lock:
+            if self.snapshots is not None and snapshot in self.snapshots:
+                self.snapshots[snapshot]["clones"] += n
+
+    def creation(self,snapshot):
+        return self.load()[snapshot]["creation"]
+
+    def clones(self,snapshot):
+        return self.load()[snapshot]["clones"]
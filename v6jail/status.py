@@ -0,0 +1,25 @@
+
+import json
+
+from .util import Command
+
+# Jail parameters collected by a single jls(8) snapshot
+JLS_PARAMS = ('jid','name','path','vnet','osrelease')
+
+def jls_snapshot(cmd=None):
+    """
+        Return running jails keyed by jname using a single jls(8) call
+        (libxo JSON output)
+    """
+    cmd = cmd or Command()
+    return parse_jls(cmd("/usr/sbin/jls","--libxo=json",*JLS_PARAMS))
+
+def parse_jls(out):
+    if not out:
+        return {}
+    jails = json.loads(out).get("jail-information",{}).get("jail",[])
+    return { j["name"]:j for j in jails }
+
+def is_vnet(j):
+    # jls reports jailsys params numerically (1 = new) but accept string form
+    return str(j.get("vnet")) in ("1","new")
@@ -1,34 +1,228 @@
 
-import subprocess
+import collections,contextlib,functools,json,os,signal,subprocess,threading,time,types
 from dataclasses import dataclass
 
+class SubprocessExecutor:
+
+    """
+        Default executor - runs commands on the host using subprocess
+    """
+
+    def run(self,args,input=None,capture=True):
+        return subprocess.run(args,capture_output=capture,input=input)
+
+    def pipe(self,src,dst,progress=None):
+        if progress is None:
+            # Connect processes directly
+            with subprocess.Popen(src,stdout=subprocess.PIPE) as send:
+                with subprocess.Popen(dst,stdin=send.stdout) as recv:
+                    send.stdout.close()
+                    recv_rc = recv.wait()
+                    if recv_rc != 0:
+                        send.kill()
+                    send_rc = send.wait()
+            return (send_rc,recv_rc)
+        # Copy stream to count bytes - progress(nbytes) called for each chunk
+        with subprocess.Popen(src,stdout=subprocess.PIPE) as send:
+            with subprocess.Popen(dst,stdin=subprocess.PIPE) as recv:
+                total = 0
+                try:
+                    while chunk := send.stdout.read1(1<<20):
+                        recv.stdin.write(chunk)
+                        total += len(chunk)
+                        progress(total)
+                    recv.stdin.close()
+                except BrokenPipeError:
+                    pass
+                recv_rc = recv.wait()
+                if recv_rc != 0:
+                    send.kill()
+                send_rc = send.wait()
+        return (send_rc,recv_rc)
+
+    def stream(self,args,output,timeout=None):
+        # Run with stdout/stderr merged calling output(line) for each line -
+        # the process group is killed after timeout (TimeoutExpired raised)
+        expired = threading.Event()
+        with subprocess.Popen(args,stdin=subprocess.DEVNULL,stdout=subprocess.PIPE,
+                              stderr=subprocess.STDOUT,start_new_session=True) as p:
+            def _kill():
+                expired.set()
+                try:
+                    os.killpg(p.pid,signal.SIGKILL)
+                except ProcessLookupError:
+                    pass
+            timer = threading.Timer(timeout,_kill) if timeout else None
+            if timer:
+                timer.start()
+            try:
+                for line in p.stdout:
+                    output(line)
+                rc = p.wait()
+            finally:
+                if timer:
+                    timer.cancel()
+        if expired.is_set():
+            raise subprocess.TimeoutExpired(args,timeout)
+        return rc
+
+def _stream_result(result,output):
+    # Executor.stream() for executors which only capture output
+    for line in (result.stdout or b"").splitlines(keepends=True):
+        output(line)
+    return result.returncode
+
+def _encode(b):
+    return b.decode('utf8','surrogateescape') if b is not None else None
+
+def _decode(s):
+    return s.encode('utf8','surrogateescape') if s is not None else None
+
+class RecordExecutor:
+
+    """
+        Wrap executor and append each command/result to a JSON-lines file
+        which can be used by ReplayExecutor
+    """
+
+    def __init__(self,path,executor=None):
+        self.path = path
+        self.executor = executor or SubprocessExecutor()
+        self.lock = threading.Lock()
+
+    def _record(self,**entry):
+        with self.lock:
+            with open(self.path,'a') as f:
+                f.write(json.dumps(entry) + '\n')
+
+    def run(self,args,input=None,capture=True):
+        result = self.executor.run(args,input=input,capture=capture)
+        self._record(args=list(args),input=_encode(input),
+                     returncode=result.returncode,
+                     stdout=_encode(result.stdout),stderr=_encode(result.stderr))
+        return result
+
+    def pipe(self,src,dst,progress=None):
+        (send_rc,recv_rc) = self.executor.pipe(src,dst,progress)
+        self._record(args=[*src,'|',*dst],returncode=[send_rc,recv_rc])
+        return (send_rc,recv_rc)
+
+    def stream(self,args,output,timeout=None):
+        lines = []
+        def _output(line):
+            lines.append(line)
+            output(line)
+        rc = self.executor.stream(args,_output,timeout)
+        self._record(args=list(args),input=None,returncode=rc,
+                     stdout=_encode(b"".join(lines)),stderr=None)
+        return rc
+
+class ReplayExecutor:
+
+    """
+        Replay results recorded by RecordExecutor. Results are matched on
+        command arguments (in recorded order for repeated commands) so that
+        replay is not sensitive to the interleaving of concurrent operations
+    """
+
+    def __init__(self,path):
+        self.results = {}
+        self.lock = threading.Lock()
+        with open(path) as f:
+            for l in f:
+                entry = json.loads(l)
+                self.results.setdefault(tuple(entry['args']),[]).append(entry)
+
+    def _next(self,args):
+        with self.lock:
+            try:
+                return self.results[tuple(args)].pop(0)
+            except (KeyError,IndexError):
+                raise ValueError(f"No recorded result: {' '.join(args)}")
+
+    def run(self,args,input=None,capture=True):
+        entry = self._next(args)
+        return subprocess.CompletedProcess(args,entry['returncode'],
+                                           _decode(entry['stdout']),
+                                           _decode(entry['stderr']))
+
+    def pipe(self,src,dst,progress=None):
+        return tuple(self._next([*src,'|',*dst])['returncode'])
+
+    def stream(self,args,output,timeout=None):
+        return _stream_result(self.run(args),output)
+
+_executor = None
+
+def executor_from_env():
+    """
+        Select executor from V6JAIL_EXECUTOR environment variable:
+
+            fake[:<state.json>] | record:<file> | replay:<file>
+    """
+    spec = os.environ.get('V6JAIL_EXECUTOR','')
+    kind,_,arg = spec.partition(':')
+    if kind == 'fake':
+        from .fake import FakeFreeBSD
+        return FakeFreeBSD(state=arg or None)
+    elif kind == 'record':
+        return RecordExecutor(arg)
+    elif kind == 'replay':
+        return ReplayExecutor(arg)
+    elif kind == '':
+        return SubprocessExecutor()
+    else:
+        raise ValueError(f"Invalid executor: {spec}")
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        _executor = executor_from_env()
+    return _executor
+
+def set_executor(executor):
+    global _executor
+    _executor = executor
+
 @dataclass
 class Command:
 
     debug: bool = False
+    executor: object = None
+    count: int = 0
+
+    def _print_out(self,args,out):
+        if self.debug:
+            print("CMD:",args)
+            if out:
+                print("\n".join([f"   | {l}" for l in out.split("\n")]))
+
+    def _print_err(self,args,err):
+        if self.debug:
+            print("ERR:",args)
+            if err:
+                print("\n".join([f"   ! {l}" for l in err.split("\n")]))
+
+    def run(self,*args,input=None,capture=True,check=True):
+        executor = self.executor or get_executor()
+        self.count += 1
+        result = executor.run(args,input=input,capture=capture)
+        if check and result.returncode != 0:
+            raise subprocess.CalledProcessError(result.returncode,args,
+                                                result.stdout,result.stderr)
+        return result
 
     def cmd(self,*args,input=None):
         try:
-            result = subprocess.run(args,capture_output=True,check=True,input=input)
+            result = self.run(*args,input=input)
             out = result.stdout.strip().decode()
-            if self.debug:
-                print("CMD:",args)
-                if out:
-                    print("\n".join([f"   | {l}" for l in out.split("\n")]))
+            self._print_out(args,out)
             return out
         except (PermissionError,FileNotFoundError) as e:
-            if self.debug:
-                err = e.strerror
-                print("ERR:",args)
-                if err:
-                    print("\n".join([f"   ! {l}" for l in err.split("\n")]))
+            self._print_err(args,e.strerror)
             raise
         except subprocess.CalledProcessError as e:
-            if self.debug:
-                err = e.stderr.strip().decode("utf8","ignore")
-                print("ERR:",args)
-                if err:
-                    print("\n".join([f"   ! {l}" for l in err.split("\n")]))
+            self._print_err(args,e.stderr.strip().decode("utf8","ignore") if e.stderr else '')
             raise
 
     __call__ = cmd
@@ -46,3 +240,151 @@ class Command:
         except subprocess.CalledProcessError:
             pass
 
+    def pipe(self,src,dst,progress=None):
+        executor = self.executor or get_executor()
+        self.count += 1
+        if self.debug:
+            print("CMD:",(*src,'|',*dst))
+        return executor.pipe(src,dst,progress)
+
+    def stream(self,*args,output,timeout=None):
+        """
+            Run command calling output(line) for each line of (merged)
+            stdout/stderr as it is produced - returns exit status or raises
+            subprocess.TimeoutExpired
+        """
+        executor = self.executor or get_executor()
+        self.count += 1
+        if self.debug:
+            print("CMD:",args)
+        return executor.stream(args,output,timeout)
+
+    # Ops (see op) are driven by the command object - Command runs them
+    # inline (each yielded value is already the command result) and
+    # AsyncCommand as coroutines
+
+    def drive(self,gen):
+        return run_sync(gen)
+
+    def sync(self):
+        # Blocking command for shared state objects (indexes/placement)
+        return self
+
+    def blocking(self,f,*args):
+        # Run blocking (non-command) call from op
+        return f(*args)
+
+    def locked(self,lock,f):
+        # Run f() holding threading lock
+        with lock:
+            return f()
+
+    def gather(self,*results):
+        # Concurrent commands - run in argument order inline
+        return results
+
+    def bulk(self,f,names,workers=8):
+        from .bulk import run_bulk
+        return run_bulk(f,names,workers)
+
+def run_sync(gen):
+    # Run op generator to completion (sync driver)
+    value = None
+    try:
+        while True:
+            value = gen.send(value)
+    except StopIteration as e:
+        return e.value
+
+def op(f):
+    """
+        Decorator - f is a generator which yields the result of each command
+        (out = yield self.cmd(...)) or nested op (yield self.start()) and is
+        run by self.cmd.drive(). With Command the op runs inline and returns
+        its result, with AsyncCommand it returns a coroutine - so that the
+        same logic is shared by the sync and asyncio classes
+    """
+    @functools.wraps(f)
+    def _wrapper(self,*args,**kwargs):
+        return self.cmd.drive(f(self,*args,**kwargs))
+    return _wrapper
+
+def op_body(result):
+    # Delegate to op generator (plain method results are returned as is) -
+    # use from decorators wrapping ops: return (yield from op_body(f(...)))
+    if isinstance(result,types.GeneratorType):
+        return (yield from result)
+    return result
+
+# Number of steps retained by StepTimer (Host timers are long lived)
+STEP_HISTORY = 1024
+
+@dataclass
+class Step:
+
+    name:           str
+    elapsed:        float
+    cmds:           int
+
+class StepTimer:
+
+    """
+        Record elapsed time and number of commands run for named steps
+
+            with jail.steps("epair"):
+                ...
+
+        Steps run within an operation (see timed) are also passed to
+        metrics.observe(operation,step,elapsed,cmds) if metrics is set
+    """
+
+    def __init__(self,cmd,metrics=None):
+        self.cmd = cmd
+        self.metrics = metrics
+        self.operation = None
+        self.steps = collections.deque(maxlen=STEP_HISTORY)
+
+    @contextlib.contextmanager
+    def __call__(self,name):
+        (start,count) = (time.perf_counter(),self.cmd.count)
+        try:
+            yield
+        finally:
+            step = Step(name,time.perf_counter()-start,self.cmd.count-count)
+            self.steps.append(step)
+            if self.metrics is not None:
+                self.metrics.observe(self.operation,name,step.elapsed,step.cmds)
+
+    @contextlib.contextmanager
+    def op(self,operation):
+        # Group steps under operation (total recorded as "total" step)
+        (previous,self.operation) = (self.operation,operation)
+        try:
+            with self("total"):
+                yield
+        except Exception:
+            if self.metrics is not None:
+                self.metrics.error(operation)
+            raise
+        finally:
+            self.operation = previous
+
+    def report(self):
+        return [ dict(step=s.name,cmds=s.cmds,elapsed=f"{s.elapsed*1000:.1f}ms") for s in self.steps ]
+
+def timed(operation):
+    """
+        Decorator - run op as StepTimer operation (self.steps)
+
+            @op
+            @timed("start")
+            def start(self):
+                ...
+    """
+    def _decorator(f):
+        @functools.wraps(f)
+        def _wrapper(self,*args,**kwargs):
+            with self.steps.op(operation):
+                return (yield from op_body(f(self,*args,**kwargs)))
+        return _wrapper
+    return _decorator